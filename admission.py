@@ -0,0 +1,121 @@
+"""Контроль допуска для запросов, нагружающих модель.
+
+Без ограничения всплеск /final_results запускает одновременно десятки проходов
+модели: замедляются все запросы и растет потребление памяти. AdmissionController
+пропускает не более max_concurrency запросов одновременно, остальные ждут в
+очереди ограниченной длины не дольше queue_timeout. При переполненной очереди
+или истечении ожидания запрос сразу отклоняется с OverloadedError (в приложении -
+ответ 503 с заголовком Retry-After), а время ответа принятых запросов остается
+предсказуемым.
+
+Фоновая работа (оценка ответа при сохранении) входит через admit(wait=False):
+она занимает только свободное место, в очереди не ждет и при нехватке мест
+откладывается, не вытесняя запросы пользователей.
+"""
+
+import asyncio
+import threading
+import time
+from contextlib import asynccontextmanager
+
+
+class OverloadedError(Exception):
+    """Сервер перегружен, запрос нужно повторить позже"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Семафор одновременных запросов с ограниченной очередью ожидания"""
+
+    def __init__(self, max_concurrency: int, max_queue: int, queue_timeout: float, retry_after: int = 5):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+
+        self._semaphore = None
+        self._loop = None
+
+        # Метрики
+        self._stats_lock = threading.Lock()
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.declined = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Семафор привязан к циклу событий (например, после fork воркера)
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self.active = 0
+            self.waiting = 0
+        return self._semaphore
+
+    @asynccontextmanager
+    async def admit(self, wait: bool = True):
+        """Занимает место для запроса или выбрасывает OverloadedError.
+
+        С wait=False место занимается, только если оно свободно сейчас; иначе
+        OverloadedError выбрасывается сразу, без постановки в очередь.
+        """
+        semaphore = self._get_semaphore()
+        if not wait and (semaphore.locked() or self.waiting):
+            with self._stats_lock:
+                self.declined += 1
+            raise OverloadedError("Нет свободных мест для фоновой проверки", self.retry_after)
+        # Мест нет ни среди выполняемых, ни в очереди - отказываем сразу
+        if self.active + self.waiting >= self.max_concurrency + self.max_queue:
+            with self._stats_lock:
+                self.rejected += 1
+            raise OverloadedError("Очередь проверки переполнена", self.retry_after)
+
+        started = time.perf_counter()
+        self.waiting += 1
+        try:
+            if semaphore.locked():
+                await asyncio.wait_for(semaphore.acquire(), self.queue_timeout)
+            else:
+                await semaphore.acquire()
+        except asyncio.TimeoutError:
+            with self._stats_lock:
+                self.timed_out += 1
+            raise OverloadedError("Превышено время ожидания в очереди проверки", self.retry_after)
+        finally:
+            self.waiting -= 1
+
+        waited = time.perf_counter() - started
+        with self._stats_lock:
+            self.admitted += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            semaphore.release()
+
+    def stats(self) -> dict:
+        """Счетчики допуска для мониторинга"""
+        with self._stats_lock:
+            return {
+                "active": self.active,
+                "queue_depth": self.waiting,
+                "max_concurrency": self.max_concurrency,
+                "max_queue": self.max_queue,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+                "declined": self.declined,
+                "avg_wait_ms": 1000.0 * self.total_wait / self.admitted if self.admitted else 0.0,
+                "max_wait_ms": 1000.0 * self.max_wait,
+            }
@@ -5,10 +5,11 @@ from fastapi.responses import RedirectResponse
 import random
 import string
 import pandas as pd
-import sqlite3
 from io import StringIO
-from database import init_db, get_db_connection
+from database import init_db, get_db_connection, run_db, fetch_all, fetch_one
 from models import UserCreate, UserUpdate
+from session_manager import revoke_user_sessions
+from identity import get_template_context, invalidate_user
 import hashlib
 
 app = FastAPI(title="User Registration System")
@@ -25,89 +26,6 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Проверяет пароль"""
     return hash_password(plain_password) == hashed_password
 
-def get_user_from_session(request: Request) -> str:
-    """Получает пользователя из сессии"""
-    session_token = request.cookies.get("session_token")
-    if session_token:
-        # Импортируем функцию из основного приложения для получения пользователя из сессии
-        try:
-            from session_manager import get_user_from_session as get_session_user
-            return get_session_user(session_token)
-        except ImportError:
-            # Если session_manager недоступен, возвращаем None
-            return None
-    return None
-
-def get_user_by_login(login: str):
-    """Получает пользователя из базы данных по логину"""
-    conn = sqlite3.connect('users.db')
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT id, user_type, last_name, first_name, middle_name, group_name, login, password, created_at 
-        FROM users WHERE login = ?
-    """, (login,))
-    user = cursor.fetchone()
-    conn.close()
-    
-    if user:
-        return {
-            "id": user[0],
-            "user_type": user[1],
-            "last_name": user[2],
-            "first_name": user[3],
-            "middle_name": user[4],
-            "group_name": user[5],
-            "login": user[6],
-            "password": user[7],  # Внимание: хранится в открытом виде!
-            "created_at": user[8]
-        }
-    return None
-
-def get_user_full_info(login: str):
-    """Получает полную информацию о пользователе для отображения"""
-    user = get_user_by_login(login)
-    if user:
-        # Формируем полное имя
-        full_name = f"{user['last_name']} {user['first_name']}"
-        if user['middle_name']:
-            full_name += f" {user['middle_name']}"
-        
-        return {
-            "login": user['login'],
-            "full_name": full_name,
-            "user_type": user['user_type'],
-            "group_name": user['group_name'],
-            "created_at": user['created_at']
-        }
-    return None
-
-def get_user_permissions(user_type: str):
-    """Возвращает доступные права пользователя"""
-    permissions = {
-        'can_view_tests': True,  # Все могут видеть тесты
-        'can_take_tests': True,  # Все могут проходить тесты
-        'can_upload_files': user_type in ['teacher', 'admin'],  # Только преподаватели и админы могут загружать файлы
-        'can_delete_files': user_type in ['teacher', 'admin'],  # Только преподаватели и админы могут удалять файлы
-        'can_manage_users': user_type == 'admin',  # Только админы могут управлять пользователями
-        'can_edit_tests': user_type in ['teacher', 'admin'],  # Только преподаватели и админы могут редактировать тесты
-    }
-    return permissions
-
-def get_template_context(request: Request):
-    """Возвращает контекст для шаблонов с информацией о пользователе"""
-    login = get_user_from_session(request)
-    if login:
-        user_info = get_user_full_info(login)
-        user_permissions = get_user_permissions(user_info['user_type'])
-        return {
-            "user_info": user_info,
-            "user_permissions": user_permissions
-        }
-    return {
-        "user_info": None,
-        "user_permissions": None
-    }
-
 # Настройка шаблонов и статических файлов
 templates = Jinja2Templates(directory="templatesrg")
 app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -218,15 +136,82 @@ def save_user_to_db(user_data: dict) -> dict:
             "exists": False
         }
 
+def import_users(df) -> dict:
+    """Проверяет строки загруженной таблицы и сохраняет новых пользователей"""
+    results = {
+        'successful': 0,
+        'failed': 0,
+        'exists': 0,
+        'errors': [],
+        'existing_users': []
+    }
+    
+    # Обрабатываем каждую строку
+    for index, row in df.iterrows():
+        try:
+            # Подготовка данных
+            user_data = {
+                'user_type': str(row['user_type']).strip().lower(),
+                'last_name': str(row['last_name']).strip(),
+                'first_name': str(row['first_name']).strip(),
+                'middle_name': str(row['middle_name']).strip() if 'middle_name' in df.columns and pd.notna(row.get('middle_name')) else None,
+                'group_name': str(row['group_name']).strip() if 'group_name' in df.columns and pd.notna(row.get('group_name')) else None
+            }
+            
+            # Проверка типа пользователя
+            if user_data['user_type'] not in ['teacher', 'student']:
+                raise ValueError("Тип пользователя должен быть 'teacher' или 'student'")
+            
+            # Проверка обязательных полей
+            if not user_data['last_name'] or not user_data['first_name']:
+                raise ValueError("Фамилия и имя обязательны для заполнения")
+            
+            # Для студентов проверяем группу
+            if user_data['user_type'] == 'student' and not user_data['group_name']:
+                raise ValueError("Для студента обязательно указание группы")
+            
+            # Проверяем, существует ли пользователь
+            if user_exists(
+                user_data['last_name'],
+                user_data['first_name'],
+                user_data['middle_name'],
+                user_data['user_type']
+            ):
+                results['exists'] += 1
+                results['existing_users'].append(
+                    f"{user_data['last_name']} {user_data['first_name']} {user_data['middle_name'] or ''} - уже существует"
+                )
+                continue
+            
+            # Генерация логина и пароля
+            user_data['login'] = generate_login(
+                user_data['last_name'], 
+                user_data['first_name'], 
+                user_data['middle_name']
+            )
+            user_data['password'] = generate_password()
+            
+            # Сохранение в базу
+            result = save_user_to_db(user_data)
+            
+            if not result.get('exists'):
+                results['successful'] += 1
+            
+        except Exception as e:
+            results['failed'] += 1
+            results['errors'].append(f"Строка {index + 2}: {str(e)}")
+    
+    return results
+
 @app.get("/")
 async def home(request: Request):
-    context = get_template_context(request)
+    context = await run_db(get_template_context, request)
     context["request"] = request
     return templates.TemplateResponse("index.html", context)
 
 @app.get("/register")
 async def show_registration_form(request: Request):
-    context = get_template_context(request)
+    context = await run_db(get_template_context, request)
     context["request"] = request
     return templates.TemplateResponse("register.html", context)
 
@@ -254,8 +239,8 @@ async def register_user(
     }
     
     # Проверяем, существует ли пользователь
-    if user_exists(last_name, first_name, middle_name, user_type):
-        context = get_template_context(request)
+    if await run_db(user_exists, last_name, first_name, middle_name, user_type):
+        context = await run_db(get_template_context, request)
         context.update({
             "request": request,
             "error": f"Пользователь {last_name} {first_name} {middle_name or ''} уже существует в системе"
@@ -263,13 +248,13 @@ async def register_user(
         return templates.TemplateResponse("register.html", context)
     
     # Сохраняем пользователя
-    result = save_user_to_db(user_data)
+    result = await run_db(save_user_to_db, user_data)
     
     return RedirectResponse(url="/users", status_code=303)
 
 @app.get("/upload")
 async def show_upload_form(request: Request):
-    context = get_template_context(request)
+    context = await run_db(get_template_context, request)
     context["request"] = request
     return templates.TemplateResponse("upload.html", context)
 
@@ -302,70 +287,10 @@ async def upload_users_file(request: Request, file: UploadFile = File(...)):
                 detail=f"Отсутствуют обязательные колонки: {', '.join(missing_columns)}"
             )
         
-        results = {
-            'successful': 0,
-            'failed': 0,
-            'exists': 0,
-            'errors': [],
-            'existing_users': []
-        }
+        # Проверки и запись в базу выполняются в пуле потоков базы
+        results = await run_db(import_users, df)
         
-        # Обрабатываем каждую строку
-        for index, row in df.iterrows():
-            try:
-                # Подготовка данных
-                user_data = {
-                    'user_type': str(row['user_type']).strip().lower(),
-                    'last_name': str(row['last_name']).strip(),
-                    'first_name': str(row['first_name']).strip(),
-                    'middle_name': str(row['middle_name']).strip() if 'middle_name' in df.columns and pd.notna(row.get('middle_name')) else None,
-                    'group_name': str(row['group_name']).strip() if 'group_name' in df.columns and pd.notna(row.get('group_name')) else None
-                }
-                
-                # Проверка типа пользователя
-                if user_data['user_type'] not in ['teacher', 'student']:
-                    raise ValueError("Тип пользователя должен быть 'teacher' или 'student'")
-                
-                # Проверка обязательных полей
-                if not user_data['last_name'] or not user_data['first_name']:
-                    raise ValueError("Фамилия и имя обязательны для заполнения")
-                
-                # Для студентов проверяем группу
-                if user_data['user_type'] == 'student' and not user_data['group_name']:
-                    raise ValueError("Для студента обязательно указание группы")
-                
-                # Проверяем, существует ли пользователь
-                if user_exists(
-                    user_data['last_name'],
-                    user_data['first_name'],
-                    user_data['middle_name'],
-                    user_data['user_type']
-                ):
-                    results['exists'] += 1
-                    results['existing_users'].append(
-                        f"{user_data['last_name']} {user_data['first_name']} {user_data['middle_name'] or ''} - уже существует"
-                    )
-                    continue
-                
-                # Генерация логина и пароля
-                user_data['login'] = generate_login(
-                    user_data['last_name'], 
-                    user_data['first_name'], 
-                    user_data['middle_name']
-                )
-                user_data['password'] = generate_password()
-                
-                # Сохранение в базу
-                result = save_user_to_db(user_data)
-                
-                if not result.get('exists'):
-                    results['successful'] += 1
-                
-            except Exception as e:
-                results['failed'] += 1
-                results['errors'].append(f"Строка {index + 2}: {str(e)}")
-        
-        context = get_template_context(request)
+        context = await run_db(get_template_context, request)
         context.update({
             "request": request,
             "results": results,
@@ -385,51 +310,48 @@ async def list_users(
     search: str = "",
     group_filter: str = ""
 ):
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        
-        # Базовый запрос
-        query = "SELECT * FROM users WHERE 1=1"
-        params = []
-        
-        # Фильтрация по типу пользователя
-        if user_type != "all":
-            query += " AND user_type = ?"
-            params.append(user_type)
-        
-        # Фильтрация по группе
-        if group_filter:
-            query += " AND group_name = ?"
-            params.append(group_filter)
-        
-        # Поиск
-        if search:
-            query += " AND (last_name LIKE ? OR first_name LIKE ? OR middle_name LIKE ? OR group_name LIKE ? OR login LIKE ?)"
-            search_term = f"%{search}%"
-            params.extend([search_term, search_term, search_term, search_term, search_term])
-        
-        # Сортировка
-        if sort_by == "alphabet":
-            query += " ORDER BY last_name, first_name, middle_name"
-        elif sort_by == "newest":
-            query += " ORDER BY created_at DESC"
-        elif sort_by == "oldest":
-            query += " ORDER BY created_at ASC"
-        elif sort_by == "group":
-            query += " ORDER BY group_name, last_name, first_name"
-        
-        cursor.execute(query, params)
-        users = cursor.fetchall()
-        
-        # Получаем список всех групп для фильтра
-        cursor.execute("SELECT DISTINCT group_name FROM users WHERE group_name IS NOT NULL AND group_name != '' ORDER BY group_name")
-        groups = [row['group_name'] for row in cursor.fetchall()]
+    # Базовый запрос
+    query = "SELECT * FROM users WHERE 1=1"
+    params = []
+    
+    # Фильтрация по типу пользователя
+    if user_type != "all":
+        query += " AND user_type = ?"
+        params.append(user_type)
+    
+    # Фильтрация по группе
+    if group_filter:
+        query += " AND group_name = ?"
+        params.append(group_filter)
+    
+    # Поиск
+    if search:
+        query += " AND (last_name LIKE ? OR first_name LIKE ? OR middle_name LIKE ? OR group_name LIKE ? OR login LIKE ?)"
+        search_term = f"%{search}%"
+        params.extend([search_term, search_term, search_term, search_term, search_term])
+    
+    # Сортировка
+    if sort_by == "alphabet":
+        query += " ORDER BY last_name, first_name, middle_name"
+    elif sort_by == "newest":
+        query += " ORDER BY created_at DESC"
+    elif sort_by == "oldest":
+        query += " ORDER BY created_at ASC"
+    elif sort_by == "group":
+        query += " ORDER BY group_name, last_name, first_name"
+    
+    users = await fetch_all(query, params)
+    
+    # Получаем список всех групп для фильтра
+    groups = [row['group_name'] for row in await fetch_all(
+        "SELECT DISTINCT group_name FROM users WHERE group_name IS NOT NULL AND group_name != '' ORDER BY group_name"
+    )]
     
     # Разделение пользователей на преподавателей и студентов
     teachers = [dict(user) for user in users if user['user_type'] == 'teacher']
     students = [dict(user) for user in users if user['user_type'] == 'student']
     
-    context = get_template_context(request)
+    context = await run_db(get_template_context, request)
     context.update({
         "request": request,
         "teachers": teachers,
@@ -445,15 +367,12 @@ async def list_users(
 
 @app.get("/users/{user_id}/edit")
 async def edit_user_form(request: Request, user_id: int):
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
-        user = cursor.fetchone()
-        
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found")
+    user = await fetch_one("SELECT * FROM users WHERE id = ?", (user_id,))
     
-    context = get_template_context(request)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    context = await run_db(get_template_context, request)
     context.update({
         "request": request,
         "user": dict(user)
@@ -485,13 +404,28 @@ async def update_user(user_id: int, request: Request):
     
     if update_fields:
         update_values.append(user_id)
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                f"UPDATE users SET {', '.join(update_fields)} WHERE id = ?",
-                update_values
-            )
-            conn.commit()
+        
+        def apply_update():
+            with get_db_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT login, password FROM users WHERE id = ?", (user_id,))
+                old_user = cursor.fetchone()
+                cursor.execute(
+                    f"UPDATE users SET {', '.join(update_fields)} WHERE id = ?",
+                    update_values
+                )
+                conn.commit()
+                return old_user
+        
+        old_user = await run_db(apply_update)
+        
+        # Смена логина или пароля завершает сессии пользователя
+        if old_user and any(
+            getattr(update_data, field) not in (None, old_user[field]) for field in ("login", "password")
+        ):
+            await run_db(revoke_user_sessions, old_user["login"])
+        if old_user:
+            invalidate_user(old_user["login"], update_data.login)
     
     return RedirectResponse(url="/users", status_code=303)
 
@@ -499,22 +433,42 @@ async def update_user(user_id: int, request: Request):
 async def regenerate_password(user_id: int):
     new_password = generate_password()
     
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE users SET password = ? WHERE id = ?",
-            (new_password, user_id)
-        )
-        conn.commit()
+    def apply_update():
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT login FROM users WHERE id = ?", (user_id,))
+            user = cursor.fetchone()
+            cursor.execute(
+                "UPDATE users SET password = ? WHERE id = ?",
+                (new_password, user_id)
+            )
+            conn.commit()
+            return user
+    
+    user = await run_db(apply_update)
+    if user:
+        await run_db(revoke_user_sessions, user["login"])
+        invalidate_user(user["login"])
     
     return RedirectResponse(url=f"/users/{user_id}/edit", status_code=303)
 
 @app.post("/users/{user_id}/delete")
 async def delete_user(user_id: int):
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM users WHERE id = ?", (user_id,))
-        conn.commit()
+    def apply_delete():
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT login FROM users WHERE id = ?", (user_id,))
+            user = cursor.fetchone()
+            cursor.execute("DELETE FROM users WHERE id = ?", (user_id,))
+            conn.commit()
+            return user
+    
+    user = await run_db(apply_delete)
+    
+    # Токены удаленного пользователя больше не принимаются
+    if user:
+        await run_db(revoke_user_sessions, user["login"])
+        invalidate_user(user["login"])
     
     return RedirectResponse(url="/users", status_code=303)
 
@@ -0,0 +1,130 @@
+"""Микро-батчинг запросов к модели между HTTP-запросами.
+
+Когда группа одновременно завершает тест, каждый запрос /final_results
+кодирует лишь несколько ответов. MicroBatcher собирает такие запросы в течение
+max_wait_ms (или до max_batch предложений), выполняет один проход модели и
+раздает результаты ожидающим запросам.
+"""
+
+import asyncio
+import threading
+import time
+from typing import Callable, List
+
+import numpy as np
+
+import inference
+
+
+class MicroBatcher:
+    """Собирает запросы на кодирование в общие батчи"""
+
+    def __init__(self, encode_fn: Callable[[List[str]], np.ndarray], max_batch: int = 64, max_wait_ms: float = 10.0):
+        self.encode_fn = encode_fn
+        self.max_batch = max_batch
+        self.max_wait_ms = max_wait_ms
+
+        self._pending = []  # (тексты, future, время постановки)
+        self._pending_sentences = 0
+        self._timer = None
+        self._loop = None
+        # Цикл событий держит задачи слабыми ссылками - выполняющиеся батчи храним сами
+        self._tasks = set()
+
+        # Метрики
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        self.requests = 0
+        self.sentences = 0
+        self.max_batch_seen = 0
+        self.total_queue_wait = 0.0
+        self.max_queue_wait = 0.0
+        self.errors = 0
+
+    async def encode(self, texts: List[str]) -> np.ndarray:
+        """Кодирует тексты в составе общего батча"""
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Очередь привязана к циклу событий (например, после fork воркера)
+            self._loop = loop
+            self._pending = []
+            self._pending_sentences = 0
+            self._timer = None
+            self._tasks = set()
+
+        future = loop.create_future()
+        self._pending.append((list(texts), future, time.perf_counter()))
+        self._pending_sentences += len(texts)
+
+        if self._pending_sentences >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait_ms / 1000.0, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+
+        batch = self._pending
+        self._pending = []
+        self._pending_sentences = 0
+        task = self._loop.create_task(self._run_batch(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, batch):
+        started = time.perf_counter()
+        all_texts = [text for texts, _, _ in batch for text in texts]
+        waits = [started - enqueued_at for _, _, enqueued_at in batch]
+
+        with self._stats_lock:
+            self.batches += 1
+            self.requests += len(batch)
+            self.sentences += len(all_texts)
+            self.max_batch_seen = max(self.max_batch_seen, len(all_texts))
+            self.total_queue_wait += sum(waits)
+            self.max_queue_wait = max(self.max_queue_wait, max(waits))
+
+        try:
+            embeddings = np.asarray(await inference.run(self.encode_fn, all_texts), dtype=np.float32)
+        except Exception as e:
+            with self._stats_lock:
+                self.errors += 1
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        # Раздаем срезы результата ожидающим запросам
+        start = 0
+        for texts, future, _ in batch:
+            end = start + len(texts)
+            if not future.done():
+                future.set_result(embeddings[start:end])
+            start = end
+
+    def stats(self) -> dict:
+        """Размеры батчей и время ожидания в очереди"""
+        with self._stats_lock:
+            return {
+                "max_batch": self.max_batch,
+                "max_wait_ms": self.max_wait_ms,
+                "batches": self.batches,
+                "requests": self.requests,
+                "sentences": self.sentences,
+                "avg_batch_size": self.sentences / self.batches if self.batches else 0.0,
+                "max_batch_size": self.max_batch_seen,
+                "avg_queue_wait_ms": 1000.0 * self.total_queue_wait / self.requests if self.requests else 0.0,
+                "max_queue_wait_ms": 1000.0 * self.max_queue_wait,
+                "pending_sentences": self._pending_sentences,
+                "running_batches": len(self._tasks),
+                "errors": self.errors,
+            }
@@ -0,0 +1,148 @@
+"""Калибровка инференса на текущей машине: потоки torch × размер батча.
+
+Команда прогоняет модель по сетке значений, сохраняет замеры в профиль
+(settings.INFERENCE_PROFILE), а сервер при старте выбирает из профиля лучшую
+конфигурацию, которая укладывается в бюджет потоков одного воркера
+(ядра машины / settings.WEB_WORKERS). Число воркеров берется из
+QUIZ_WEB_WORKERS или WEB_CONCURRENCY; serve.py задает его сам, а при запуске
+"uvicorn main:app --workers N" нужно передать WEB_CONCURRENCY=N.
+
+Запуск:
+    python calibrate.py --threads 1,2,4,8 --batch-sizes 8,16,32,64,128
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from typing import List, Optional
+
+import inference
+import settings
+
+# Размер батча sentence-transformers по умолчанию - используется без профиля
+DEFAULT_BATCH_SIZE = 32
+
+_SAMPLE_TEXTS = [
+    "Столица России - Москва",
+    "Вода кипит при температуре сто градусов Цельсия при нормальном давлении",
+    "Функция возвращает значение через оператор return",
+    "Фотосинтез - процесс образования органических веществ на свету",
+    "Первичный ключ однозначно идентифицирует строку таблицы",
+    "Закон Ома: сила тока прямо пропорциональна напряжению",
+]
+
+
+def thread_budget(workers: int) -> int:
+    """Число потоков torch на один воркер, чтобы воркеры не делили ядра"""
+    return max(1, (os.cpu_count() or 1) // max(1, workers))
+
+
+def load_profile(path: str, encoder: str) -> Optional[dict]:
+    """Читает профиль; профиль другого кодировщика или другой машины не используется"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            profile = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if profile.get("encoder") != encoder or profile.get("cpu_count") != os.cpu_count():
+        return None
+    return profile
+
+
+def select(profile: Optional[dict], workers: int) -> dict:
+    """Выбирает лучшую конфигурацию из профиля в пределах бюджета потоков воркера"""
+    budget = thread_budget(workers)
+    results = [r for r in (profile or {}).get("results", []) if r["threads"] <= budget]
+    if not results:
+        return {"threads": budget, "batch_size": DEFAULT_BATCH_SIZE, "source": "default"}
+    best = max(results, key=lambda r: r["texts_per_sec"])
+    return {"threads": best["threads"], "batch_size": best["batch_size"], "source": "profile"}
+
+
+def apply(encoder: str, workers: int) -> dict:
+    """Загружает профиль, задает число потоков torch и возвращает выбранную конфигурацию"""
+    choice = select(load_profile(settings.INFERENCE_PROFILE, encoder), workers)
+    inference.set_threads(choice["threads"])
+    return choice
+
+
+def benchmark(model, texts: List[str], threads_grid: List[int], batch_grid: List[int], repeats: int = 3) -> List[dict]:
+    """Замеряет скорость кодирования для каждой пары (потоки, размер батча)"""
+    results = []
+    for threads in threads_grid:
+        inference.set_threads(threads)
+        for batch_size in batch_grid:
+            model.encode(texts[:batch_size], batch_size=batch_size)  # прогрев
+            timings = []
+            for _ in range(repeats):
+                started = time.perf_counter()
+                model.encode(texts, batch_size=batch_size)
+                timings.append(time.perf_counter() - started)
+            # Медиана устойчивее к разовым помехам на машине
+            elapsed = sorted(timings)[len(timings) // 2]
+            results.append({
+                "threads": threads,
+                "batch_size": batch_size,
+                "texts_per_sec": len(texts) / elapsed,
+            })
+            print(f"threads={threads:<3} batch={batch_size:<4} {len(texts) / elapsed:10.1f} текстов/с")
+    return results
+
+
+def _benchmark_texts(count: int) -> List[str]:
+    from utils import read_quiz_file
+
+    texts = []
+    for file_path in glob.glob(os.path.join("uploaded_files", "*.xlsx")):
+        try:
+            _, reference_answers = read_quiz_file(file_path)
+        except Exception:
+            continue
+        texts.extend(answer for answers in reference_answers for answer in answers)
+    texts = texts or _SAMPLE_TEXTS
+    return [texts[i % len(texts)] for i in range(count)]
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(item) for item in value.split(",") if item.strip()]
+
+
+def main(argv=None):
+    from encoders import encoder_id, load_encoder
+
+    cpu_count = os.cpu_count() or 1
+    default_threads = sorted({1, 2, 4, 8, 16, cpu_count} & set(range(1, cpu_count + 1)))
+
+    parser = argparse.ArgumentParser(description="Подбор числа потоков и размера батча для инференса")
+    parser.add_argument("--threads", type=_int_list, default=default_threads)
+    parser.add_argument("--batch-sizes", type=_int_list, default=[8, 16, 32, 64, 128])
+    parser.add_argument("--texts", type=int, default=256, help="число текстов в одном замере")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--output", default=settings.INFERENCE_PROFILE)
+    args = parser.parse_args(argv)
+
+    encoder = encoder_id(settings.MODEL_NAME, settings.ENCODER_BACKEND)
+    model = load_encoder(settings.MODEL_NAME, settings.ENCODER_BACKEND)
+    results = benchmark(model, _benchmark_texts(args.texts), args.threads, args.batch_sizes, args.repeats)
+
+    profile = {
+        "encoder": encoder,
+        "cpu_count": cpu_count,
+        "created_at": time.time(),
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(profile, f, ensure_ascii=False, indent=2)
+
+    for workers in sorted({1, 2, 4, settings.WEB_WORKERS}):
+        choice = select(profile, workers)
+        print(f"Воркеров {workers}: threads={choice['threads']} batch={choice['batch_size']}")
+    print(f"Профиль сохранен в {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
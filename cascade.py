@@ -0,0 +1,98 @@
+"""Каскадная проверка ответов.
+
+Стадии по возрастанию стоимости:
+    exact         - совпадение с эталоном после нормализации (без модели)
+    semantic      - сходство эмбеддингов bi-encoder с эталонами
+    cross-encoder - переоценка только пограничных ответов, чье сходство
+                    попало в полосу settings.CASCADE_BAND вокруг порога
+
+Дорогая модель вызывается лишь для малой доли ответов, где чаще всего и
+ошибается bi-encoder, поэтому средняя стоимость проверки почти не растет.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Tuple
+
+import numpy as np
+
+STAGES = ("exact", "semantic", "cross-encoder")
+
+
+class CascadeStats:
+    """Число решенных ответов и суммарное время по стадиям"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.decided = {stage: 0 for stage in STAGES}
+        self.seconds = {stage: 0.0 for stage in STAGES}
+        self.calls = {stage: 0 for stage in STAGES}
+
+    @contextmanager
+    def timed(self, stage: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.seconds[stage] += elapsed
+                self.calls[stage] += 1
+
+    def record(self, stage: str, count: int) -> None:
+        with self._lock:
+            self.decided[stage] += count
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                stage: {
+                    "decided": self.decided[stage],
+                    "calls": self.calls[stage],
+                    "total_ms": 1000.0 * self.seconds[stage],
+                    "avg_ms": 1000.0 * self.seconds[stage] / self.calls[stage] if self.calls[stage] else 0.0,
+                }
+                for stage in STAGES
+            }
+
+
+def borderline(score: float, threshold: float, band: float) -> bool:
+    """Попадает ли сходство в полосу неуверенности вокруг порога"""
+    return band > 0 and abs(score - threshold) <= band
+
+
+class CrossEncoderReranker:
+    """Cross-encoder для пограничных ответов; модель загружается при первом обращении"""
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self._model = None
+        self._lock = threading.Lock()
+
+    def _get_model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    from sentence_transformers import CrossEncoder
+                    self._model = CrossEncoder(self.model_name, device="cpu")
+        return self._model
+
+    def best_scores(self, items: List[Tuple[str, List[str]]]) -> List[Tuple[float, int]]:
+        """Для каждого (ответ, эталоны) - лучшая оценка cross-encoder и индекс эталона"""
+        pairs = [(answer, reference) for answer, references in items for reference in references]
+        if not pairs:
+            return [(0.0, -1) for _ in items]
+        scores = np.asarray(self._get_model().predict(pairs), dtype=np.float32).reshape(-1)
+
+        results = []
+        start = 0
+        for _, references in items:
+            segment = scores[start:start + len(references)]
+            start += len(references)
+            if len(segment):
+                best = int(segment.argmax())
+                results.append((float(segment[best]), best))
+            else:
+                results.append((0.0, -1))
+        return results
@@ -1,34 +1,156 @@
+"""Доступ к базам SQLite через пул соединений.
+
+Каждый поток держит по одному соединению на файл базы и переиспользует его
+между запросами, поэтому соединение не открывается заново при каждом обращении.
+Соединение настраивается один раз при открытии:
+    journal_mode=WAL     - чтение не блокируется записью;
+    synchronous=NORMAL   - без fsync на каждую транзакцию (в WAL это безопасно);
+    mmap_size            - чтение страниц через отображение файла в память;
+    busy_timeout         - ожидание блокировки другого процесса вместо ошибки;
+    cached_statements    - кэш подготовленных запросов.
+
+Асинхронные обработчики выполняют запросы через run_db и помощники
+fetch_all/fetch_one/execute: работа с базой идет в отдельном пуле потоков
+(settings.DB_WORKERS) и не останавливает общий цикл событий.
+"""
+
+import asyncio
+import functools
+import os
 import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 
+import settings
+
 DATABASE_NAME = "users.db"
 
-def init_db():
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_type TEXT NOT NULL,
-            last_name TEXT NOT NULL,
-            first_name TEXT NOT NULL,
-            middle_name TEXT,
-            group_name TEXT,
-            login TEXT UNIQUE NOT NULL,
-            password TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
+_local = threading.local()
+_stats_lock = threading.Lock()
+_opened = 0
 
-@contextmanager
-def get_db_connection():
-    conn = sqlite3.connect(DATABASE_NAME)
+
+def _create_executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=settings.DB_WORKERS, thread_name_prefix="db")
+
+
+_executor = _create_executor()
+
+
+def _reset_after_fork():
+    # Соединения родителя и потоки пула нельзя использовать в дочернем процессе
+    global _local, _stats_lock, _opened, _executor
+    _local = threading.local()
+    _stats_lock = threading.Lock()
+    _opened = 0
+    _executor = _create_executor()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _open(db_path: str) -> sqlite3.Connection:
+    global _opened
+    conn = sqlite3.connect(
+        db_path,
+        timeout=settings.SQLITE_BUSY_TIMEOUT_MS / 1000.0,
+        cached_statements=settings.SQLITE_CACHED_STATEMENTS,
+    )
     conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA mmap_size={int(settings.SQLITE_MMAP_SIZE)}")
+    conn.execute(f"PRAGMA busy_timeout={int(settings.SQLITE_BUSY_TIMEOUT_MS)}")
+    with _stats_lock:
+        _opened += 1
+    return conn
+
+
+def connect(db_path: str = DATABASE_NAME) -> sqlite3.Connection:
+    """Соединение текущего потока с базой (открывается при первом обращении)"""
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    conn = connections.get(db_path)
+    if conn is None:
+        conn = connections[db_path] = _open(db_path)
+    return conn
+
+
+@contextmanager
+def get_db_connection(db_path: str = DATABASE_NAME):
+    """Соединение из пула на время блока; незавершенная транзакция откатывается"""
+    conn = connect(db_path)
     try:
         yield conn
     finally:
-        conn.close()
\ No newline at end of file
+        # Соединение переиспользуется - транзакция без commit не должна перейти
+        # в следующий запрос этого потока
+        if conn.in_transaction:
+            conn.rollback()
+
+
+async def run_db(fn, *args, **kwargs):
+    """Выполняет синхронную работу с базой в пуле потоков базы, не блокируя цикл событий"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(fn, *args, **kwargs))
+
+
+def _fetch_all(sql: str, params, db_path: str):
+    with get_db_connection(db_path) as conn:
+        return conn.execute(sql, params).fetchall()
+
+
+def _fetch_one(sql: str, params, db_path: str):
+    with get_db_connection(db_path) as conn:
+        return conn.execute(sql, params).fetchone()
+
+
+def _execute(sql: str, params, db_path: str) -> int:
+    with get_db_connection(db_path) as conn:
+        cursor = conn.execute(sql, params)
+        conn.commit()
+        return cursor.rowcount
+
+
+async def fetch_all(sql: str, params=(), db_path: str = DATABASE_NAME):
+    """Все строки результата запроса"""
+    return await run_db(_fetch_all, sql, params, db_path)
+
+
+async def fetch_one(sql: str, params=(), db_path: str = DATABASE_NAME):
+    """Первая строка результата запроса или None"""
+    return await run_db(_fetch_one, sql, params, db_path)
+
+
+async def execute(sql: str, params=(), db_path: str = DATABASE_NAME) -> int:
+    """Выполняет изменяющий запрос с фиксацией транзакции; возвращает число затронутых строк"""
+    return await run_db(_execute, sql, params, db_path)
+
+
+def stats() -> dict:
+    """Число соединений, открытых процессом"""
+    with _stats_lock:
+        return {"connections_opened": _opened}
+
+
+def init_db():
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_type TEXT NOT NULL,
+                last_name TEXT NOT NULL,
+                first_name TEXT NOT NULL,
+                middle_name TEXT,
+                group_name TEXT,
+                login TEXT UNIQUE NOT NULL,
+                password TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        conn.commit()
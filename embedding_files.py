@@ -0,0 +1,116 @@
+"""Файлы скомпилированных тестов рядом с xlsx для совместного использования воркерами.
+
+Скомпилированный тест записывается один раз в плоский бинарный файл
+<имя>.xlsx.emb и открывается через np.memmap каждым воркером uvicorn: кэш
+страниц ОС держит одну общую копию матрицы, а новый воркер получает готовый
+тест без кодирования.
+
+Формат файла:
+    MAGIC (8 байт) | длина заголовка (uint32 LE) | заголовок JSON
+    | offsets int32 | scales float32 (только для int8) | matrix
+Каждый массив выровнен по ALIGNMENT байт от начала файла.
+"""
+
+import json
+import os
+import struct
+from typing import Optional
+
+import numpy as np
+
+from grading import CompiledQuiz, PackedEmbeddings
+
+MAGIC = b"QUIZEMB1"
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+SUFFIX = ".emb"
+
+
+def sidecar_path(file_path: str) -> str:
+    """Путь к файлу эмбеддингов для файла теста"""
+    return str(file_path) + SUFFIX
+
+
+def _align(position: int) -> int:
+    return (position + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def write(file_path: str, quiz: CompiledQuiz, encoder: str) -> str:
+    """Записывает скомпилированный тест рядом с файлом теста (атомарно)"""
+    packed = quiz.embeddings
+    matrix = np.ascontiguousarray(packed.matrix)
+    header = {
+        "format": FORMAT_VERSION,
+        "encoder": encoder,
+        "source_digest": quiz.version,
+        "dtype": matrix.dtype.name,
+        "shape": list(matrix.shape),
+        "questions_count": len(packed),
+        "has_scales": packed.scales is not None,
+        "max_score_error": packed.max_score_error,
+        "questions": quiz.questions,
+        "reference_answers": quiz.reference_answers,
+    }
+    header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+
+    path = sidecar_path(file_path)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<I", len(header_bytes)))
+        f.write(header_bytes)
+        arrays = [packed.offsets.astype(np.int32)]
+        if packed.scales is not None:
+            arrays.append(packed.scales.astype(np.float32))
+        arrays.append(matrix)
+        for array in arrays:
+            f.write(b"\0" * (_align(f.tell()) - f.tell()))
+            f.write(array.tobytes())
+    os.replace(tmp_path, path)
+    return path
+
+
+def load(file_path: str, source_digest: str, encoder: str, dtype: str) -> Optional[CompiledQuiz]:
+    """Открывает файл эмбеддингов через mmap; None, если его нет или он устарел"""
+    path = sidecar_path(file_path)
+    try:
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                return None
+            (header_len,) = struct.unpack("<I", f.read(4))
+            header = json.loads(f.read(header_len).decode("utf-8"))
+    except (OSError, ValueError, struct.error):
+        return None
+
+    # Файл относится к другой версии теста, модели или формату хранения
+    if (header.get("format") != FORMAT_VERSION or header.get("source_digest") != source_digest
+            or header.get("encoder") != encoder or header.get("dtype") != dtype):
+        return None
+
+    rows, dim = header["shape"]
+    position = _align(len(MAGIC) + 4 + header_len)
+    offsets = np.memmap(path, dtype=np.int32, mode="r", offset=position, shape=(header["questions_count"] + 1,))
+    position = _align(position + offsets.nbytes)
+
+    scales = None
+    if header["has_scales"] and rows:
+        scales = np.memmap(path, dtype=np.float32, mode="r", offset=position, shape=(rows,))
+        position = _align(position + scales.nbytes)
+
+    if rows and dim:
+        matrix = np.memmap(path, dtype=np.dtype(header["dtype"]), mode="r", offset=position, shape=(rows, dim))
+    else:
+        matrix = np.zeros((0, 0), dtype=np.dtype(header["dtype"]))
+
+    packed = PackedEmbeddings(matrix, np.array(offsets), scales, header["max_score_error"])
+    quiz = CompiledQuiz(header["questions"], header["reference_answers"], packed, file_path)
+    quiz.version = source_digest
+    return quiz
+
+
+def remove(file_path: str) -> None:
+    """Удаляет файл эмбеддингов теста, если он есть"""
+    try:
+        os.remove(sidecar_path(file_path))
+    except FileNotFoundError:
+        pass
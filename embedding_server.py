@@ -0,0 +1,209 @@
+"""Локальный сервис эмбеддингов через Unix-сокет.
+
+Отдельный процесс владеет моделью и принимает запросы на кодирование от всех
+веб-воркеров, объединяя их в общие батчи. Веб-воркеры при этом не загружают
+модель (см. settings.EMBEDDING_SOCKET) и при недоступности сервиса кодируют
+сами.
+
+Протокол: кадры "длина (uint32 BE) + данные".
+    запрос  - JSON {"texts": [...]}
+    ответ   - JSON {"ok": true, "shape": [n, d], "dtype": "float32"}, затем кадр с байтами матрицы,
+              или JSON {"ok": false, "error": "..."}
+
+Запуск:
+    python embedding_server.py --socket /run/quiz/embeddings.sock
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import struct
+import sys
+import threading
+from typing import List
+
+import numpy as np
+
+import settings
+
+# Ограничение размера кадра, чтобы поврежденный поток не занял всю память
+MAX_FRAME_BYTES = 64 * 1024 * 1024
+
+_HEADER = struct.Struct(">I")
+
+
+class EmbeddingServiceError(Exception):
+    """Сервис эмбеддингов недоступен или вернул ошибку"""
+
+
+# --- Клиент -----------------------------------------------------------------
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ConnectionError("Сервис эмбеддингов закрыл соединение")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def _recv_frame(sock: socket.socket) -> bytes:
+    (size,) = _HEADER.unpack(_recv_exact(sock, _HEADER.size))
+    if size > MAX_FRAME_BYTES:
+        raise ConnectionError("Слишком большой кадр от сервиса эмбеддингов")
+    return _recv_exact(sock, size)
+
+
+class EmbeddingClient:
+    """Клиент сервиса эмбеддингов с переиспользованием соединения в каждом потоке"""
+
+    def __init__(self, socket_path: str, timeout: float = 10.0, max_batch: int = settings.BATCH_MAX_SENTENCES):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        # Тексты отправляются частями не больше батча сервиса: таймаут
+        # ограничивает время ответа на одну часть, а не на весь тест
+        self.max_batch = max(1, max_batch)
+        self._local = threading.local()
+        # Соединение, открытое до fork, нельзя делить с дочерним процессом
+        os.register_at_fork(after_in_child=self._reset_after_fork)
+
+    def _reset_after_fork(self):
+        self._close()
+        self._local = threading.local()
+
+    def _connection(self) -> socket.socket:
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            self._local.sock = sock
+        return sock
+
+    def _close(self):
+        sock = getattr(self._local, "sock", None)
+        self._local.sock = None
+        if sock is not None:
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+    def _request(self, texts: List[str]) -> np.ndarray:
+        sock = self._connection()
+        payload = json.dumps({"texts": texts}, ensure_ascii=False).encode("utf-8")
+        sock.sendall(_HEADER.pack(len(payload)) + payload)
+
+        header = json.loads(_recv_frame(sock).decode("utf-8"))
+        if not header.get("ok"):
+            raise EmbeddingServiceError(header.get("error", "Неизвестная ошибка сервиса эмбеддингов"))
+        data = _recv_frame(sock)
+        return np.frombuffer(data, dtype=np.dtype(header["dtype"])).reshape(header["shape"])
+
+    def _encode_chunk(self, texts: List[str]) -> np.ndarray:
+        for attempt in range(2):
+            try:
+                return self._request(texts)
+            except EmbeddingServiceError:
+                raise
+            except socket.timeout as e:
+                # Сервис занят: повтор закодировал бы те же тексты еще раз.
+                # Ответ на этот запрос может прийти позже, поэтому соединение закрываем
+                self._close()
+                raise EmbeddingServiceError(f"Сервис эмбеддингов не ответил за {self.timeout} с") from e
+            except (OSError, ValueError) as e:
+                # Соединение могло устареть (перезапуск сервиса) - открываем новое
+                self._close()
+                if attempt == 1:
+                    raise EmbeddingServiceError(f"Сервис эмбеддингов недоступен: {e}") from e
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """Кодирует тексты в сервисе частями по max_batch; при обрыве соединения
+        пробует переподключиться один раз, после таймаута не повторяет"""
+        texts = list(texts)
+        if len(texts) <= self.max_batch:
+            return self._encode_chunk(texts)
+        return np.vstack([
+            self._encode_chunk(texts[start:start + self.max_batch])
+            for start in range(0, len(texts), self.max_batch)
+        ])
+
+
+# --- Сервер -----------------------------------------------------------------
+
+async def _read_frame(reader: asyncio.StreamReader) -> bytes:
+    (size,) = _HEADER.unpack(await reader.readexactly(_HEADER.size))
+    if size > MAX_FRAME_BYTES:
+        raise ConnectionError("Слишком большой кадр")
+    return await reader.readexactly(size)
+
+
+def _write_frame(writer: asyncio.StreamWriter, data: bytes) -> None:
+    writer.write(_HEADER.pack(len(data)) + data)
+
+
+async def _handle_connection(batcher, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        while True:
+            try:
+                request = json.loads((await _read_frame(reader)).decode("utf-8"))
+            except asyncio.IncompleteReadError:
+                break
+            try:
+                texts = [str(text) for text in request["texts"]]
+                embeddings = np.ascontiguousarray(await batcher.encode(texts), dtype=np.float32)
+                header = {"ok": True, "shape": list(embeddings.shape), "dtype": "float32"}
+                _write_frame(writer, json.dumps(header).encode("utf-8"))
+                _write_frame(writer, embeddings.tobytes())
+            except Exception as e:
+                _write_frame(writer, json.dumps({"ok": False, "error": str(e)}, ensure_ascii=False).encode("utf-8"))
+            await writer.drain()
+    except (ConnectionError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(socket_path: str):
+    import calibrate
+    from batching import MicroBatcher
+    from encoders import encoder_id, load_encoder
+
+    model = load_encoder(settings.MODEL_NAME, settings.ENCODER_BACKEND)
+    # Сервис один на машину: ему доступны все ядра
+    profile = calibrate.apply(encoder_id(settings.MODEL_NAME, settings.ENCODER_BACKEND), 1)
+    # Запросы всех веб-воркеров объединяются в общие батчи
+    batcher = MicroBatcher(
+        lambda texts: model.encode(texts, batch_size=profile["batch_size"]),
+        max_batch=settings.BATCH_MAX_SENTENCES,
+        max_wait_ms=settings.BATCH_MAX_WAIT_MS,
+    )
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    server = await asyncio.start_unix_server(
+        lambda reader, writer: _handle_connection(batcher, reader, writer),
+        path=socket_path,
+    )
+    print(f"Сервис эмбеддингов {settings.MODEL_NAME} ({settings.ENCODER_BACKEND}) слушает {socket_path}")
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Сервис эмбеддингов через Unix-сокет")
+    parser.add_argument("--socket", default=settings.EMBEDDING_SOCKET or "/tmp/quiz-embeddings.sock")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.socket))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
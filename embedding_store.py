@@ -0,0 +1,203 @@
+"""Кэширование эмбеддингов перед моделью.
+
+EmbeddingStore - постоянное хранилище эмбеддингов эталонных ответов. Ключ записи -
+хеш имени модели и нормализованного текста ответа, поэтому один и тот же ответ
+не кодируется повторно ни в том же файле, ни в его отредактированной копии,
+ни в другом тесте.
+
+EmbeddingLRUCache - ограниченный по памяти кэш эмбеддингов ответов студентов.
+"""
+
+import hashlib
+import re
+import sys
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List
+
+import numpy as np
+
+from database import get_db_connection
+
+EMBEDDINGS_DB = "embeddings.db"
+
+# Ограничение SQLite на число параметров в одном запросе
+_QUERY_CHUNK = 500
+
+
+def normalize_text(text: str) -> str:
+    """Нормализует текст ответа перед хешированием (Unicode NFC, схлопывание пробелов)"""
+    text = unicodedata.normalize("NFC", str(text))
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def text_key(model_name: str, text: str) -> str:
+    """Ключ эмбеддинга: хеш имени модели и нормализованного текста"""
+    payload = f"{model_name}\0{normalize_text(text)}".encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()
+
+
+class EmbeddingStore:
+    """Хранилище эмбеддингов в SQLite, адресуемое по содержимому"""
+
+    def __init__(self, model_name: str, db_path: str = EMBEDDINGS_DB):
+        self.model_name = model_name
+        self.db_path = db_path
+        self._init_db()
+
+    def _init_db(self):
+        with get_db_connection(self.db_path) as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    key TEXT PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    dim INTEGER NOT NULL,
+                    vector BLOB NOT NULL
+                )
+            ''')
+            conn.commit()
+
+    def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        """Возвращает найденные эмбеддинги по ключам"""
+        found = {}
+        with get_db_connection(self.db_path) as conn:
+            for start in range(0, len(keys), _QUERY_CHUNK):
+                chunk = keys[start:start + _QUERY_CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                cursor = conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                    chunk
+                )
+                for key, vector in cursor.fetchall():
+                    found[key] = np.frombuffer(vector, dtype=np.float32)
+        return found
+
+    def put_many(self, items: Dict[str, np.ndarray]) -> None:
+        """Сохраняет эмбеддинги по ключам"""
+        if not items:
+            return
+        rows = [
+            (key, self.model_name, int(vector.shape[-1]), np.asarray(vector, dtype=np.float32).tobytes())
+            for key, vector in items.items()
+        ]
+        with get_db_connection(self.db_path) as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, model, dim, vector) VALUES (?, ?, ?, ?)",
+                rows
+            )
+            conn.commit()
+
+    def encode(self, texts: List[str], encode_fn: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        """Возвращает эмбеддинги текстов, кодируя через encode_fn только отсутствующие в хранилище"""
+        keys = [text_key(self.model_name, text) for text in texts]
+        found = self.get_many(list(dict.fromkeys(keys)))
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+
+        if missing:
+            encoded = np.asarray(encode_fn(list(missing.values())), dtype=np.float32)
+            new_items = dict(zip(missing.keys(), encoded))
+            self.put_many(new_items)
+            found.update(new_items)
+
+        if not keys:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.stack([found[key] for key in keys])
+
+
+class EmbeddingLRUCache:
+    """Ограниченный по памяти LRU-кэш эмбеддингов ответов студентов.
+
+    Одинаковые ответы (повторная загрузка страницы, совпадающие ответы в группе)
+    не проходят через модель повторно.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _entry_size(key: str, vector: np.ndarray) -> int:
+        return vector.nbytes + sys.getsizeof(key)
+
+    def get(self, text: str):
+        key = normalize_text(text)
+        with self._lock:
+            vector = self._items.get(key)
+            if vector is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return vector
+
+    def put(self, text: str, vector: np.ndarray) -> None:
+        key = normalize_text(text)
+        vector = np.asarray(vector, dtype=np.float32)
+        size = self._entry_size(key, vector)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.current_bytes -= self._entry_size(key, old)
+            self._items[key] = vector
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                old_key, old_vector = self._items.popitem(last=False)
+                self.current_bytes -= self._entry_size(old_key, old_vector)
+                self.evictions += 1
+
+    def _lookup(self, texts: List[str]):
+        vectors = [self.get(text) for text in texts]
+        missing = list(dict.fromkeys(
+            normalize_text(text) for text, vector in zip(texts, vectors) if vector is None
+        ))
+        return vectors, missing
+
+    def _merge(self, texts: List[str], vectors, missing: List[str], encoded) -> np.ndarray:
+        if missing:
+            encoded = dict(zip(missing, np.asarray(encoded, dtype=np.float32)))
+            for key, vector in encoded.items():
+                self.put(key, vector)
+            vectors = [
+                vector if vector is not None else encoded[normalize_text(text)]
+                for text, vector in zip(texts, vectors)
+            ]
+
+        if not vectors:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.stack(vectors)
+
+    def encode(self, texts: List[str], encode_fn: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        """Возвращает эмбеддинги текстов, кодируя через encode_fn только промахи кэша"""
+        vectors, missing = self._lookup(texts)
+        encoded = encode_fn(missing) if missing else None
+        return self._merge(texts, vectors, missing, encoded)
+
+    async def encode_async(self, texts: List[str], encode_fn: Callable[[List[str]], Awaitable[np.ndarray]]) -> np.ndarray:
+        """То же, что encode, но промахи кодируются асинхронной функцией"""
+        vectors, missing = self._lookup(texts)
+        encoded = await encode_fn(missing) if missing else None
+        return self._merge(texts, vectors, missing, encoded)
+
+    def stats(self) -> dict:
+        """Счетчики кэша для мониторинга"""
+        with self._lock:
+            return {
+                "entries": len(self._items),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
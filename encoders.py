@@ -0,0 +1,129 @@
+"""Загрузка модели кодирования с выбранным бэкендом инференса для CPU.
+
+Бэкенды:
+    torch      - исходная модель float32 на PyTorch
+    torch-int8 - динамическое квантование линейных слоев PyTorch в int8
+    onnx       - граф ONNX Runtime (float32)
+    onnx-int8  - квантованный граф ONNX Runtime (settings.ONNX_INT8_FILE)
+    lexical    - символьные n-граммы без torch (см. lexical.py), свой порог settings.LEXICAL_THRESHOLD
+
+Перед переключением бэкенда в продакшене запустите проверку совпадения оценок:
+    python encoders.py --backend torch-int8 uploaded_files/*.xlsx
+"""
+
+import argparse
+import glob
+import os
+import sys
+
+import numpy as np
+
+import settings
+from lexical import corpus_encoder, pair_scores
+
+BACKENDS = ("torch", "torch-int8", "onnx", "onnx-int8", "lexical")
+
+
+def encoder_id(model_name: str, backend: str) -> str:
+    """Идентификатор кодировщика для ключей кэшей эмбеддингов"""
+    if backend == "lexical":
+        return corpus_encoder(settings.LEXICAL_CORPUS).encoder_id
+    return model_name if backend == "torch" else f"{model_name}:{backend}"
+
+
+def load_encoder(model_name: str, backend: str = "torch"):
+    """Загружает SentenceTransformer с выбранным бэкендом инференса"""
+    if backend not in BACKENDS:
+        raise ValueError(f"Неизвестный бэкенд инференса: {backend} (доступны: {', '.join(BACKENDS)})")
+
+    if backend == "lexical":
+        # Лексический движок не импортирует torch и sentence_transformers
+        return corpus_encoder(settings.LEXICAL_CORPUS)
+
+    from sentence_transformers import SentenceTransformer
+
+    if backend == "torch":
+        return SentenceTransformer(model_name, device="cpu")
+
+    if backend == "torch-int8":
+        import torch
+        model = SentenceTransformer(model_name, device="cpu")
+        model.eval()
+        # Веса линейных слоев хранятся в int8, активации квантуются на лету
+        torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+        return model
+
+    if backend == "onnx":
+        return SentenceTransformer(model_name, device="cpu", backend="onnx")
+
+    return SentenceTransformer(
+        model_name,
+        device="cpu",
+        backend="onnx",
+        model_kwargs={"file_name": settings.ONNX_INT8_FILE},
+    )
+
+
+def _parity_pairs(reference_answers):
+    """Пары для проверки: эталоны одного вопроса между собой и с эталонами соседнего вопроса"""
+    pairs = []
+    for i, answers in enumerate(reference_answers):
+        neighbours = reference_answers[(i + 1) % len(reference_answers)]
+        for a_idx, answer in enumerate(answers):
+            for other in answers[a_idx + 1:]:
+                pairs.append((answer, other))
+            for other in neighbours[:2]:
+                pairs.append((answer, other))
+    return pairs
+
+
+def check_parity(reference_model, candidate_model, pairs, threshold: float, band: float = 0.02) -> dict:
+    """Сравнивает оценки бэкенда с эталонной моделью float32 вокруг порога зачета"""
+    expected = pair_scores(reference_model, pairs)
+    actual = pair_scores(candidate_model, pairs)
+    delta = np.abs(expected - actual)
+    flipped = (expected >= threshold) != (actual >= threshold)
+    near = np.abs(expected - threshold) <= band
+    return {
+        "pairs": len(pairs),
+        "max_abs_delta": float(delta.max()) if len(delta) else 0.0,
+        "mean_abs_delta": float(delta.mean()) if len(delta) else 0.0,
+        "near_threshold": int(near.sum()),
+        "flipped_decisions": int(flipped.sum()),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Проверка совпадения оценок бэкенда с моделью float32")
+    parser.add_argument("files", nargs="*", help="файлы тестов (по умолчанию uploaded_files/*.xlsx)")
+    parser.add_argument("--backend", default=settings.ENCODER_BACKEND, choices=[b for b in BACKENDS if b != "lexical"])
+    parser.add_argument("--model", default=settings.MODEL_NAME)
+    parser.add_argument("--threshold", type=float, default=settings.THRESHOLD)
+    parser.add_argument("--band", type=float, default=0.02, help="полуширина полосы вокруг порога")
+    args = parser.parse_args(argv)
+
+    from utils import read_quiz_file
+
+    pairs = []
+    for file_path in args.files or glob.glob(os.path.join("uploaded_files", "*.xlsx")):
+        _, reference_answers = read_quiz_file(file_path)
+        if reference_answers:
+            pairs.extend(_parity_pairs(reference_answers))
+    if not pairs:
+        print("Нет эталонных ответов для проверки")
+        return 1
+
+    report = check_parity(
+        load_encoder(args.model, "torch"),
+        load_encoder(args.model, args.backend),
+        pairs,
+        args.threshold,
+        args.band,
+    )
+    for key, value in report.items():
+        print(f"{key}: {value}")
+    return 0 if report["flipped_decisions"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
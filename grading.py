@@ -0,0 +1,193 @@
+"""Проверка ответов: точное совпадение с эталоном и векторизованное сравнение эмбеддингов"""
+
+import unicodedata
+
+import numpy as np
+from typing import List, Optional, Tuple
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """Нормирует строки матрицы (для косинусного сходства через скалярное произведение)"""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+# Знаки, которые отбрасываются по краям слов ответа. Дефис-минус, точка и
+# запятая внутри слова значимы ("-5", "3.14", "x^2-1"), а скобки могут быть
+# частью выражения, поэтому они в набор не входят
+_EDGE_PUNCTUATION = ".,!?;:\"'«»„“”‘’…–—¡¿"
+
+
+def normalize_answer(text: str) -> str:
+    """Нормализует ответ для точного сравнения: регистр, пробелы и пунктуация по краям слов не учитываются"""
+    text = unicodedata.normalize("NFKC", str(text)).casefold()
+    words = (word.strip(_EDGE_PUNCTUATION) for word in text.split())
+    return " ".join(word for word in words if word)
+
+
+class ExactMatchIndex:
+    """Хеш-таблицы нормализованных эталонных ответов по вопросам.
+
+    Ответ, совпадающий с эталоном после нормализации, засчитывается
+    со сходством 1.0 без обращения к модели.
+    """
+
+    def __init__(self, reference_answers: List[List[str]]):
+        self.lookup = []
+        for answers in reference_answers:
+            normalized = {}
+            for idx, answer in enumerate(answers):
+                key = normalize_answer(answer)
+                if key:
+                    normalized.setdefault(key, idx)
+            self.lookup.append(normalized)
+
+    def match(self, question_idx: int, answer: str) -> Optional[int]:
+        """Индекс совпавшего эталона внутри вопроса или None"""
+        if question_idx >= len(self.lookup):
+            return None
+        return self.lookup[question_idx].get(normalize_answer(answer))
+
+
+STORAGE_DTYPES = ("float32", "float16", "int8")
+
+
+def quantize(matrix: np.ndarray, dtype: str):
+    """Переводит нормированную матрицу float32 в формат хранения.
+
+    Возвращает (матрица, масштабы строк или None, max_score_error), где
+    max_score_error - наибольшая норма ошибки строки. Для любого нормированного
+    запроса это верхняя граница отклонения косинусного сходства от float32.
+    """
+    if dtype not in STORAGE_DTYPES:
+        raise ValueError(f"Неизвестный формат хранения эмбеддингов: {dtype}")
+
+    if dtype == "float32":
+        return matrix.astype(np.float32), None, 0.0
+    if matrix.size == 0:
+        # Пустая матрица хранится в запрошенном формате, чтобы файл эмбеддингов
+        # теста без эталонов совпадал по dtype и переиспользовался воркерами
+        return matrix.astype(dtype), None, 0.0
+
+    if dtype == "float16":
+        stored = matrix.astype(np.float16)
+        restored = stored.astype(np.float32)
+        scales = None
+    else:
+        # Симметричное квантование int8 с отдельным масштабом для каждой строки
+        scales = np.abs(matrix).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        stored = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+        scales = scales.astype(np.float32)
+        restored = stored.astype(np.float32) * scales[:, None]
+
+    max_score_error = float(np.linalg.norm(matrix - restored, axis=1).max())
+    return stored, scales, max_score_error
+
+
+class PackedEmbeddings:
+    """Эталонные эмбеддинги всех вопросов в одной непрерывной матрице.
+
+    matrix  - нормированные эмбеддинги всех эталонных ответов подряд, форма (R, D),
+              в формате float32, float16 или int8 (тогда строки умножаются на scales)
+    offsets - границы вопросов (int32): ответы вопроса i лежат в matrix[offsets[i]:offsets[i + 1]]
+    """
+
+    def __init__(self, matrix: np.ndarray, offsets: np.ndarray, scales: Optional[np.ndarray] = None,
+                 max_score_error: float = 0.0):
+        self.matrix = matrix if matrix.flags.c_contiguous else np.ascontiguousarray(matrix)
+        self.offsets = np.asarray(offsets, dtype=np.int32)
+        self.scales = scales
+        self.max_score_error = max_score_error
+
+        # Таблица индексов (Q, K) для сегментного max/argmax: строка i содержит
+        # номера строк matrix для ответов вопроса i, хвост забит нулями и замаскирован
+        counts = np.diff(self.offsets)
+        width = max(int(counts.max()) if len(counts) else 0, 1)
+        local = np.arange(width, dtype=np.int32)
+        self.mask = local[None, :] < counts[:, None]
+        self.pad_index = np.where(self.mask, self.offsets[:-1, None] + local[None, :], 0).astype(np.int32)
+
+    @classmethod
+    def from_flat(cls, embeddings: np.ndarray, counts: List[int], dtype: str = "float32") -> "PackedEmbeddings":
+        """Упаковывает эмбеддинги всех эталонов подряд; counts - число эталонов у каждого вопроса"""
+        offsets = np.zeros(len(counts) + 1, dtype=np.int32)
+        np.cumsum(counts, out=offsets[1:])
+
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if embeddings.ndim != 2 or len(embeddings) == 0:
+            embeddings = np.zeros((0, 0), dtype=np.float32)
+        matrix, scales, max_score_error = quantize(_normalize_rows(embeddings), dtype)
+        return cls(matrix, offsets, scales, max_score_error)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    @property
+    def dtype(self) -> str:
+        return self.matrix.dtype.name
+
+    def nbytes(self) -> int:
+        size = self.matrix.nbytes + self.offsets.nbytes + self.pad_index.nbytes + self.mask.nbytes
+        if self.scales is not None:
+            size += self.scales.nbytes
+        return size
+
+    def score(self, user_embeddings: np.ndarray, question_indices=None) -> Tuple[np.ndarray, np.ndarray]:
+        """Оценивает ответы пользователя за один проход.
+
+        user_embeddings[j] - эмбеддинг ответа на вопрос question_indices[j]
+        (по умолчанию - на вопрос j). Возвращает максимальное сходство и
+        индекс лучшего эталона внутри вопроса (-1, если эталонов нет).
+        """
+        if question_indices is None:
+            question_indices = np.arange(len(user_embeddings))
+        question_indices = np.asarray(question_indices, dtype=np.intp)
+
+        n = len(question_indices)
+        if n == 0 or self.matrix.size == 0:
+            return np.zeros(n, dtype=np.float32), np.full(n, -1, dtype=np.int64)
+
+        users = _normalize_rows(np.asarray(user_embeddings, dtype=np.float32))
+
+        # Из матрицы берутся только эталоны запрошенных вопросов (n, K, D): ответ
+        # сравнивается со своими эталонами, а к float32 приводятся лишь эти строки.
+        # Для одного ответа (/answer) это K строк, а не вся матрица теста
+        pad = self.pad_index[question_indices]
+        mask = self.mask[question_indices]
+        references = self.matrix[pad].astype(np.float32, copy=False)
+        segment = np.matmul(references, users[:, :, None])[:, :, 0]
+        if self.scales is not None:
+            segment *= self.scales[pad]
+        segment = np.where(mask, segment, -np.inf)
+
+        best_idx = segment.argmax(axis=1)
+        best_scores = segment[np.arange(n), best_idx]
+
+        has_refs = mask.any(axis=1)
+        best_scores = np.where(has_refs, best_scores, 0.0).astype(np.float32)
+        best_idx = np.where(has_refs, best_idx, -1)
+        return best_scores, best_idx
+
+
+class CompiledQuiz:
+    """Тест, готовый к проверке: вопросы, эталоны, их эмбеддинги и индекс точных совпадений"""
+
+    def __init__(self, questions: List[str], reference_answers: List[List[str]],
+                 embeddings: PackedEmbeddings, source: str = ""):
+        self.questions = questions
+        self.reference_answers = reference_answers
+        self.embeddings = embeddings
+        self.exact_index = ExactMatchIndex(reference_answers)
+        self.source = source
+        self.version = ""  # хеш содержимого файла, заполняет каталог тестов
+
+    def __len__(self) -> int:
+        return len(self.questions)
+
+    def nbytes(self) -> int:
+        """Приблизительный объем памяти теста"""
+        texts = sum(len(q) for q in self.questions)
+        texts += sum(len(a) for answers in self.reference_answers for a in answers)
+        return self.embeddings.nbytes() + 2 * texts
@@ -0,0 +1,209 @@
+"""Общий сервис данных пользователя для всех приложений (main, main2, app).
+
+Раньше каждый просмотр страницы открывал одно-два новых соединения с users.db:
+get_user_full_info в обработчике и еще раз в get_template_context. Теперь:
+    - в пределах запроса логин и профиль запоминаются в request.state;
+    - между запросами профили хранятся в ограниченном кэше с временем жизни
+      settings.IDENTITY_CACHE_TTL;
+    - изменение пользователя (редактирование, смена пароля, удаление, записи
+      /admin/*) вызывает invalidate_user, и кэш сразу забывает профиль.
+Другие воркеры увидят изменение не позже чем через IDENTITY_CACHE_TTL секунд.
+С подписанными токенами логин и тип пользователя берутся из токена, и
+проверка прав (get_request_permissions) не обращается к users.db.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import settings
+from database import get_db_connection
+from session_manager import get_session_claims
+
+_USER_COLUMNS = "id, user_type, last_name, first_name, middle_name, group_name, login, password, created_at"
+
+
+class ProfileCache:
+    """Ограниченный кэш профилей пользователей с временем жизни записей"""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._items = OrderedDict()  # логин -> (профиль, время истечения)
+        self._lock = threading.Lock()
+
+    def get(self, login: str) -> Optional[dict]:
+        now = time.monotonic()
+        with self._lock:
+            item = self._items.get(login)
+            if item is None or item[1] <= now:
+                self._items.pop(login, None)
+                self.misses += 1
+                return None
+            self._items.move_to_end(login)
+            self.hits += 1
+            return item[0]
+
+    def put(self, login: str, profile: dict) -> None:
+        with self._lock:
+            self._items.pop(login, None)
+            self._items[login] = (profile, time.monotonic() + self.ttl)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def invalidate(self, login: Optional[str] = None) -> None:
+        """Забывает профиль пользователя (без логина - все профили)"""
+        with self._lock:
+            if login is None:
+                self._items.clear()
+            else:
+                self._items.pop(login, None)
+            self.invalidations += 1
+
+    def reset_after_fork(self) -> None:
+        self._lock = threading.Lock()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._items),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+            }
+
+
+profile_cache = ProfileCache(settings.IDENTITY_CACHE_SIZE, settings.IDENTITY_CACHE_TTL)
+
+
+def get_user_by_login(login: str):
+    """Получает пользователя из базы данных по логину (без кэша: используется при входе)"""
+    with get_db_connection() as conn:
+        user = conn.execute(f"SELECT {_USER_COLUMNS} FROM users WHERE login = ?", (login,)).fetchone()
+    if user:
+        return {
+            "id": user["id"],
+            "user_type": user["user_type"],
+            "last_name": user["last_name"],
+            "first_name": user["first_name"],
+            "middle_name": user["middle_name"],
+            "group_name": user["group_name"],
+            "login": user["login"],
+            "password": user["password"],  # Внимание: хранится в открытом виде!
+            "created_at": user["created_at"]
+        }
+    return None
+
+
+def get_user_full_info(login: str):
+    """Получает полную информацию о пользователе для отображения"""
+    if not login:
+        return None
+    profile = profile_cache.get(login)
+    if profile is None:
+        user = get_user_by_login(login)
+        if not user:
+            return None
+        # Формируем полное имя
+        full_name = f"{user['last_name']} {user['first_name']}"
+        if user['middle_name']:
+            full_name += f" {user['middle_name']}"
+
+        profile = {
+            "login": user['login'],
+            "full_name": full_name,
+            "user_type": user['user_type'],
+            "group_name": user['group_name'],
+            "created_at": user['created_at']
+        }
+        profile_cache.put(login, profile)
+    # Копия, чтобы изменения в обработчике не попали в кэш
+    return dict(profile)
+
+
+def get_user_permissions(user_type: str):
+    """Возвращает доступные права пользователя"""
+    permissions = {
+        'can_view_tests': True,  # Все могут видеть тесты
+        'can_take_tests': True,  # Все могут проходить тесты
+        'can_upload_files': user_type in ['teacher', 'admin'],  # Только преподаватели и админы могут загружать файлы
+        'can_delete_files': user_type in ['teacher', 'admin'],  # Только преподаватели и админы могут удалять файлы
+        'can_manage_users': user_type == 'admin',  # Только админы могут управлять пользователями
+        'can_edit_tests': user_type in ['teacher', 'admin'],  # Только преподаватели и админы могут редактировать тесты
+    }
+    return permissions
+
+
+def get_request_claims(request) -> Optional[dict]:
+    """Данные сессии текущего запроса: логин и тип пользователя (один раз за запрос)"""
+    state = request.state
+    if not hasattr(state, "session_claims"):
+        state.session_claims = get_session_claims(request.cookies.get("session_token"))
+    return state.session_claims
+
+
+def get_user_from_session(request) -> Optional[str]:
+    """Получает логин пользователя из сессии (один раз за запрос)"""
+    claims = get_request_claims(request)
+    return claims["login"] if claims else None
+
+
+def get_request_user_type(request) -> Optional[str]:
+    """Тип пользователя текущего запроса.
+
+    Подписанный токен (SESSION_BACKEND=signed) уже содержит тип, и база не
+    читается; для других хранилищ тип берется из профиля.
+    """
+    claims = get_request_claims(request)
+    if not claims:
+        return None
+    if claims["user_type"]:
+        return claims["user_type"]
+    user_info = get_request_user_info(request)
+    return user_info["user_type"] if user_info else None
+
+
+def get_request_permissions(request) -> Optional[dict]:
+    """Права пользователя текущего запроса (None без сессии)"""
+    user_type = get_request_user_type(request)
+    return get_user_permissions(user_type) if user_type else None
+
+
+def get_request_user_info(request) -> Optional[dict]:
+    """Профиль пользователя текущего запроса (один раз за запрос)"""
+    state = request.state
+    if not hasattr(state, "user_info"):
+        state.user_info = get_user_full_info(get_user_from_session(request))
+    return state.user_info
+
+
+def get_template_context(request):
+    """Возвращает контекст для шаблонов с информацией о пользователе"""
+    user_info = get_request_user_info(request)
+    if user_info:
+        return {
+            "user_info": user_info,
+            "user_permissions": get_request_permissions(request)
+        }
+    return {
+        "user_info": None,
+        "user_permissions": None
+    }
+
+
+def invalidate_user(*logins: str) -> None:
+    """Сбрасывает кэш профилей после изменения пользователей (без аргументов - всех)"""
+    if not logins:
+        profile_cache.invalidate()
+    for login in logins:
+        if login:
+            profile_cache.invalidate(login)
+
+
+os.register_at_fork(after_in_child=profile_cache.reset_after_fork)
@@ -0,0 +1,65 @@
+"""Выделенный пул потоков для инференса модели.
+
+Все вызовы модели выполняются здесь, а не в цикле событий uvicorn, поэтому
+вход, просмотр страниц и смонтированные приложения /v2 и /main2 продолжают
+отвечать, пока идет кодирование ответов.
+"""
+
+import asyncio
+import os
+import sys
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import settings
+
+_local = threading.local()
+
+
+def _mark_inference_thread():
+    _local.is_inference_thread = True
+
+
+def _create_executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(
+        max_workers=settings.INFERENCE_WORKERS,
+        thread_name_prefix="inference",
+        initializer=_mark_inference_thread,
+    )
+
+
+_executor = _create_executor()
+
+
+def _reset_after_fork():
+    # Потоки пула не переживают fork: воркеру нужен собственный пул
+    global _executor
+    _executor = _create_executor()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def set_threads(num_threads: int) -> None:
+    """Задает число внутренних потоков torch (если torch загружен)"""
+    torch = sys.modules.get("torch")
+    if torch is not None and num_threads > 0:
+        torch.set_num_threads(num_threads)
+
+
+def submit(fn, *args, **kwargs) -> Future:
+    """Ставит вызов в пул инференса"""
+    return _executor.submit(fn, *args, **kwargs)
+
+
+def run_sync(fn, *args, **kwargs):
+    """Выполняет вызов в пуле инференса и ждет результат (для синхронного кода)"""
+    # Вызов из потока пула выполняем на месте, иначе пул может ждать сам себя
+    if getattr(_local, "is_inference_thread", False):
+        return fn(*args, **kwargs)
+    return submit(fn, *args, **kwargs).result()
+
+
+async def run(fn, *args, **kwargs):
+    """Выполняет вызов в пуле инференса, не блокируя цикл событий"""
+    return await asyncio.wrap_future(submit(fn, *args, **kwargs))
@@ -0,0 +1,138 @@
+"""Фоновая очередь предварительного расчета эмбеддингов тестов.
+
+Файл теста ставится в очередь сразу после загрузки или сохранения, и эмбеддинги
+эталонных ответов считаются до того, как первый студент начнет тест.
+Сам расчет регистрирует основное приложение через set_handler, поэтому модуль
+можно импортировать из main2 без загрузки модели.
+"""
+
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Callable, Optional
+
+# Сколько завершенных задач хранить для эндпоинта статуса
+MAX_FINISHED_JOBS = 200
+
+_handler: Optional[Callable[[str], None]] = None
+_jobs = OrderedDict()  # job_id -> описание задачи
+_active_by_path = {}  # путь к файлу -> job_id задачи в очереди или в работе
+_done_events = {}  # job_id -> threading.Event
+_queue = queue.Queue()
+_lock = threading.Lock()
+_worker = None
+
+
+def _reset_after_fork():
+    # Поток-обработчик и блокировки очереди не переживают fork
+    global _queue, _lock, _worker
+    _queue = queue.Queue()
+    _lock = threading.Lock()
+    _worker = None
+    for job_id in _active_by_path.values():
+        _jobs[job_id].update(status="error", error="Задача осталась в родительском процессе")
+    _active_by_path.clear()
+    _done_events.clear()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def set_handler(handler: Callable[[str], None]) -> None:
+    """Регистрирует функцию предварительного расчета для файла теста"""
+    global _handler
+    _handler = handler
+
+
+def _normalize_path(file_path: str) -> str:
+    return os.path.abspath(str(file_path))
+
+
+def _ensure_worker():
+    global _worker
+    if _worker is None or not _worker.is_alive():
+        _worker = threading.Thread(target=_run_worker, name="precompute-worker", daemon=True)
+        _worker.start()
+
+
+def enqueue(file_path: str) -> str:
+    """Ставит файл теста в очередь на расчет и возвращает идентификатор задачи"""
+    path = _normalize_path(file_path)
+    with _lock:
+        # Файл уже ждет в очереди - новая задача ничего не добавит
+        job_id = _active_by_path.get(path)
+        if job_id and _jobs[job_id]["status"] == "queued":
+            return job_id
+
+        job_id = uuid.uuid4().hex
+        _jobs[job_id] = {
+            "id": job_id,
+            "file": os.path.basename(path),
+            "status": "queued",
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "error": None,
+        }
+        _done_events[job_id] = threading.Event()
+        _active_by_path[path] = job_id
+        _ensure_worker()
+    _queue.put((job_id, path))
+    return job_id
+
+
+def get_job(job_id: str) -> Optional[dict]:
+    """Возвращает копию описания задачи или None"""
+    with _lock:
+        job = _jobs.get(job_id)
+        return dict(job) if job else None
+
+
+def wait_for_file(file_path: str, timeout: Optional[float] = None) -> Optional[dict]:
+    """Ждет завершения задачи для файла, если она есть; возвращает ее описание"""
+    path = _normalize_path(file_path)
+    with _lock:
+        job_id = _active_by_path.get(path)
+        event = _done_events.get(job_id) if job_id else None
+    if event is None:
+        return None
+    event.wait(timeout)
+    return get_job(job_id)
+
+
+def _finish(job_id: str, path: str, status: str, error: Optional[str] = None):
+    with _lock:
+        job = _jobs[job_id]
+        job["status"] = status
+        job["error"] = error
+        job["finished_at"] = time.time()
+        if _active_by_path.get(path) == job_id:
+            del _active_by_path[path]
+        event = _done_events.pop(job_id, None)
+
+        # Ограничиваем историю завершенных задач
+        finished = [jid for jid, j in _jobs.items() if j["status"] in ("done", "error")]
+        for old_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del _jobs[old_id]
+    if event is not None:
+        event.set()
+
+
+def _run_worker():
+    while True:
+        job_id, path = _queue.get()
+        with _lock:
+            _jobs[job_id]["status"] = "running"
+            _jobs[job_id]["started_at"] = time.time()
+        try:
+            if _handler is None:
+                raise RuntimeError("Обработчик предварительного расчета не зарегистрирован")
+            _handler(path)
+            _finish(job_id, path, "done")
+        except Exception as e:
+            _finish(job_id, path, "error", str(e))
+        finally:
+            _queue.task_done()
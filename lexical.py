@@ -0,0 +1,266 @@
+"""Лексический движок оценки без torch: TF-IDF по символьным n-граммам и словам.
+
+Ответ представляется хешированным вектором символьных n-грамм внутри слов и
+самих слов (сублинейный TF, веса IDF, L2-нормировка). Слова как признаки
+разделяют однокоренные и близкие по написанию ответы ("тест" и "тесто"), а IDF
+снижает вес общеупотребительных слов и окончаний: ответ засчитывается по
+совпадению терминов, а не по "это", "является" и "столица".
+
+IDF обучается один раз на корпусе lexical_corpus.txt (QUIZ_LEXICAL_CORPUS), а не
+на эталонах теста: вектор ответа не зависит от теста, поэтому LexicalEncoder
+подключается вместо модели через тот же интерфейс encode() и работает с
+хранилищем, кэшем ответов и упакованными матрицами без изменений. Хеш весов
+входит в encoder_id, и после правки корпуса эмбеддинги пересчитываются.
+Кодирование - доли миллисекунды на ответ.
+
+Включение: QUIZ_ENCODER_BACKEND=lexical (порог - QUIZ_LEXICAL_THRESHOLD).
+
+Подбор порога и согласие с эталонными решениями:
+    python lexical.py --reference labelled --sweep     (размеченные пары lexical_calibration.tsv)
+    python lexical.py --sweep uploaded_files/*.xlsx   (решения трансформера на тестах сервера)
+Для трансформера нужна модель settings.MODEL_NAME; --reference questions
+сравнивает с разметкой "эталоны одного вопроса засчитываются, соседнего - нет".
+
+Порог по умолчанию 0.59 выбран на lexical_calibration.tsv: 145 пар, 72 верных
+ответа-перефразировки и 73 трудных неверных ответа по теме вопроса
+("Берлин это столица Германии" к "Париж это столица Франции" - 0.36,
+"тесто" к "тест" - 0.50):
+    порог 0.18 (прежний)  согласие 0.61  точность 0.56  полнота 1.00
+    порог 0.50            согласие 0.75  точность 0.70  полнота 0.88
+    порог 0.59            согласие 0.78  точность 0.76  полнота 0.81
+    порог 0.70            согласие 0.72  точность 0.85  полнота 0.54
+Без IDF и слов лучшее согласие на тех же парах - 0.76 (точность 0.74). Ответ
+с заменой одного термина ("90 градусам" вместо "180 градусам") набирает больше
+0.9, а синонимы без общих корней - меньше 0.4: лексический движок не заменяет
+трансформер. Где важна точность, включите каскад с cross-encoder
+(QUIZ_CROSS_ENCODER_MODEL): пограничные ответы он переоценит.
+"""
+
+import argparse
+import functools
+import glob
+import hashlib
+import os
+import sys
+import time
+import zlib
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from grading import normalize_answer
+
+DEFAULT_DIM = 2048
+DEFAULT_NGRAMS = (3, 5)
+CALIBRATION_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "lexical_calibration.tsv")
+
+
+def read_lines(file_path: str) -> List[str]:
+    """Непустые строки текстового файла без комментариев (#)"""
+    with open(file_path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+
+class LexicalEncoder:
+    """Кодировщик ответов хешированными символьными n-граммами и словами с весами IDF"""
+
+    def __init__(self, dim: int = DEFAULT_DIM, ngram_range=DEFAULT_NGRAMS, idf: Optional[np.ndarray] = None):
+        self.dim = dim
+        self.ngram_range = ngram_range
+        self.idf = None if idf is None else np.asarray(idf, dtype=np.float32)
+
+    def fit(self, corpus: List[str]) -> "LexicalEncoder":
+        """Обучает веса IDF на корпусе (сглаженный IDF: log((1 + N) / (1 + df)) + 1)"""
+        df = np.zeros(self.dim, dtype=np.float32)
+        for text in corpus:
+            df[np.unique(np.asarray(self._hashes(text), dtype=np.int64) % self.dim)] += 1
+        self.idf = (np.log((1.0 + len(corpus)) / (1.0 + df)) + 1.0).astype(np.float32)
+        return self
+
+    @property
+    def encoder_id(self) -> str:
+        encoder_id = f"lexical:char{self.ngram_range[0]}-{self.ngram_range[1]}+word:{self.dim}"
+        if self.idf is not None:
+            encoder_id += ":idf-" + hashlib.sha256(self.idf.tobytes()).hexdigest()[:12]
+        return encoder_id
+
+    def _hashes(self, text: str) -> List[int]:
+        hashes = []
+        low, high = self.ngram_range
+        for word in normalize_answer(text).split():
+            padded = f" {word} "
+            # Слово целиком - отдельный признак (префикс отделяет его от n-грамм)
+            hashes.append(zlib.crc32(("w" + padded).encode("utf-8")))
+            for n in range(low, high + 1):
+                if len(padded) < n:
+                    # Короткое слово целиком считается одной n-граммой
+                    hashes.append(zlib.crc32(padded.encode("utf-8")))
+                    break
+                for start in range(len(padded) - n + 1):
+                    hashes.append(zlib.crc32(padded[start:start + n].encode("utf-8")))
+        return hashes
+
+    def encode(self, texts: List[str], **kwargs) -> np.ndarray:
+        """Возвращает нормированные векторы (N, dim) float32"""
+        texts = list(texts)
+        rows, cols = [], []
+        for row, text in enumerate(texts):
+            hashes = self._hashes(text)
+            rows.extend([row] * len(hashes))
+            cols.extend(hashes)
+
+        # Частоты n-грамм всех текстов считаются одним bincount
+        flat = np.asarray(rows, dtype=np.int64) * self.dim + np.asarray(cols, dtype=np.int64) % self.dim
+        counts = np.bincount(flat, minlength=len(texts) * self.dim).astype(np.float32)
+        vectors = np.log1p(counts).reshape(len(texts), self.dim)
+        if self.idf is not None:
+            vectors *= self.idf
+
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+
+@functools.lru_cache(maxsize=None)
+def corpus_encoder(corpus_path: str) -> LexicalEncoder:
+    """Кодировщик с весами IDF, обученными на корпусе (один раз на процесс)"""
+    return LexicalEncoder().fit(read_lines(corpus_path))
+
+
+def pair_scores(model, pairs) -> np.ndarray:
+    """Косинусное сходство текстов каждой пары (a, b)"""
+    left = np.asarray(model.encode([a for a, _ in pairs]), dtype=np.float32)
+    right = np.asarray(model.encode([b for _, b in pairs]), dtype=np.float32)
+    left /= np.maximum(np.linalg.norm(left, axis=1, keepdims=True), 1e-12)
+    right /= np.maximum(np.linalg.norm(right, axis=1, keepdims=True), 1e-12)
+    return (left * right).sum(axis=1)
+
+
+def agreement(transformer_scores: np.ndarray, lexical_scores: np.ndarray,
+              transformer_threshold: float, lexical_threshold: float) -> dict:
+    """Согласие решений зачет/незачет двух движков (или движка и эталонной разметки)"""
+    a = transformer_scores >= transformer_threshold
+    b = lexical_scores >= lexical_threshold
+    n = len(a)
+    observed = float((a == b).mean()) if n else 0.0
+    expected = float(a.mean() * b.mean() + (1 - a.mean()) * (1 - b.mean())) if n else 0.0
+    kappa = (observed - expected) / (1 - expected) if expected < 1 else 1.0
+    correlation = float(np.corrcoef(transformer_scores, lexical_scores)[0, 1]) if n > 1 else 0.0
+    # Точность и полнота зачетов относительно эталонных решений
+    both = int((a & b).sum())
+    return {
+        "pairs": n,
+        "agreement": observed,
+        "cohen_kappa": kappa,
+        "score_correlation": correlation,
+        "reference_accepts": int(a.sum()),
+        "lexical_accepts": int(b.sum()),
+        "precision": both / int(b.sum()) if b.any() else 0.0,
+        "recall": both / int(a.sum()) if a.any() else 0.0,
+    }
+
+
+def labelled_pairs(reference_answers) -> List[Tuple[str, str, int]]:
+    """Пары эталонов с меткой: 1 - ответы одного вопроса, 0 - ответы соседнего вопроса.
+
+    Используется как замена оценок трансформера, когда модели нет: эталоны
+    одного вопроса должны засчитываться друг за друга, соседнего - нет.
+    """
+    pairs = []
+    for i, answers in enumerate(reference_answers):
+        neighbours = reference_answers[(i + 1) % len(reference_answers)] if len(reference_answers) > 1 else []
+        for a_idx, answer in enumerate(answers):
+            for other in answers[a_idx + 1:]:
+                pairs.append((answer, other, 1))
+            for other in neighbours[:2]:
+                pairs.append((answer, other, 0))
+    return pairs
+
+
+def calibration_pairs(file_path: str = CALIBRATION_FILE) -> List[Tuple[str, str, int]]:
+    """Размеченные пары (эталон, ответ, метка) из файла калибровки"""
+    pairs = []
+    for line in read_lines(file_path):
+        label, reference, answer = line.split("\t")
+        pairs.append((reference, answer, int(label)))
+    return pairs
+
+
+def sweep(reference_accepts: np.ndarray, lexical_scores: np.ndarray, thresholds) -> List[dict]:
+    """Согласие с эталонными решениями для каждого порога лексического движка"""
+    rows = []
+    for threshold in thresholds:
+        row = agreement(reference_accepts.astype(np.float32), lexical_scores, 0.5, float(threshold))
+        row["threshold"] = round(float(threshold), 3)
+        rows.append(row)
+    return rows
+
+
+def best_threshold(rows: List[dict]) -> float:
+    """Порог с наибольшей каппой; из равных по каппе порогов берется середина
+    диапазона, чтобы оставить запас с обеих сторон"""
+    best = max(row["cohen_kappa"] for row in rows)
+    plateau = [row["threshold"] for row in rows if row["cohen_kappa"] >= best - 1e-9]
+    return round((plateau[0] + plateau[-1]) / 2, 2)
+
+
+def main(argv=None):
+    import settings
+    from utils import read_quiz_file
+
+    parser = argparse.ArgumentParser(description="Согласие лексического движка с эталонными решениями")
+    parser.add_argument("files", nargs="*", help="файлы тестов (по умолчанию uploaded_files/*.xlsx)")
+    parser.add_argument("--threshold", type=float, default=settings.THRESHOLD)
+    parser.add_argument("--lexical-threshold", type=float, default=settings.LEXICAL_THRESHOLD)
+    parser.add_argument("--reference", choices=("transformer", "labelled", "questions"), default="transformer",
+                        help="с чем сравнивать: решения трансформера, размеченные пары "
+                             "lexical_calibration.tsv или принадлежность эталонов вопросу")
+    parser.add_argument("--sweep", action="store_true", help="подобрать порог по сетке 0.05..0.95 с шагом 0.01")
+    args = parser.parse_args(argv)
+
+    # Одинаковые пары (копии теста) не должны учитываться дважды
+    pairs = {}
+    if args.reference == "labelled":
+        for a, b, label in calibration_pairs():
+            pairs.setdefault((a, b), label)
+    else:
+        for file_path in args.files or glob.glob(os.path.join("uploaded_files", "*.xlsx")):
+            _, reference_answers = read_quiz_file(file_path)
+            if reference_answers:
+                for a, b, label in labelled_pairs(reference_answers):
+                    pairs.setdefault((a, b), label)
+    if not pairs:
+        print("Нет эталонных ответов для сравнения")
+        return 1
+    texts = list(pairs)
+
+    lexical = corpus_encoder(settings.LEXICAL_CORPUS)
+    started = time.perf_counter()
+    lexical_scores = pair_scores(lexical, texts)
+    lexical_ms = 1000.0 * (time.perf_counter() - started) / (2 * len(texts))
+
+    if args.reference == "transformer":
+        from encoders import load_encoder
+        reference_accepts = pair_scores(load_encoder(settings.MODEL_NAME, "torch"), texts) >= args.threshold
+    else:
+        reference_accepts = np.array(list(pairs.values()), dtype=bool)
+
+    if args.sweep:
+        rows = sweep(reference_accepts, lexical_scores, np.arange(5, 96) / 100)
+        print(f"pairs: {len(texts)}, reference_accepts: {int(reference_accepts.sum())}")
+        for row in rows[::5]:
+            print(f"threshold {row['threshold']:.2f}: agreement {row['agreement']:.3f} "
+                  f"kappa {row['cohen_kappa']:.3f} precision {row['precision']:.3f} "
+                  f"recall {row['recall']:.3f} accepts {row['lexical_accepts']}")
+        print(f"best_threshold: {best_threshold(rows)}")
+        return 0
+
+    report = agreement(reference_accepts.astype(np.float32), lexical_scores, 0.5, args.lexical_threshold)
+    report["lexical_ms_per_text"] = lexical_ms
+    for key, value in report.items():
+        print(f"{key}: {value}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,11 +3,9 @@ from fastapi import FastAPI, UploadFile, File, Form, Request, HTTPException, Dep
 from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-import pandas as pd
-from sentence_transformers import SentenceTransformer, util
 import os
-import re
-import torch
+import asyncio
+import threading
 from typing import List, Dict, Optional
 import glob
 import sqlite3
@@ -18,8 +16,29 @@ from fastapi.middleware.cors import CORSMiddleware
 from datetime import datetime
 import main2
 import app
-from session_manager import create_session, active_sessions
+from session_manager import create_session, remove_session, revoke_user_sessions, active_sessions
+from identity import (
+    get_user_from_session, get_user_by_login, get_request_permissions,
+    get_template_context, invalidate_user, profile_cache
+)
 from app import app as app_v2
+from grading import PackedEmbeddings, CompiledQuiz
+from quiz_state import QuizAttempt, create_attempt_store
+import quiz_catalog
+import embedding_files
+from embedding_store import EmbeddingStore, EmbeddingLRUCache
+import settings
+import database
+from database import get_db_connection, run_db, execute
+import jobs
+import inference
+import calibrate
+from batching import MicroBatcher
+from admission import AdmissionController, OverloadedError
+from encoders import load_encoder, encoder_id
+from utils import read_quiz_file
+from embedding_server import EmbeddingClient, EmbeddingServiceError
+from cascade import CascadeStats, CrossEncoderReranker, borderline, STAGES
 
 app = FastAPI()
 app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -28,13 +47,55 @@ app.mount("/v2", app_v2)
 app.mount("/main2", main2.app)
 
 # Глобальные данные
-MODEL_NAME = 'all-MiniLM-L6-v2'
-THRESHOLD = 0.833
-model = SentenceTransformer(MODEL_NAME)
-questions = []
-reference_answers = []
-user_answers = []
-all_embeddings = []
+MODEL_NAME = settings.MODEL_NAME
+THRESHOLD = settings.LEXICAL_THRESHOLD if settings.ENCODER_BACKEND == "lexical" else settings.THRESHOLD
+# При работе через сервис эмбеддингов модель в веб-процессе загружается только как запасной вариант
+embedding_client = (
+    EmbeddingClient(settings.EMBEDDING_SOCKET, settings.EMBEDDING_SOCKET_TIMEOUT)
+    if settings.EMBEDDING_SOCKET else None
+)
+model = None if embedding_client else load_encoder(MODEL_NAME, settings.ENCODER_BACKEND)
+model_lock = threading.Lock()
+# Эмбеддинги разных бэкендов немного отличаются, поэтому ключи кэшей учитывают бэкенд
+ENCODER_ID = encoder_id(MODEL_NAME, settings.ENCODER_BACKEND)
+# Потоки torch и размер батча из профиля калибровки (в пределах доли ядер одного воркера)
+inference_profile = calibrate.apply(ENCODER_ID, settings.WEB_WORKERS)
+embedding_store = EmbeddingStore(ENCODER_ID)
+answer_cache = EmbeddingLRUCache(int(settings.ANSWER_CACHE_MAX_MB * 1024 * 1024))
+# Попытки прохождения тестов по сессиям (тест, ответы и их оценки);
+# в хранилище sqlite попытку продолжает любой воркер, тест берется из его каталога
+attempt_store = create_attempt_store(quiz_catalog.catalog.get)
+os.register_at_fork(after_in_child=attempt_store.reset_after_fork)
+# Воркеры с общим сокетом получают запросы одной сессии вперемешку: сессии и
+# попытки должны храниться там, где их видят все воркеры
+if settings.WEB_WORKERS > 1 and "memory" in (settings.SESSION_BACKEND, settings.ATTEMPT_BACKEND):
+    raise RuntimeError(
+        "Для нескольких воркеров задайте общие хранилища: "
+        "QUIZ_SESSION_BACKEND=sqlite или signed и QUIZ_ATTEMPT_BACKEND=sqlite"
+    )
+# Ограничение одновременных проверок: лишние запросы ждут в очереди или получают 503
+grading_admission = AdmissionController(
+    settings.GRADING_MAX_CONCURRENCY,
+    settings.GRADING_MAX_QUEUE,
+    settings.GRADING_QUEUE_TIMEOUT,
+    settings.GRADING_RETRY_AFTER,
+)
+
+@app.exception_handler(OverloadedError)
+async def overloaded_handler(request: Request, exc: OverloadedError):
+    """Перегрузка проверки: 503 с подсказкой, когда повторить запрос"""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+# Фоновые задачи оценки (ссылки нужны, чтобы задачи не собрал сборщик мусора)
+scoring_tasks = set()
+# Счетчики и время стадий каскадной проверки
+cascade_stats = CascadeStats()
+# Cross-encoder для пограничных ответов (если задан в настройках)
+reranker = CrossEncoderReranker(settings.CROSS_ENCODER_MODEL) if settings.CROSS_ENCODER_MODEL else None
 
 # Папка для хранения загруженных файлов
 UPLOAD_DIR = "uploaded_files"
@@ -51,14 +112,6 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Проверяет пароль"""
     return hash_password(plain_password) == hashed_password
 
-def get_user_from_session(request: Request) -> Optional[str]:
-    """Получает пользователя из сессии"""
-    session_token = request.cookies.get("session_token")
-    if session_token:
-        from session_manager import get_user_from_session as get_session_user
-        return get_session_user(session_token)
-    return None
-
 def login_required(request: Request):
     """Декоратор для проверки аутентификации"""
     user = get_user_from_session(request)
@@ -68,40 +121,35 @@ def login_required(request: Request):
 
 # Инициализация базы данных с новой структурой
 def init_db():
-    conn = sqlite3.connect('users.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_type TEXT NOT NULL,
-            last_name TEXT NOT NULL,
-            first_name TEXT NOT NULL,
-            middle_name TEXT,
-            group_name TEXT,
-            login TEXT UNIQUE NOT NULL,
-            password TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Создаем тестового пользователя если его нет
-    cursor.execute("SELECT COUNT(*) FROM users WHERE login = 'admin'")
-    if cursor.fetchone()[0] == 0:
-        cursor.execute(
-            "INSERT INTO users (user_type, last_name, first_name, middle_name, group_name, login, password) VALUES (?, ?, ?, ?, ?, ?, ?)",
-            ("admin", "Иванов", "Иван", "Иванович", "Администраторы", "admin", hash_password("admin123"))
-        )
-        print("Создан тестовый пользователь: admin / admin123")
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_type TEXT NOT NULL,
+                last_name TEXT NOT NULL,
+                first_name TEXT NOT NULL,
+                middle_name TEXT,
+                group_name TEXT,
+                login TEXT UNIQUE NOT NULL,
+                password TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+    
+        # Создаем тестового пользователя если его нет
+        cursor.execute("SELECT COUNT(*) FROM users WHERE login = 'admin'")
+        if cursor.fetchone()[0] == 0:
+            cursor.execute(
+                "INSERT INTO users (user_type, last_name, first_name, middle_name, group_name, login, password) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                ("admin", "Иванов", "Иван", "Иванович", "Администраторы", "admin", hash_password("admin123"))
+            )
+            print("Создан тестовый пользователь: admin / admin123")
     
-    conn.commit()
-    conn.close()
+        conn.commit()
 
 init_db()
 
-def parse_quoted_strings(s):
-    """Парсит строку с ответами в кавычках, разделенных запятыми"""
-    return [m.group(1) for m in re.finditer(r'"([^"]*)"', s)]
-
 def get_uploaded_files():
     """Получает список загруженных файлов"""
     files = []
@@ -115,77 +163,6 @@ def get_uploaded_files():
         })
     return files
 
-def get_user_by_login(login: str):
-    """Получает пользователя из базы данных по логину"""
-    conn = sqlite3.connect('users.db')
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT id, user_type, last_name, first_name, middle_name, group_name, login, password, created_at 
-        FROM users WHERE login = ?
-    """, (login,))
-    user = cursor.fetchone()
-    conn.close()
-    
-    if user:
-        return {
-            "id": user[0],
-            "user_type": user[1],
-            "last_name": user[2],
-            "first_name": user[3],
-            "middle_name": user[4],
-            "group_name": user[5],
-            "login": user[6],
-            "password": user[7],  # Внимание: хранится в открытом виде!
-            "created_at": user[8]
-        }
-    return None
-
-def get_user_full_info(login: str):
-    """Получает полную информацию о пользователе для отображения"""
-    user = get_user_by_login(login)
-    if user:
-        # Формируем полное имя
-        full_name = f"{user['last_name']} {user['first_name']}"
-        if user['middle_name']:
-            full_name += f" {user['middle_name']}"
-        
-        return {
-            "login": user['login'],
-            "full_name": full_name,
-            "user_type": user['user_type'],
-            "group_name": user['group_name'],
-            "created_at": user['created_at']
-        }
-    return None
-
-
-def get_user_permissions(user_type: str):
-    """Возвращает доступные права пользователя"""
-    permissions = {
-        'can_view_tests': True,  # Все могут видеть тесты
-        'can_take_tests': True,  # Все могут проходить тесты
-        'can_upload_files': user_type in ['teacher', 'admin'],  # Только преподаватели и админы могут загружать файлы
-        'can_delete_files': user_type in ['teacher', 'admin'],  # Только преподаватели и админы могут удалять файлы
-        'can_manage_users': user_type == 'admin',  # Только админы могут управлять пользователями
-        'can_edit_tests': user_type in ['teacher', 'admin'],  # Только преподаватели и админы могут редактировать тесты
-    }
-    return permissions
-
-def get_template_context(request: Request):
-    """Возвращает контекст для шаблонов с информацией о пользователе"""
-    login = get_user_from_session(request)
-    if login:
-        user_info = get_user_full_info(login)
-        user_permissions = get_user_permissions(user_info['user_type'])
-        return {
-            "user_info": user_info,
-            "user_permissions": user_permissions
-        }
-    return {
-        "user_info": None,
-        "user_permissions": None
-    }
-
 @app.get("/", response_class=HTMLResponse)
 def login_page(request: Request):
     """Страница входа"""
@@ -225,7 +202,7 @@ def login(
         
         # Создаем сессию и устанавливаем cookie
         from session_manager import create_session
-        session_token = create_session(username)
+        session_token = create_session(username, user["user_type"])
         response = RedirectResponse(url="/select", status_code=303)
         response.set_cookie(key="session_token", value=session_token, httponly=True)
         return response
@@ -239,20 +216,19 @@ def login(
         return templates.TemplateResponse("login.html", context)
 
 @app.get("/select", response_class=HTMLResponse)
-def select_file_page(request: Request):
-    """Страница выбора файла с сервера"""
+def select_file_page(request: Request, job_id: Optional[str] = None):
+    """Страница выбора файла с сервера (job_id - задача расчета сохраненного теста)"""
     login = get_user_from_session(request)
     if not login:
         return RedirectResponse(url="/", status_code=303)
     
-    user_info = get_user_full_info(login)
-    user_permissions = get_user_permissions(user_info['user_type'])
     files = get_uploaded_files()
     
     context = get_template_context(request)
     context.update({
         "request": request,
-        "files": files
+        "files": files,
+        "job_id": job_id
     })
     
     return templates.TemplateResponse("select.html", context)
@@ -261,17 +237,16 @@ def select_file_page(request: Request):
 async def upload_file(request: Request, file: UploadFile = File(...)):
     """Загрузка нового файла на сервер"""
     # Проверяем авторизацию
-    user_login = get_user_from_session(request)
+    user_login = await run_db(get_user_from_session, request)
     if not user_login:
         return RedirectResponse(url="/", status_code=303)
     
     # Проверяем права доступа
-    user_info = get_user_full_info(user_login)
-    user_permissions = get_user_permissions(user_info['user_type'])
+    user_permissions = await run_db(get_request_permissions, request)
     
     if not user_permissions['can_upload_files']:
         files = get_uploaded_files()
-        context = get_template_context(request)
+        context = await run_db(get_template_context, request)
         context.update({
             "request": request,
             "files": files,
@@ -285,19 +260,24 @@ async def upload_file(request: Request, file: UploadFile = File(...)):
         with open(file_path, "wb") as f:
             f.write(await file.read())
         
+        # Считаем эмбеддинги в фоне, пока студенты еще не начали тест
+        job_id = jobs.enqueue(file_path)
+        
         # Возвращаем на страницу выбора файлов с сообщением об успехе
+        # (страница следит за задачей расчета через /jobs/{job_id})
         files = get_uploaded_files()
-        context = get_template_context(request)
+        context = await run_db(get_template_context, request)
         context.update({
             "request": request,
             "files": files,
-            "message": f"Файл {file.filename} успешно загружен!"
+            "message": f"Файл {file.filename} успешно загружен!",
+            "job_id": job_id
         })
         return templates.TemplateResponse("select.html", context)
         
     except Exception as e:
         files = get_uploaded_files()
-        context = get_template_context(request)
+        context = await run_db(get_template_context, request)
         context.update({
             "request": request,
             "files": files,
@@ -305,30 +285,162 @@ async def upload_file(request: Request, file: UploadFile = File(...)):
         })
         return templates.TemplateResponse("select.html", context)
 
+def get_model():
+    """Возвращает модель, загружая ее при первом обращении"""
+    global model
+    if model is None:
+        with model_lock:
+            if model is None:
+                model = load_encoder(MODEL_NAME, settings.ENCODER_BACKEND)
+                # torch загружен только сейчас - применяем число потоков из профиля
+                inference.set_threads(inference_profile["threads"])
+    return model
+
+def encode_texts(texts):
+    """Кодирует тексты: через сервис эмбеддингов, если он настроен, иначе моделью в пуле инференса"""
+    if embedding_client is not None:
+        try:
+            return embedding_client.encode(texts)
+        except EmbeddingServiceError as e:
+            print(f"Сервис эмбеддингов недоступен, кодируем в процессе: {e}")
+    batch_size = inference_profile["batch_size"]
+    return inference.run_sync(lambda batch: get_model().encode(batch, batch_size=batch_size), texts)
+
+answer_batcher = MicroBatcher(
+    encode_texts,
+    max_batch=settings.BATCH_MAX_SENTENCES,
+    max_wait_ms=settings.BATCH_MAX_WAIT_MS,
+)
+
+def build_embeddings(file_reference_answers) -> PackedEmbeddings:
+    """Строит упакованную матрицу эмбеддингов эталонных ответов"""
+    # Берем эмбеддинги эталонных ответов из хранилища (модель кодирует только новые)
+    # и упаковываем их в одну матрицу со смещениями по вопросам
+    flat_answers = [answer for answers_list in file_reference_answers for answer in answers_list]
+    embeddings = embedding_store.encode(flat_answers, encode_texts)
+    return PackedEmbeddings.from_flat(
+        embeddings, [len(a) for a in file_reference_answers], settings.EMBEDDING_DTYPE
+    )
+
+def compile_quiz(file_path: str, digest: str) -> CompiledQuiz:
+    """Читает файл теста и готовит его к проверке"""
+    # Тест, уже скомпилированный этим или другим воркером, открывается через mmap
+    quiz = embedding_files.load(file_path, digest, ENCODER_ID, settings.EMBEDDING_DTYPE)
+    if quiz is not None:
+        return quiz
+    
+    file_questions, file_reference_answers = read_quiz_file(file_path)
+    quiz = CompiledQuiz(file_questions, file_reference_answers, build_embeddings(file_reference_answers), file_path)
+    quiz.version = digest
+    try:
+        embedding_files.write(file_path, quiz, ENCODER_ID)
+    except OSError as e:
+        print(f"Не удалось сохранить эмбеддинги теста {file_path}: {e}")
+    return quiz
+
+def get_attempt(request: Request) -> Optional[QuizAttempt]:
+    """Возвращает попытку прохождения теста текущей сессии"""
+    return attempt_store.get(request.cookies.get("session_token"))
+
+quiz_catalog.catalog.set_compiler(compile_quiz)
+
+def precompute_quiz(file_path: str):
+    """Фоновая задача: заранее компилирует тест в общий каталог"""
+    quiz_catalog.catalog.get(file_path)
+
+jobs.set_handler(precompute_quiz)
+
+async def score_answers(answers_by_idx: Dict[int, str], quiz: CompiledQuiz):
+    """Оценивает ответы {номер вопроса: ответ} каскадом стадий.
+
+    Возвращает {номер: (сходство, индекс эталона, стадия, зачтен ли ответ)}.
+    Для ответов, решенных cross-encoder, сходство и индекс эталона остаются
+    от bi-encoder (одна шкала косинусного сходства для всех ответов), а
+    cross-encoder определяет только, зачтен ли ответ.
+    """
+    scores = {}
+    semantic_indices = []
+    
+    # Стадия 1: ответы, совпадающие с эталоном после нормализации, засчитываются без модели
+    with cascade_stats.timed("exact"):
+        for i, answer in answers_by_idx.items():
+            match = quiz.exact_index.match(i, answer)
+            if match is not None:
+                scores[i] = (1.0, match, "exact", True)
+            else:
+                semantic_indices.append(i)
+    cascade_stats.record("exact", len(scores))
+    
+    # Стадия 2: сходство с эталонами своего вопроса и сегментный max/argmax за один проход;
+    # промахи кэша кодируются в общем батче с ответами других студентов
+    borderline_indices = []
+    if semantic_indices:
+        with cascade_stats.timed("semantic"):
+            user_embeddings = await answer_cache.encode_async(
+                [answers_by_idx[i] for i in semantic_indices], answer_batcher.encode
+            )
+            best_scores, best_indices = quiz.embeddings.score(user_embeddings, semantic_indices)
+        for j, i in enumerate(semantic_indices):
+            similarity = float(best_scores[j])
+            scores[i] = (similarity, int(best_indices[j]), "semantic", similarity >= THRESHOLD)
+            if reranker is not None and borderline(similarity, THRESHOLD, settings.CASCADE_BAND):
+                borderline_indices.append(i)
+        cascade_stats.record("semantic", len(semantic_indices) - len(borderline_indices))
+    
+    # Стадия 3: пограничные ответы переоценивает cross-encoder
+    if borderline_indices:
+        items = [(answers_by_idx[i], quiz.reference_answers[i]) for i in borderline_indices]
+        with cascade_stats.timed("cross-encoder"):
+            reranked = await inference.run(reranker.best_scores, items)
+        for i, (cross_score, _) in zip(borderline_indices, reranked):
+            similarity, best_idx = scores[i][:2]
+            scores[i] = (similarity, best_idx, "cross-encoder", cross_score >= settings.CROSS_ENCODER_THRESHOLD)
+        cascade_stats.record("cross-encoder", len(borderline_indices))
+    
+    return scores
+
+async def score_answer_in_background(attempt: QuizAttempt, idx: int, answer: str):
+    """Фоновая оценка одного сохраненного ответа (инкрементальный режим).
+
+    Оценка занимает только свободное место проверки и не ждет в очереди: при
+    нагрузке ответ остается неоцененным и проверяется в /final_results.
+    """
+    try:
+        async with grading_admission.admit(wait=False):
+            scores = await score_answers({idx: answer}, attempt.quiz)
+    except OverloadedError:
+        return
+    except Exception as e:
+        print(f"Ошибка фоновой оценки ответа {idx}: {e}")
+        return
+    # Результат устарел, если ответ успел измениться
+    if attempt.answers[idx] == answer:
+        attempt.scores[idx] = (answer, scores[idx])
+
 async def load_quiz_data(request: Request, file_path: str):
     """Загружает данные викторины из файла и начинает тест"""
-    global questions, reference_answers, user_answers, all_embeddings
-    
     try:
-        df = pd.read_excel(file_path, engine='openpyxl', usecols=[0,1], header=None, names=['q','a'])
-        
-        questions = df['q'].astype(str).tolist()
-        reference_answers = [parse_quoted_strings(answers_str) for answers_str in df['a'].astype(str)]
+        # Если файл еще обрабатывается фоновой задачей, дожидаемся ее
+        # и берем готовые эмбеддинги вместо повторного расчета
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, jobs.wait_for_file, file_path)
         
-        # Создаем эмбеддинги для всех эталонных ответов
-        all_embeddings = []
-        for answers_list in reference_answers:
-            embeddings = model.encode(answers_list, convert_to_tensor=True)
-            all_embeddings.append(embeddings)
+        # Чтение файла и кодирование выполняются вне цикла событий
+        # Скомпилированный тест общий для всех сессий, открывших тот же файл
+        async with grading_admission.admit():
+            quiz = await loop.run_in_executor(None, quiz_catalog.catalog.get, file_path)
         
-        user_answers = []
+        # Новая попытка только для этой сессии, другие студенты ее не затрагивают
+        await run_db(attempt_store.start, request.cookies.get("session_token"), quiz)
         
         # Перенаправляем на первый вопрос
         return RedirectResponse(url="/quiz?idx=0", status_code=303)
         
+    except OverloadedError:
+        raise
     except Exception as e:
         files = get_uploaded_files()
-        context = get_template_context(request)
+        context = await run_db(get_template_context, request)
         context.update({
             "request": request,
             "files": files,
@@ -340,14 +452,14 @@ async def load_quiz_data(request: Request, file_path: str):
 async def select_existing_file(request: Request, filename: str = Form(...)):
     """Выбор существующего файла с сервера и начало теста"""
     # Проверяем авторизацию
-    user = get_user_from_session(request)
+    user = await run_db(get_user_from_session, request)
     if not user:
         return RedirectResponse(url="/", status_code=303)
     
     file_path = os.path.join(UPLOAD_DIR, filename)
     if not os.path.exists(file_path):
         files = get_uploaded_files()
-        context = get_template_context(request)
+        context = await run_db(get_template_context, request)
         context.update({
             "request": request,
             "files": files,
@@ -368,16 +480,46 @@ def get_files_list(request: Request):
     files = get_uploaded_files()
     return {"files": files}
 
+@app.get("/metrics", response_class=JSONResponse)
+def get_metrics(request: Request):
+    """API со счетчиками кэшей и очередей проверки"""
+    user = get_user_from_session(request)
+    if not user:
+        raise HTTPException(status_code=401, detail="Требуется авторизация")
+    
+    return {
+        "answer_cache": answer_cache.stats(),
+        "answer_batcher": answer_batcher.stats(),
+        "inference_profile": inference_profile,
+        "grading_admission": grading_admission.stats(),
+        "profile_cache": profile_cache.stats(),
+        "database": database.stats(),
+        "cascade": cascade_stats.stats(),
+        "attempts": attempt_store.stats(),
+        "quiz_catalog": quiz_catalog.catalog.stats()
+    }
+
+@app.get("/jobs/{job_id}", response_class=JSONResponse)
+def get_job_status(request: Request, job_id: str):
+    """API статуса фоновой задачи расчета эмбеддингов"""
+    user = get_user_from_session(request)
+    if not user:
+        raise HTTPException(status_code=401, detail="Требуется авторизация")
+    
+    job = jobs.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+    return job
+
 @app.post("/delete_file")
 async def delete_file(request: Request, filename: str = Form(...)):
     """Удаление файла с сервера"""
-    user_login = get_user_from_session(request)
+    user_login = await run_db(get_user_from_session, request)
     if not user_login:
         raise HTTPException(status_code=401, detail="Требуется авторизация")
     
     # Проверяем права доступа
-    user_info = get_user_full_info(user_login)
-    user_permissions = get_user_permissions(user_info['user_type'])
+    user_permissions = await run_db(get_request_permissions, request)
     
     if not user_permissions['can_delete_files']:
         raise HTTPException(status_code=403, detail="У вас нет прав для удаления файлов")
@@ -386,6 +528,8 @@ async def delete_file(request: Request, filename: str = Form(...)):
         file_path = os.path.join(UPLOAD_DIR, filename)
         if os.path.exists(file_path):
             os.remove(file_path)
+            embedding_files.remove(file_path)
+            quiz_catalog.invalidate(file_path)
             return JSONResponse({"status": "success", "message": f"Файл {filename} удален"})
         else:
             return JSONResponse({"status": "error", "message": "Файл не найден"})
@@ -401,21 +545,17 @@ def admin_users_page(request: Request):
         return RedirectResponse(url="/", status_code=303)
     
     # Проверяем права доступа
-    user_info = get_user_full_info(login)
-    user_permissions = get_user_permissions(user_info['user_type'])
+    user_permissions = get_request_permissions(request)
     
     if not user_permissions['can_manage_users']:
         # Если нет прав, перенаправляем на главную страницу тестов
         return RedirectResponse(url="/select", status_code=303)
     
-    conn = sqlite3.connect('users.db')
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT id, user_type, last_name, first_name, middle_name, group_name, login, password, created_at 
-        FROM users ORDER BY created_at DESC
-    """)
-    users_data = cursor.fetchall()
-    conn.close()
+    with get_db_connection() as conn:
+        users_data = conn.execute("""
+            SELECT id, user_type, last_name, first_name, middle_name, group_name, login, password, created_at 
+            FROM users ORDER BY created_at DESC
+        """).fetchall()
     
     # Форматируем данные для отображения
     users = []
@@ -454,28 +594,24 @@ async def add_user(
     password: str = Form(...)
 ):
     """Добавление нового пользователя"""
-    current_login = get_user_from_session(request)
+    current_login = await run_db(get_user_from_session, request)
     if not current_login:
         raise HTTPException(status_code=401, detail="Требуется авторизация")
     
     # Проверяем права доступа
-    current_user_info = get_user_full_info(current_login)
-    user_permissions = get_user_permissions(current_user_info['user_type'])
+    user_permissions = await run_db(get_request_permissions, request)
     
     if not user_permissions['can_manage_users']:
         raise HTTPException(status_code=403, detail="У вас нет прав для добавления пользователей")
     
     try:
-        conn = sqlite3.connect('users.db')
-        cursor = conn.cursor()
-        cursor.execute(
+        await execute(
             """INSERT INTO users 
             (user_type, last_name, first_name, middle_name, group_name, login, password) 
             VALUES (?, ?, ?, ?, ?, ?, ?)""",
             (user_type, last_name, first_name, middle_name, group_name, login, password)
         )
-        conn.commit()
-        conn.close()
+        invalidate_user(login)
         return JSONResponse({"status": "success", "message": f"Пользователь {login} создан"})
     except sqlite3.IntegrityError:
         return JSONResponse({"status": "error", "message": "Пользователь с таким логином уже существует"})
@@ -485,23 +621,29 @@ async def add_user(
 @app.post("/admin/delete_user")
 async def delete_user(request: Request, user_id: int = Form(...)):
     """Удаление пользователя"""
-    current_login = get_user_from_session(request)
+    current_login = await run_db(get_user_from_session, request)
     if not current_login:
         raise HTTPException(status_code=401, detail="Требуется авторизация")
     
     # Проверяем права доступа
-    current_user_info = get_user_full_info(current_login)
-    user_permissions = get_user_permissions(current_user_info['user_type'])
+    user_permissions = await run_db(get_request_permissions, request)
     
     if not user_permissions['can_manage_users']:
         raise HTTPException(status_code=403, detail="У вас нет прав для удаления пользователей")
     
     try:
-        conn = sqlite3.connect('users.db')
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM users WHERE id = ?", (user_id,))
-        conn.commit()
-        conn.close()
+        def apply_delete():
+            with get_db_connection() as conn:
+                deleted = conn.execute("SELECT login FROM users WHERE id = ?", (user_id,)).fetchone()
+                conn.execute("DELETE FROM users WHERE id = ?", (user_id,))
+                conn.commit()
+                return deleted
+        
+        deleted = await run_db(apply_delete)
+        # Сессии удаленного пользователя завершаются (в том числе подписанные токены)
+        if deleted:
+            await run_db(revoke_user_sessions, deleted[0])
+            invalidate_user(deleted[0])
         return JSONResponse({"status": "success", "message": "Пользователь удален"})
     except Exception as e:
         return JSONResponse({"status": "error", "message": str(e)})
@@ -513,20 +655,20 @@ def quiz_form(request: Request, idx: int = 0):
     if not login:
         return RedirectResponse(url="/", status_code=303)
     
-    user_info = get_user_full_info(login)
-    user_permissions = get_user_permissions(user_info['user_type'])
+    attempt = get_attempt(request)
+    if not attempt:
+        return RedirectResponse(url="/select", status_code=303)
     
+    questions = attempt.quiz.questions
     if idx >= len(questions):
         return RedirectResponse(url="/final_results", status_code=303)
     
-    current_answer = user_answers[idx] if idx < len(user_answers) else ""
-    
     context = get_template_context(request)
     context.update({
         "request": request,
         "question": questions[idx],
         "idx": idx,
-        "current_answer": current_answer,
+        "current_answer": attempt.answers[idx],
         "total_questions": len(questions),
         "questions": questions
     })
@@ -535,23 +677,33 @@ def quiz_form(request: Request, idx: int = 0):
 
 @app.post("/answer")
 async def save_answer(request: Request, idx: int = Form(...), user_answer: str = Form(...)):
-    user = get_user_from_session(request)
+    user = await run_db(get_user_from_session, request)
     if not user:
         raise HTTPException(status_code=401, detail="Требуется авторизация")
     
-    global user_answers
+    attempt = await run_db(get_attempt, request)
+    if not attempt:
+        raise HTTPException(status_code=409, detail="Тест не начат")
+    
     try:
-        while len(user_answers) <= idx:
-            user_answers.append("")
-            
-        user_answers[idx] = user_answer.strip()
+        answer = user_answer.strip()
+        if attempt.set_answer(idx, answer):
+            await run_db(attempt_store.save_answer, request.cookies.get("session_token"), idx, answer)
+        
+        # Инкрементальный режим: оцениваем ответ сразу, повторно - только если он изменился
+        cached = attempt.scores.get(idx)
+        if settings.INCREMENTAL_GRADING and answer and not (cached and cached[0] == answer):
+            task = asyncio.create_task(score_answer_in_background(attempt, idx, answer))
+            scoring_tasks.add(task)
+            task.add_done_callback(scoring_tasks.discard)
+        
         return JSONResponse({"status": "success"})
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.post("/navigate")
 async def navigate_question(request: Request, current_idx: int = Form(...), direction: str = Form(...)):
-    user = get_user_from_session(request)
+    user = await run_db(get_user_from_session, request)
     if not user:
         raise HTTPException(status_code=401, detail="Требуется авторизация")
     
@@ -561,10 +713,13 @@ async def navigate_question(request: Request, current_idx: int = Form(...), dire
         else:
             new_idx = current_idx - 1
         
+        attempt = await run_db(get_attempt, request)
+        total_questions = attempt.total if attempt else 0
+        
         # Проверяем границы
         if new_idx < 0:
             new_idx = 0
-        elif new_idx >= len(questions):
+        elif new_idx >= total_questions:
             # Если пытаемся перейти за последний вопрос - перенаправляем на завершение
             return RedirectResponse(url="/final_results", status_code=303)
         
@@ -574,22 +729,20 @@ async def navigate_question(request: Request, current_idx: int = Form(...), dire
 
 async def check_test_completion(request: Request):
     """Общая логика проверки завершения теста"""
-    user = get_user_from_session(request)
+    user = await run_db(get_user_from_session, request)
     if not user:
         raise HTTPException(status_code=401, detail="Требуется авторизация")
     
-    global user_answers, questions
-    unanswered = []
-    
-    for i in range(len(questions)):
-        if i >= len(user_answers) or not user_answers[i].strip():
-            unanswered.append(i + 1)
+    attempt = await run_db(get_attempt, request)
+    if not attempt:
+        raise HTTPException(status_code=409, detail="Тест не начат")
     
+    # Счетчик отвеченных вопросов ведется при сохранении ответов, проверка - O(1)
     return {
-        "completed": len(unanswered) == 0,
-        "unanswered": unanswered,
-        "total_questions": len(questions),
-        "answered_count": sum(1 for ans in user_answers if ans and ans.strip())
+        "completed": attempt.is_complete(),
+        "unanswered": attempt.unanswered(),
+        "total_questions": attempt.total,
+        "answered_count": attempt.answered_count
     }
 
 @app.post("/check_completion")
@@ -603,40 +756,77 @@ async def check_test_completion_get(request: Request):
     return await check_test_completion(request)
 
 @app.get("/final_results", response_class=HTMLResponse)
-def show_final_results(request: Request):
-    user = get_user_from_session(request)
+async def show_final_results(request: Request):
+    user = await run_db(get_user_from_session, request)
     if not user:
         return RedirectResponse(url="/", status_code=303)
     
-    user_info = get_user_full_info(user)
-    user_permissions = get_user_permissions(user_info['user_type'])
-    global user_answers, questions
-    
-    if len(user_answers) < len(questions):
-        for i in range(len(questions)):
-            if i >= len(user_answers) or not user_answers[i].strip():
-                context = get_template_context(request)
-                context.update({
-                    "request": request,
-                    "unanswered_index": i,
-                    "total_questions": len(questions),
-                    "answered_count": sum(1 for ans in user_answers if ans and ans.strip())
-                })
-                return templates.TemplateResponse("complete_all.html", context)
-    
-    user_embeddings = model.encode(user_answers, convert_to_tensor=True)
+    attempt = await run_db(get_attempt, request)
+    if not attempt:
+        return RedirectResponse(url="/select", status_code=303)
+    
+    if not attempt.is_complete():
+        unanswered = attempt.unanswered()
+        context = await run_db(get_template_context, request)
+        context.update({
+            "request": request,
+            "unanswered": unanswered,
+            "unanswered_index": unanswered[0] - 1,
+            "total_questions": attempt.total,
+            "answered_count": attempt.answered_count
+        })
+        return templates.TemplateResponse("complete_all.html", context)
+    
+    # Повторный просмотр с теми же ответами не требует новой проверки
+    graded = attempt.cached_results()
+    if graded is None:
+        graded = await grade_attempt(attempt)
+    
+    total_questions = attempt.total
+    total_correct = graded["total_correct"]
+    percentage = (total_correct / total_questions) * 100 if total_questions > 0 else 0
+    
+    context = await run_db(get_template_context, request)
+    context.update({
+        "request": request,
+        "results": graded["results"],
+        "total_correct": total_correct,
+        "total_questions": total_questions,
+        "percentage": f"{percentage:.1f}",
+        "threshold": THRESHOLD,
+        "exact_matches": graded["stage_counts"]["exact"],
+        "stage_counts": graded["stage_counts"]
+    })
+    
+    return templates.TemplateResponse("final_results.html", context)
+
+async def grade_attempt(attempt: QuizAttempt) -> dict:
+    """Проверяет все ответы попытки и запоминает итоги до следующего изменения ответов"""
+    quiz = attempt.quiz
+    questions = quiz.questions
+    reference_answers = quiz.reference_answers
+    answers = list(attempt.answers)
+    fingerprint = attempt.fingerprint()
+    
+    # В инкрементальном режиме большая часть ответов уже оценена при сохранении;
+    # здесь досчитываются только неоцененные и измененные
+    scores = {}
+    for i, answer in enumerate(answers):
+        cached = attempt.scores.get(i)
+        if cached and cached[0] == answer:
+            scores[i] = cached[1]
+    missing = {i: answer for i, answer in enumerate(answers) if i not in scores}
+    if missing:
+        async with grading_admission.admit():
+            scores.update(await score_answers(missing, quiz))
+    
     results = []
     total_correct = 0
     
-    for i, (user_emb, user_answer) in enumerate(zip(user_embeddings, user_answers)):
-        question_embeddings = all_embeddings[i]
-        similarities = util.cos_sim(user_emb, question_embeddings)[0]
-        
-        max_sim_idx = int(similarities.argmax())
-        max_similarity = float(similarities[max_sim_idx])
-        best_reference_answer = reference_answers[i][max_sim_idx]
+    for i, user_answer in enumerate(answers):
+        max_similarity, best_idx, decided_by, is_correct = scores[i]
+        best_reference_answer = reference_answers[i][best_idx] if best_idx >= 0 else ""
         
-        is_correct = max_similarity >= THRESHOLD
         if is_correct:
             total_correct += 1
         
@@ -647,27 +837,24 @@ def show_final_results(request: Request):
             "score": f"{max_similarity:.2f}",
             "best_reference_answer": best_reference_answer,
             "reference_answers": reference_answers[i],
-            "max_similarity": max_similarity
+            "max_similarity": max_similarity,
+            "decided_by": decided_by
         })
     
-    total_questions = len(questions)
-    percentage = (total_correct / total_questions) * 100 if total_questions > 0 else 0
-    
-    context = get_template_context(request)
-    context.update({
-        "request": request,
+    graded = {
         "results": results,
         "total_correct": total_correct,
-        "total_questions": total_questions,
-        "percentage": f"{percentage:.1f}",
-        "threshold": THRESHOLD
-    })
-    
-    return templates.TemplateResponse("final_results.html", context)
+        "stage_counts": {stage: sum(1 for i in scores if scores[i][2] == stage) for stage in STAGES}
+    }
+    attempt.store_results(fingerprint, graded)
+    return graded
 
 @app.get("/logout")
-def logout():
+def logout(request: Request):
     """Выход из системы"""
+    session_token = request.cookies.get("session_token")
+    attempt_store.remove(session_token)
+    remove_session(session_token)
     response = RedirectResponse(url="/", status_code=303)
     response.delete_cookie("session_token")
     return response
@@ -679,12 +866,17 @@ def redirect_to_editor(request: Request):
     if not user:
         return RedirectResponse(url="/", status_code=303)
     
-    user_info = get_user_full_info(user)
-    user_permissions = get_user_permissions(user_info['user_type'])
+    user_permissions = get_request_permissions(request)
     
     if not user_permissions['can_edit_tests']:
         return RedirectResponse(url="/select", status_code=303)
     
     return RedirectResponse(url="/main2", status_code=307)
 # Для запуска:
-# uvicorn main:app --reload
\ No newline at end of file
+# uvicorn main:app --reload
+# Несколько воркеров с общей предзагруженной моделью (сессии и попытки - в общей базе):
+# QUIZ_SESSION_BACKEND=sqlite QUIZ_ATTEMPT_BACKEND=sqlite python serve.py --workers 4
+# Подбор потоков и размера батча под машину (профиль применяется при старте):
+# python calibrate.py
+# Оценка без torch (TF-IDF по символьным n-граммам, см. lexical.py):
+# QUIZ_ENCODER_BACKEND=lexical uvicorn main:app
@@ -1,5 +1,5 @@
 from fastapi import FastAPI, Request, Form, File, UploadFile, HTTPException, Depends
-from fastapi.responses import HTMLResponse, FileResponse, JSONResponse
+from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, RedirectResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 import pandas as pd
@@ -8,80 +8,20 @@ from pathlib import Path
 from utils import parse_answers, format_answers, process_excel_file, save_excel_file, create_new_excel_file
 import json
 import shutil
-import sqlite3
 import secrets
 import sys
 import importlib
-from session_manager import get_user_from_session as get_main_session_user
+from identity import get_user_from_session, get_request_user_info, get_request_permissions
+from database import run_db
 import ast
+import jobs
+import quiz_catalog
 
 app = FastAPI(title="Excel Questions Editor")
 
 # Создаем директории
 Path("uploaded_filesd_filesd_files").mkdir(exist_ok=True)
 
-def get_user_from_session(request: Request) -> str:
-    """Получает пользователя из сессии (совместимо с основным приложением)"""
-    session_token = request.cookies.get("session_token")
-    if session_token:
-        return get_main_session_user(session_token)
-    return None
-
-def get_user_by_login(login: str):
-    """Получает пользователя из базы данных по логину"""
-    conn = sqlite3.connect('users.db')
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT id, user_type, last_name, first_name, middle_name, group_name, login, password, created_at 
-        FROM users WHERE login = ?
-    """, (login,))
-    user = cursor.fetchone()
-    conn.close()
-    
-    if user:
-        return {
-            "id": user[0],
-            "user_type": user[1],
-            "last_name": user[2],
-            "first_name": user[3],
-            "middle_name": user[4],
-            "group_name": user[5],
-            "login": user[6],
-            "password": user[7],
-            "created_at": user[8]
-        }
-    return None
-
-def get_user_full_info(login: str):
-    """Получает полную информацию о пользователе для отображения"""
-    user = get_user_by_login(login)
-    if user:
-        # Формируем полное имя
-        full_name = f"{user['last_name']} {user['first_name']}"
-        if user['middle_name']:
-            full_name += f" {user['middle_name']}"
-        
-        return {
-            "login": user['login'],
-            "full_name": full_name,
-            "user_type": user['user_type'],
-            "group_name": user['group_name'],
-            "created_at": user['created_at']
-        }
-    return None
-
-def get_user_permissions(user_type: str):
-    """Возвращает доступные права пользователя"""
-    permissions = {
-        'can_view_tests': True,  # Все могут видеть тесты
-        'can_take_tests': True,  # Все могут проходить тесты
-        'can_upload_files': user_type in ['teacher', 'admin'],  # Только преподаватели и админы могут загружать файлы
-        'can_delete_files': user_type in ['teacher', 'admin'],  # Только преподаватели и админы могут удалять файлы
-        'can_manage_users': user_type == 'admin',  # Только админы могут управлять пользователями
-        'can_edit_tests': user_type in ['teacher', 'admin'],  # Только преподаватели и админы могут редактировать тесты
-    }
-    return permissions
-
 # Создаем директории
 Path("uploaded_filesd_filesd_files").mkdir(exist_ok=True)
 
@@ -91,14 +31,14 @@ templates = Jinja2Templates(directory="templates")
 @app.get("/", response_class=HTMLResponse)
 async def home(request: Request):
     # Проверяем авторизацию
-    user_login = get_user_from_session(request)
+    user_login = await run_db(get_user_from_session, request)
     if not user_login:
         from fastapi.responses import RedirectResponse
         return RedirectResponse(url="/", status_code=303)  # Redirect to main app login
     
     # Проверяем права доступа
-    user_info = get_user_full_info(user_login)
-    user_permissions = get_user_permissions(user_info['user_type'])
+    user_info = await run_db(get_request_user_info, request)
+    user_permissions = await run_db(get_request_permissions, request)
     
     if not user_permissions['can_edit_tests']:
         from fastapi.responses import RedirectResponse
@@ -116,13 +56,13 @@ async def home(request: Request):
 @app.post("/upload")
 async def upload_file(request: Request, file: UploadFile = File(...)):
     # Проверяем авторизацию
-    user_login = get_user_from_session(request)
+    user_login = await run_db(get_user_from_session, request)
     if not user_login:
         raise HTTPException(status_code=401, detail="Требуется авторизация")
     
     # Проверяем права доступа
-    user_info = get_user_full_info(user_login)
-    user_permissions = get_user_permissions(user_info['user_type'])
+    user_info = await run_db(get_request_user_info, request)
+    user_permissions = await run_db(get_request_permissions, request)
     
     if not user_permissions['can_edit_tests']:
         raise HTTPException(status_code=403, detail="У вас нет прав для редактирования тестов")
@@ -172,13 +112,12 @@ async def save_file(
     answers: list[str] = Form(...)
 ):
     # Проверяем авторизацию
-    user_login = get_user_from_session(request)
+    user_login = await run_db(get_user_from_session, request)
     if not user_login:
         raise HTTPException(status_code=401, detail="Требуется авторизация")
     
     # Проверяем права доступа
-    user_info = get_user_full_info(user_login)
-    user_permissions = get_user_permissions(user_info['user_type'])
+    user_permissions = await run_db(get_request_permissions, request)
     
     if not user_permissions['can_edit_tests']:
         raise HTTPException(status_code=403, detail="У вас нет прав для редактирования тестов")
@@ -247,7 +186,11 @@ async def save_file(
                     "Answers": row[1] if len(row) > 1 else ""
                 })
         
-        return RedirectResponse(url="/select", status_code=303)
+        # Сбрасываем скомпилированную версию и пересчитываем тест в фоне
+        quiz_catalog.invalidate(output_path)
+        job_id = jobs.enqueue(output_path)
+        
+        return RedirectResponse(url=f"/select?job_id={job_id}", status_code=303)
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка сохранения: {str(e)}")
@@ -256,13 +199,12 @@ async def save_file(
 async def download_file(filename: str, request: Request = None):
     if request:
         # Проверяем авторизацию
-        user_login = get_user_from_session(request)
+        user_login = await run_db(get_user_from_session, request)
         if not user_login:
             raise HTTPException(status_code=401, detail="Требуется авторизация")
         
         # Проверяем права доступа
-        user_info = get_user_full_info(user_login)
-        user_permissions = get_user_permissions(user_info['user_type'])
+        user_permissions = await run_db(get_request_permissions, request)
         
         if not user_permissions['can_edit_tests']:
             raise HTTPException(status_code=403, detail="У вас нет прав для скачивания файлов")
@@ -280,14 +222,14 @@ async def download_file(filename: str, request: Request = None):
 @app.get("/create-new")
 async def create_new(request: Request):
     # Проверяем авторизацию
-    user_login = get_user_from_session(request)
+    user_login = await run_db(get_user_from_session, request)
     if not user_login:
         from fastapi.responses import RedirectResponse
         return RedirectResponse(url="/", status_code=303)  # Redirect to main app login
     
     # Проверяем права доступа
-    user_info = get_user_full_info(user_login)
-    user_permissions = get_user_permissions(user_info['user_type'])
+    user_info = await run_db(get_request_user_info, request)
+    user_permissions = await run_db(get_request_permissions, request)
     
     if not user_permissions['can_edit_tests']:
         from fastapi.responses import RedirectResponse
@@ -306,14 +248,14 @@ async def create_new(request: Request):
 
 @app.get("/edit/{filename}")
 async def edit(filename: str, request: Request):
-    user_login = get_user_from_session(request)
+    user_login = await run_db(get_user_from_session, request)
     if not user_login:
         from fastapi.responses import RedirectResponse
         return RedirectResponse(url="/", status_code=303)
 
     # Проверяем права доступа
-    user_info = get_user_full_info(user_login)
-    user_permissions = get_user_permissions(user_info['user_type'])
+    user_info = await run_db(get_request_user_info, request)
+    user_permissions = await run_db(get_request_permissions, request)
     
     if not user_permissions['can_edit_tests']:
         from fastapi.responses import RedirectResponse
@@ -428,7 +370,7 @@ async def save_edit(
     questions: list[str] = Form(...),
     answers: list[str] = Form(...)
 ):
-    user_login = get_user_from_session(request)
+    user_login = await run_db(get_user_from_session, request)
     if not user_login:
         return JSONResponse(
             content={"error": "Не авторизован"},
@@ -436,8 +378,7 @@ async def save_edit(
         )
     
     # Проверяем права
-    user_info = get_user_full_info(user_login)
-    user_permissions = get_user_permissions(user_info['user_type'])
+    user_permissions = await run_db(get_request_permissions, request)
     
     if not user_permissions['can_edit_tests']:
         return JSONResponse(
@@ -469,12 +410,17 @@ async def save_edit(
         # Используем нашу утилиту для сохранения без заголовков
         save_excel_file(str(file_path), data)
 
+        # Сбрасываем скомпилированную версию и пересчитываем тест в фоне
+        quiz_catalog.invalidate(str(file_path))
+        job_id = jobs.enqueue(str(file_path))
+
         # Возвращаем JSON ответ для асинхронного запроса
         return JSONResponse(
             content={
                 "success": True,
                 "message": f"Файл {filename} успешно сохранен",
-                "filename": filename
+                "filename": filename,
+                "job_id": job_id
             }
         )
     except Exception as e:
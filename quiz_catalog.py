@@ -0,0 +1,162 @@
+"""Общий для процесса каталог скомпилированных тестов.
+
+Вопросы, разобранные эталонные ответы и матрицы эмбеддингов хранятся один раз
+на файл и раздаются всем сессиям только для чтения. Запись ищется по пути
+и (mtime, size) файла, а при изменении файла - по хешу содержимого, так что
+пересохраненный без изменений файл не компилируется заново. Каталог ограничен
+по объему памяти и вытесняет давно не использованные тесты.
+
+Компиляцию регистрирует основное приложение через set_compiler, поэтому
+main2 может сбрасывать записи, не загружая модель.
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional
+
+import settings
+from grading import CompiledQuiz
+
+
+def file_digest(file_path: str) -> str:
+    """Хеш содержимого файла"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class QuizCatalog:
+    """LRU-каталог скомпилированных тестов, ограниченный по байтам"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._compiler: Optional[Callable[[str, str], CompiledQuiz]] = None
+        self._by_digest = OrderedDict()  # хеш содержимого -> CompiledQuiz
+        self._by_path = {}  # путь -> ((mtime_ns, size), хеш содержимого)
+        self._lock = threading.Lock()
+        # путь -> [threading.Lock, число потоков, ожидающих или компилирующих файл];
+        # запись удаляется, когда последний поток закончил
+        self._compile_locks = {}
+
+    def set_compiler(self, compiler: Callable[[str, str], CompiledQuiz]) -> None:
+        """Регистрирует функцию компиляции compiler(путь, хеш содержимого)"""
+        self._compiler = compiler
+
+    def _lookup(self, path: str, stat_key) -> Optional[CompiledQuiz]:
+        with self._lock:
+            known = self._by_path.get(path)
+            if known and known[0] == stat_key and known[1] in self._by_digest:
+                self._by_digest.move_to_end(known[1])
+                self.hits += 1
+                return self._by_digest[known[1]]
+        return None
+
+    def get(self, file_path: str) -> CompiledQuiz:
+        """Возвращает скомпилированный тест, компилируя его при необходимости"""
+        path = os.path.abspath(str(file_path))
+        st = os.stat(path)
+        stat_key = (st.st_mtime_ns, st.st_size)
+
+        quiz = self._lookup(path, stat_key)
+        if quiz is not None:
+            return quiz
+
+        # Один файл компилирует только один поток, остальные ждут результат
+        with self._lock:
+            entry = self._compile_locks.get(path)
+            if entry is None:
+                entry = self._compile_locks[path] = [threading.Lock(), 0]
+            entry[1] += 1
+        try:
+            with entry[0]:
+                return self._compile(path, stat_key)
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._compile_locks[path]
+
+    def _compile(self, path: str, stat_key) -> CompiledQuiz:
+        quiz = self._lookup(path, stat_key)
+        if quiz is not None:
+            return quiz
+
+        digest = file_digest(path)
+        with self._lock:
+            quiz = self._by_digest.get(digest)
+            if quiz is not None:
+                # Содержимое не изменилось (или совпадает с другим файлом)
+                self._by_digest.move_to_end(digest)
+                self._by_path[path] = (stat_key, digest)
+                self.hits += 1
+                return quiz
+            self.misses += 1
+
+        if self._compiler is None:
+            raise RuntimeError("Компилятор тестов не зарегистрирован")
+        quiz = self._compiler(path, digest)
+        quiz.version = digest
+
+        with self._lock:
+            if digest not in self._by_digest:
+                self._by_digest[digest] = quiz
+                self.current_bytes += quiz.nbytes()
+            self._by_path[path] = (stat_key, digest)
+            self._evict()
+        return quiz
+
+    def _evict(self):
+        while self.current_bytes > self.max_bytes and len(self._by_digest) > 1:
+            digest, quiz = self._by_digest.popitem(last=False)
+            self.current_bytes -= quiz.nbytes()
+            self.evictions += 1
+            for path in [p for p, (_, d) in self._by_path.items() if d == digest]:
+                del self._by_path[path]
+
+    def invalidate(self, file_path: str) -> None:
+        """Сбрасывает запись файла (вызывается при сохранении или удалении)"""
+        path = os.path.abspath(str(file_path))
+        with self._lock:
+            known = self._by_path.pop(path, None)
+            if not known:
+                return
+            digest = known[1]
+            # Тест остается в каталоге, если его содержимое разделяет другой файл
+            if any(d == digest for _, d in self._by_path.values()):
+                return
+            quiz = self._by_digest.pop(digest, None)
+            if quiz is not None:
+                self.current_bytes -= quiz.nbytes()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "quizzes": len(self._by_digest),
+                "files": len(self._by_path),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "compiling": len(self._compile_locks),
+                # Наибольшее отклонение сходства от float32 среди тестов в каталоге
+                "max_score_error": max(
+                    (quiz.embeddings.max_score_error for quiz in self._by_digest.values()), default=0.0
+                ),
+            }
+
+
+catalog = QuizCatalog(int(settings.QUIZ_CATALOG_MAX_MB * 1024 * 1024))
+
+
+def invalidate(file_path: str) -> None:
+    """Сбрасывает запись файла в общем каталоге"""
+    catalog.invalidate(file_path)
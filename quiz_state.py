@@ -0,0 +1,333 @@
+"""Состояние прохождения тестов по сессиям.
+
+Каждая сессия получает свою попытку (QuizAttempt) со своим тестом и листом
+ответов, поэтому одновременно проходящие тест студенты не перезаписывают
+ответы друг друга. Хранилище ограничено по числу попыток и вытесняет
+неактивные попытки.
+
+Хранилище попыток подключаемое (settings.ATTEMPT_BACKEND):
+    memory - попытки в памяти процесса (видны только своему воркеру);
+    sqlite - ответы в общей базе settings.SESSIONS_DB, попытку продолжает
+             любой воркер.
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+import settings
+from database import get_db_connection
+from grading import CompiledQuiz
+
+
+class QuizAttempt:
+    """Попытка прохождения теста: ответы, битовая карта отвеченных вопросов и оценки"""
+
+    def __init__(self, quiz: CompiledQuiz):
+        self.quiz = quiz
+        self.answers = [""] * len(quiz)
+        self.answered = bytearray((len(quiz) + 7) // 8)
+        self.answered_count = 0
+        # Оценки сохраненных ответов: номер вопроса -> (ответ, (сходство, индекс эталона, стадия, зачтен))
+        self.scores = {}
+        # Готовые итоги проверки: (отпечаток ответов, итоги); сбрасываются при изменении ответа
+        self.graded = None
+        self.last_access = time.monotonic()
+
+    def _is_answered(self, idx: int) -> bool:
+        return bool(self.answered[idx >> 3] & (1 << (idx & 7)))
+
+    def set_answer(self, idx: int, answer: str) -> bool:
+        """Сохраняет ответ; возвращает True, если он изменился"""
+        if not 0 <= idx < len(self.answers):
+            raise IndexError(f"Нет вопроса с номером {idx}")
+        if self.answers[idx] == answer:
+            return False
+        self.answers[idx] = answer
+        self.graded = None
+
+        # Счетчик отвеченных поддерживается инкрементально, без прохода по ответам
+        was_answered = self._is_answered(idx)
+        is_answered = bool(answer.strip())
+        if is_answered and not was_answered:
+            self.answered[idx >> 3] |= 1 << (idx & 7)
+            self.answered_count += 1
+        elif was_answered and not is_answered:
+            self.answered[idx >> 3] &= ~(1 << (idx & 7)) & 0xFF
+            self.answered_count -= 1
+        return True
+
+    def fingerprint(self) -> str:
+        """Отпечаток листа ответов и версии теста"""
+        digest = hashlib.sha256(self.quiz.version.encode("utf-8"))
+        for answer in self.answers:
+            digest.update(b"\0")
+            digest.update(answer.encode("utf-8"))
+        return digest.hexdigest()
+
+    def cached_results(self) -> Optional[dict]:
+        """Итоги проверки, если ответы не менялись с момента их расчета"""
+        graded = self.graded
+        if graded is not None and graded[0] == self.fingerprint():
+            return graded[1]
+        return None
+
+    def store_results(self, fingerprint: str, results: dict) -> None:
+        """Запоминает итоги, посчитанные для ответов с данным отпечатком"""
+        # Ответы могли измениться, пока шла проверка - такие итоги уже устарели
+        if fingerprint == self.fingerprint():
+            self.graded = (fingerprint, results)
+
+    @property
+    def total(self) -> int:
+        return len(self.answers)
+
+    def is_complete(self) -> bool:
+        return self.answered_count == self.total
+
+    def unanswered(self):
+        """Номера (с единицы) вопросов без ответа"""
+        if self.is_complete():
+            return []
+        return [i + 1 for i in range(self.total) if not self._is_answered(i)]
+
+
+class AttemptStore:
+    """Попытки по ключу сессии с ограничением числа и вытеснением неактивных"""
+
+    def __init__(self, max_attempts: int, idle_ttl: float):
+        self.max_attempts = max_attempts
+        self.idle_ttl = idle_ttl
+        self.evictions = 0
+        self._attempts = OrderedDict()  # ключ сессии -> QuizAttempt, от давно неактивных к недавним
+        self._lock = threading.Lock()
+
+    def _evict(self, now: float):
+        while self._attempts:
+            key, attempt = next(iter(self._attempts.items()))
+            if len(self._attempts) <= self.max_attempts and now - attempt.last_access <= self.idle_ttl:
+                break
+            del self._attempts[key]
+            self.evictions += 1
+
+    def start(self, key: str, quiz: CompiledQuiz) -> QuizAttempt:
+        """Начинает новую попытку для сессии (старая попытка заменяется)"""
+        attempt = QuizAttempt(quiz)
+        with self._lock:
+            self._attempts.pop(key, None)
+            self._attempts[key] = attempt
+            self._evict(attempt.last_access)
+        return attempt
+
+    def get(self, key: Optional[str]) -> Optional[QuizAttempt]:
+        """Возвращает попытку сессии и отмечает обращение"""
+        if not key:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            attempt = self._attempts.get(key)
+            if attempt is None:
+                return None
+            if now - attempt.last_access > self.idle_ttl:
+                del self._attempts[key]
+                self.evictions += 1
+                return None
+            attempt.last_access = now
+            self._attempts.move_to_end(key)
+            self._evict(now)
+            return attempt
+
+    def save_answer(self, key: Optional[str], idx: int, answer: str) -> None:
+        """Фиксирует измененный ответ (попытка в памяти уже изменена)"""
+
+    def remove(self, key: Optional[str]) -> None:
+        with self._lock:
+            self._attempts.pop(key, None)
+
+    def reset_after_fork(self) -> None:
+        self._lock = threading.Lock()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "attempts": len(self._attempts),
+                "max_attempts": self.max_attempts,
+                "evictions": self.evictions,
+            }
+
+
+class SQLiteAttemptStore:
+    """Попытки в общей базе SQLite: тест можно продолжить в любом воркере.
+
+    В базе хранятся файл теста, его версия и ответы (по хешу ключа сессии).
+    Скомпилированный тест каждый воркер берет из своего каталога (load_quiz).
+    Объекты попыток кэшируются в процессе, чтобы оценки сохраненных ответов
+    и итоги проверки переиспользовались, а ответы при каждом обращении
+    сверяются с базой. Если файл теста изменился после начала попытки,
+    попытка завершается.
+    """
+
+    # Время последнего обращения обновляется в базе не чаще, чем раз в столько секунд
+    TOUCH_INTERVAL = 60.0
+
+    def __init__(self, db_path: str, max_attempts: int, idle_ttl: float,
+                 load_quiz: Callable[[str], CompiledQuiz]):
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+        self.idle_ttl = idle_ttl
+        self.load_quiz = load_quiz
+        self.evictions = 0
+        self._local = {}  # ключ сессии -> QuizAttempt этого процесса
+        self._lock = threading.Lock()
+        self._init_db()
+
+    def _init_db(self):
+        with get_db_connection(self.db_path) as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS quiz_attempts (
+                    key_hash TEXT PRIMARY KEY,
+                    source TEXT NOT NULL,
+                    version TEXT NOT NULL,
+                    answers TEXT NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            ''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_quiz_attempts_access ON quiz_attempts(last_access)")
+            conn.commit()
+
+    @staticmethod
+    def _hash(key: str) -> str:
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def _cache(self, key: str, attempt: Optional[QuizAttempt]) -> None:
+        with self._lock:
+            if attempt is None:
+                self._local.pop(key, None)
+                return
+            if len(self._local) >= self.max_attempts:
+                self._local.clear()
+            self._local[key] = attempt
+
+    def _evict(self, conn, now: float) -> None:
+        removed = conn.execute(
+            "DELETE FROM quiz_attempts WHERE last_access < ?", (now - self.idle_ttl,)
+        ).rowcount
+        removed += conn.execute(
+            """DELETE FROM quiz_attempts WHERE key_hash IN (
+                SELECT key_hash FROM quiz_attempts ORDER BY last_access DESC LIMIT -1 OFFSET ?
+            )""",
+            (self.max_attempts,)
+        ).rowcount
+        with self._lock:
+            self.evictions += removed
+
+    def start(self, key: str, quiz: CompiledQuiz) -> QuizAttempt:
+        """Начинает новую попытку для сессии (старая попытка заменяется)"""
+        attempt = QuizAttempt(quiz)
+        now = time.time()
+        with get_db_connection(self.db_path) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO quiz_attempts (key_hash, source, version, answers, last_access) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (self._hash(key), quiz.source, quiz.version, json.dumps(attempt.answers), now)
+            )
+            self._evict(conn, now)
+            conn.commit()
+        self._cache(key, attempt)
+        return attempt
+
+    def get(self, key: Optional[str]) -> Optional[QuizAttempt]:
+        """Возвращает попытку сессии с ответами, сохраненными любым воркером"""
+        if not key:
+            return None
+        now = time.time()
+        key_hash = self._hash(key)
+        with get_db_connection(self.db_path) as conn:
+            row = conn.execute(
+                "SELECT source, version, answers, last_access FROM quiz_attempts WHERE key_hash = ?",
+                (key_hash,)
+            ).fetchone()
+            if row is not None and now - row["last_access"] > self.idle_ttl:
+                conn.execute("DELETE FROM quiz_attempts WHERE key_hash = ?", (key_hash,))
+                conn.commit()
+                with self._lock:
+                    self.evictions += 1
+                row = None
+            elif row is not None and now - row["last_access"] > self.TOUCH_INTERVAL:
+                conn.execute("UPDATE quiz_attempts SET last_access = ? WHERE key_hash = ?", (now, key_hash))
+                conn.commit()
+        if row is None:
+            self._cache(key, None)
+            return None
+
+        with self._lock:
+            attempt = self._local.get(key)
+        if attempt is None or attempt.quiz.version != row["version"]:
+            try:
+                quiz = self.load_quiz(row["source"])
+            except OSError:
+                quiz = None
+            if quiz is None or quiz.version != row["version"]:
+                # Файл теста удален или изменен: продолжить попытку нельзя
+                self.remove(key)
+                return None
+            attempt = QuizAttempt(quiz)
+            self._cache(key, attempt)
+
+        # Ответы могли быть сохранены другим воркером
+        for idx, answer in enumerate(json.loads(row["answers"])):
+            attempt.set_answer(idx, answer)
+        attempt.last_access = time.monotonic()
+        return attempt
+
+    def save_answer(self, key: Optional[str], idx: int, answer: str) -> None:
+        """Записывает измененный ответ в общую базу.
+
+        Меняется только элемент idx, поэтому ответы на другие вопросы,
+        одновременно сохраненные другим воркером, не перезаписываются.
+        """
+        if not key:
+            return
+        with get_db_connection(self.db_path) as conn:
+            conn.execute(
+                "UPDATE quiz_attempts SET answers = json_set(answers, '$[' || ? || ']', ?), last_access = ? "
+                "WHERE key_hash = ?",
+                (idx, answer, time.time(), self._hash(key))
+            )
+            conn.commit()
+
+    def remove(self, key: Optional[str]) -> None:
+        if not key:
+            return
+        self._cache(key, None)
+        with get_db_connection(self.db_path) as conn:
+            conn.execute("DELETE FROM quiz_attempts WHERE key_hash = ?", (self._hash(key),))
+            conn.commit()
+
+    def reset_after_fork(self) -> None:
+        self._lock = threading.Lock()
+
+    def stats(self) -> dict:
+        with get_db_connection(self.db_path) as conn:
+            count = conn.execute("SELECT COUNT(*) FROM quiz_attempts").fetchone()[0]
+        with self._lock:
+            return {
+                "attempts": count,
+                "local_attempts": len(self._local),
+                "max_attempts": self.max_attempts,
+                "evictions": self.evictions,
+            }
+
+
+def create_attempt_store(load_quiz: Callable[[str], CompiledQuiz]):
+    """Хранилище попыток по settings.ATTEMPT_BACKEND"""
+    if settings.ATTEMPT_BACKEND == "sqlite":
+        return SQLiteAttemptStore(
+            settings.SESSIONS_DB, settings.MAX_QUIZ_ATTEMPTS, settings.ATTEMPT_IDLE_TTL, load_quiz
+        )
+    if settings.ATTEMPT_BACKEND != "memory":
+        raise ValueError(f"Неизвестное хранилище попыток: {settings.ATTEMPT_BACKEND}")
+    return AttemptStore(settings.MAX_QUIZ_ATTEMPTS, settings.ATTEMPT_IDLE_TTL)
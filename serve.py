@@ -0,0 +1,231 @@
+"""Запуск с предзагрузкой модели и fork воркеров.
+
+Главный процесс один раз загружает модель и прогревает каталог тестов, затем
+создает слушающий сокет и порождает воркеры через fork. Веса модели и
+скомпилированные тесты остаются общими страницами памяти (copy-on-write),
+поэтому N воркеров не требуют N копий модели и N холодных стартов.
+
+Воркер перезапускается после --max-requests запросов или при падении.
+Воркер, упавший быстрее --min-uptime секунд после запуска (ошибка при старте),
+перезапускается с экспоненциальной задержкой, а после --max-failures таких
+падений подряд главный процесс останавливается с кодом 1, не порождая воркеры
+в цикле. SIGHUP перезапускает воркеры по одному без остановки сервиса,
+SIGTERM/SIGINT завершают все воркеры.
+
+Воркеры принимают соединения с одного сокета, и запросы одной сессии попадают
+в разные воркеры. Поэтому при --workers больше 1 сессии и попытки должны
+храниться в общей базе, иначе main откажется запускаться.
+
+Запуск:
+    QUIZ_SESSION_BACKEND=sqlite QUIZ_ATTEMPT_BACKEND=sqlite python serve.py --workers 4 --port 8000
+"""
+
+import argparse
+import gc
+import glob
+import os
+import signal
+import socket
+import sys
+import time
+
+import settings
+
+
+def _bind_socket(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def preload():
+    """Загружает приложение с моделью и прогревает каталог тестов в главном процессе"""
+    import inference
+    import main
+    import quiz_catalog
+
+    # Прогрев в один поток: пул потоков torch, созданный до fork, в воркерах не работает
+    inference.set_threads(1)
+
+    for file_path in glob.glob(os.path.join(main.UPLOAD_DIR, "*.xlsx")):
+        try:
+            quiz_catalog.catalog.get(file_path)
+        except Exception as e:
+            print(f"Не удалось прогреть тест {file_path}: {e}")
+    return main.app
+
+
+def _run_worker(app, sock: socket.socket, workers: int, max_requests: int):
+    import uvicorn
+    import inference
+    import main
+
+    signal.signal(signal.SIGHUP, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    # Потоки из профиля калибровки уже ограничены долей ядер воркера (settings.WEB_WORKERS)
+    inference.set_threads(main.inference_profile["threads"])
+
+    config = uvicorn.Config(app, limit_max_requests=max_requests or None, log_level="info")
+    server = uvicorn.Server(config)
+    server.run(sockets=[sock])
+
+
+class Master:
+    """Порождает воркеры и следит за ними"""
+
+    # Задержка перезапуска после быстрого падения: 0.5, 1, 2, ... с, не больше 30 с
+    BACKOFF_BASE = 0.5
+    BACKOFF_MAX = 30.0
+
+    def __init__(self, app, sock: socket.socket, workers: int, max_requests: int, graceful_timeout: float,
+                 min_uptime: float = 5.0, max_failures: int = 5):
+        self.app = app
+        self.sock = sock
+        self.workers = workers
+        self.max_requests = max_requests
+        self.graceful_timeout = graceful_timeout
+        self.min_uptime = min_uptime
+        self.max_failures = max_failures
+        self.children = {}  # pid -> время запуска
+        self.respawn_at = []  # время запуска отложенных замен
+        self.failures = 0  # быстрых падений подряд
+        self.stopping = False
+        self.reload_requested = False
+
+    def spawn(self) -> int:
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                _run_worker(self.app, self.sock, self.workers, self.max_requests)
+            except BaseException:
+                code = 1
+            finally:
+                os._exit(code)
+        self.children[pid] = time.monotonic()
+        return pid
+
+    def _wait_child(self, pid: int, timeout: float) -> None:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            done, _ = os.waitpid(pid, os.WNOHANG)
+            if done:
+                self.children.pop(pid, None)
+                return
+            time.sleep(0.1)
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+        self.children.pop(pid, None)
+
+    def rolling_restart(self) -> None:
+        """Перезапускает воркеры по одному: новый стартует до остановки старого"""
+        for pid in list(self.children):
+            self.spawn()
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+            self._wait_child(pid, self.graceful_timeout)
+
+    def stop(self) -> None:
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in list(self.children):
+            self._wait_child(pid, self.graceful_timeout)
+
+    def _worker_exited(self, pid: int, status: int) -> None:
+        """Планирует замену завершившегося воркера"""
+        uptime = time.monotonic() - self.children.pop(pid)
+        if os.waitstatus_to_exitcode(status) == 0 or uptime >= self.min_uptime:
+            # Лимит запросов или падение после нормальной работы - замена сразу
+            self.failures = 0
+            self.respawn_at.append(time.monotonic())
+            return
+
+        self.failures += 1
+        if self.failures >= self.max_failures:
+            print(f"Воркеры падают при запуске {self.failures} раз подряд, главный процесс останавливается")
+            self.stopping = True
+            return
+        delay = min(self.BACKOFF_BASE * 2 ** (self.failures - 1), self.BACKOFF_MAX)
+        print(f"Воркер {pid} упал через {uptime:.1f} с после запуска, перезапуск через {delay:.1f} с")
+        self.respawn_at.append(time.monotonic() + delay)
+
+    def run(self) -> int:
+        signal.signal(signal.SIGTERM, lambda *_: setattr(self, "stopping", True))
+        signal.signal(signal.SIGINT, lambda *_: setattr(self, "stopping", True))
+        signal.signal(signal.SIGHUP, lambda *_: setattr(self, "reload_requested", True))
+
+        # Объекты предзагрузки больше не меняются: сборщик мусора не должен
+        # трогать их страницы в воркерах и ломать copy-on-write
+        gc.collect()
+        gc.freeze()
+
+        for _ in range(self.workers):
+            self.spawn()
+
+        while not self.stopping:
+            if self.reload_requested:
+                self.reload_requested = False
+                self.rolling_restart()
+
+            # Воркер завершился (лимит запросов или падение) - планируем замену
+            while True:
+                try:
+                    pid, status = os.waitpid(-1, os.WNOHANG)
+                except ChildProcessError:
+                    break
+                if not pid:
+                    break
+                if pid in self.children:
+                    self._worker_exited(pid, status)
+
+            now = time.monotonic()
+            due = [t for t in self.respawn_at if t <= now]
+            if due and not self.stopping:
+                self.respawn_at = [t for t in self.respawn_at if t > now]
+                for _ in due:
+                    self.spawn()
+            time.sleep(0.2)
+
+        self.stop()
+        return 1 if self.failures >= self.max_failures else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Запуск воркеров с общей предзагруженной моделью")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=settings.WEB_WORKERS)
+    parser.add_argument("--max-requests", type=int, default=0,
+                        help="перезапускать воркер после этого числа запросов (0 - без ограничения)")
+    parser.add_argument("--graceful-timeout", type=float, default=30.0)
+    parser.add_argument("--min-uptime", type=float, default=5.0,
+                        help="воркер, упавший быстрее, считается упавшим при запуске")
+    parser.add_argument("--max-failures", type=int, default=5,
+                        help="столько падений при запуске подряд останавливают главный процесс")
+    args = parser.parse_args(argv)
+
+    # Воркеры делят ядра машины, это учитывается и при загрузке профиля инференса
+    os.environ["QUIZ_WEB_WORKERS"] = str(args.workers)
+    settings.WEB_WORKERS = args.workers
+
+    app = preload()
+    sock = _bind_socket(args.host, args.port)
+    print(f"Главный процесс {os.getpid()}: {args.workers} воркеров на {args.host}:{args.port}")
+    master = Master(
+        app, sock, args.workers, args.max_requests, args.graceful_timeout, args.min_uptime, args.max_failures
+    )
+    return master.run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,24 +1,413 @@
-"""Модуль для управления сессиями пользователя"""
+"""Модуль для управления сессиями пользователя
 
+Хранилище сессий подключаемое (settings.SESSION_BACKEND):
+    memory - словарь в памяти процесса (сессии теряются при перезапуске и не
+             видны другим воркерам);
+    sqlite - общая база SQLite (settings.SESSIONS_DB, пул соединений database.py) с кэшем
+             чтения в процессе: сессии переживают перезапуск и работают с
+             несколькими воркерами без привязки клиента к воркеру;
+    signed - подписанные HMAC токены с логином, типом пользователя и сроком
+             действия: проверка токена не обращается к общему состоянию,
+             отозванные токены учитывает компактный список отзыва.
+Сессии живут settings.SESSION_TTL секунд, просроченные удаляет фоновый поток.
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import os
 import secrets
-from typing import Optional
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+import settings
+from database import get_db_connection
 
-# Хранение сессий (в реальном приложении используйте Redis или базу данных)
+# Хранение сессий бэкенда memory: токен -> логин
 active_sessions = {}
 
-def create_session(username: str) -> str:
+
+class MemorySessionBackend:
+    """Сессии в памяти процесса"""
+
+    def __init__(self):
+        self.sessions = active_sessions
+        self.expires = {}  # токен -> время истечения
+
+    def create(self, username: str, expires_at: float, user_type: Optional[str] = None) -> str:
+        token = secrets.token_hex(32)
+        self.sessions[token] = username
+        self.expires[token] = expires_at
+        return token
+
+    def get(self, token: str) -> Optional[str]:
+        username = self.sessions.get(token)
+        if username is None:
+            return None
+        if self.expires.get(token, float("inf")) <= time.time():
+            self.remove(token)
+            return None
+        return username
+
+    def remove(self, token: str) -> None:
+        self.sessions.pop(token, None)
+        self.expires.pop(token, None)
+
+    def revoke_user(self, username: str) -> None:
+        for token in [t for t, login in list(self.sessions.items()) if login == username]:
+            self.remove(token)
+
+    def sweep(self) -> int:
+        now = time.time()
+        expired = [token for token, expires_at in list(self.expires.items()) if expires_at <= now]
+        for token in expired:
+            self.remove(token)
+        return len(expired)
+
+
+class SQLiteSessionBackend:
+    """Сессии в SQLite (WAL) с кэшем чтения в процессе.
+
+    В базе хранится хеш токена, а не сам токен. Кэш держит найденные сессии не
+    дольше cache_ttl секунд, поэтому выход в другом воркере виден с такой задержкой.
+    """
+
+    def __init__(self, db_path: str, cache_ttl: float, cache_size: int = 10000):
+        self.db_path = db_path
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self._cache = {}  # токен -> (логин, срок действия записи кэша)
+        self._lock = threading.Lock()
+        self._init_db()
+
+    def _init_db(self):
+        with get_db_connection(self.db_path) as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS sessions (
+                    token_hash TEXT PRIMARY KEY,
+                    login TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            ''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions(expires_at)")
+            conn.commit()
+
+    @staticmethod
+    def _hash(token: str) -> str:
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    def _cache_put(self, token: str, username: str, expires_at: float) -> None:
+        with self._lock:
+            if len(self._cache) >= self.cache_size:
+                self._cache.clear()
+            self._cache[token] = (username, min(expires_at, time.time() + self.cache_ttl))
+
+    def create(self, username: str, expires_at: float, user_type: Optional[str] = None) -> str:
+        token = secrets.token_hex(32)
+        with get_db_connection(self.db_path) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions (token_hash, login, expires_at) VALUES (?, ?, ?)",
+                (self._hash(token), username, expires_at)
+            )
+            conn.commit()
+        self._cache_put(token, username, expires_at)
+        return token
+
+    def get(self, token: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            cached = self._cache.get(token)
+        if cached is not None:
+            if cached[1] > now:
+                return cached[0]
+            with self._lock:
+                self._cache.pop(token, None)
+
+        with get_db_connection(self.db_path) as conn:
+            row = conn.execute(
+                "SELECT login, expires_at FROM sessions WHERE token_hash = ? AND expires_at > ?",
+                (self._hash(token), now)
+            ).fetchone()
+        if row is None:
+            return None
+        self._cache_put(token, row[0], row[1])
+        return row[0]
+
+    def remove(self, token: str) -> None:
+        with self._lock:
+            self._cache.pop(token, None)
+        with get_db_connection(self.db_path) as conn:
+            conn.execute("DELETE FROM sessions WHERE token_hash = ?", (self._hash(token),))
+            conn.commit()
+
+    def revoke_user(self, username: str) -> None:
+        with self._lock:
+            for token in [t for t, (login, _) in self._cache.items() if login == username]:
+                del self._cache[token]
+        with get_db_connection(self.db_path) as conn:
+            conn.execute("DELETE FROM sessions WHERE login = ?", (username,))
+            conn.commit()
+
+    def sweep(self) -> int:
+        now = time.time()
+        with self._lock:
+            for token in [t for t, (_, until) in self._cache.items() if until <= now]:
+                del self._cache[token]
+        with get_db_connection(self.db_path) as conn:
+            removed = conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (now,)).rowcount
+            conn.commit()
+        return removed
+
+    def reset_after_fork(self) -> None:
+        # Блокировка могла быть захвачена потоком родителя в момент fork
+        self._lock = threading.Lock()
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def parse_signing_keys(value: str) -> Dict[str, bytes]:
+    """Ключи подписи из строки "kid:секрет,kid:секрет"; первый ключ подписывает новые токены"""
+    keys = {}
+    for item in value.split(","):
+        kid, sep, secret = item.strip().partition(":")
+        if sep and kid and secret:
+            keys[kid] = secret.encode("utf-8")
+    return keys
+
+
+class SignedSessionBackend:
+    """Подписанные HMAC-SHA256 токены сессий.
+
+    Токен - "данные.подпись", где данные - JSON с логином (sub), типом
+    пользователя (typ), сроком действия (exp), идентификатором токена (jti) и
+    ключа (kid). Для смены ключа новый ключ ставится первым, а старый остается
+    в списке, пока не истекут подписанные им токены.
+
+    Отозванные токены (выход) и время, раньше которого токены пользователя
+    недействительны (удаление, смена пароля), хранятся в SQLite и
+    перечитываются в память раз в refresh_interval секунд. Записи отзыва
+    удаляются после истечения срока токена, поэтому список остается маленьким.
+    """
+
+    def __init__(self, keys: Dict[str, bytes], db_path: str, refresh_interval: float):
+        if not keys:
+            # Случайный ключ процесса не годится: токены не переживут перезапуск,
+            # а воркеры, запущенные отдельно (uvicorn --workers), не примут чужие токены
+            raise ValueError("Для хранилища сессий signed нужно задать QUIZ_SESSION_SIGNING_KEYS")
+        self.keys = keys
+        self.active_kid = next(iter(keys))
+        self.db_path = db_path
+        self.refresh_interval = refresh_interval
+        self._revoked = {}  # jti -> срок действия токена
+        self._not_before = {}  # логин -> время, раньше которого токены недействительны
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+        self._init_db()
+
+    def _init_db(self):
+        with get_db_connection(self.db_path) as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS revoked_tokens (
+                    jti TEXT PRIMARY KEY,
+                    expires_at REAL NOT NULL
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS revoked_users (
+                    login TEXT PRIMARY KEY,
+                    not_before REAL NOT NULL
+                )
+            ''')
+            conn.commit()
+
+    def _sign(self, kid: str, payload: str) -> str:
+        return _b64encode(hmac.new(self.keys[kid], payload.encode("ascii"), hashlib.sha256).digest())
+
+    def _refresh(self, now: float) -> None:
+        if now - self._loaded_at < self.refresh_interval:
+            return
+        with get_db_connection(self.db_path) as conn:
+            revoked = dict(conn.execute("SELECT jti, expires_at FROM revoked_tokens WHERE expires_at > ?", (now,)))
+            not_before = dict(conn.execute("SELECT login, not_before FROM revoked_users"))
+        with self._lock:
+            self._revoked = revoked
+            self._not_before = not_before
+            self._loaded_at = now
+
+    def create(self, username: str, expires_at: float, user_type: Optional[str] = None) -> str:
+        claims = {
+            "sub": username,
+            "typ": user_type,
+            "iat": round(time.time(), 3),
+            "exp": int(expires_at),
+            "jti": secrets.token_hex(8),
+            "kid": self.active_kid,
+        }
+        payload = _b64encode(json.dumps(claims, separators=(",", ":")).encode("utf-8"))
+        return f"{payload}.{self._sign(self.active_kid, payload)}"
+
+    def claims(self, token: str) -> Optional[dict]:
+        """Проверяет подпись, срок действия и список отзыва; возвращает данные токена"""
+        # Starlette декодирует cookie как latin-1; compare_digest не сравнивает
+        # строки с не-ASCII символами, а подлинный токен всегда ASCII
+        if not token.isascii():
+            return None
+        payload, sep, signature = token.partition(".")
+        if not sep:
+            return None
+        try:
+            claims = json.loads(_b64decode(payload))
+        except ValueError:
+            return None
+        kid = claims.get("kid") if isinstance(claims, dict) else None
+        if kid not in self.keys or not hmac.compare_digest(signature, self._sign(kid, payload)):
+            return None
+
+        now = time.time()
+        if claims.get("exp", 0) <= now:
+            return None
+        try:
+            self._refresh(now)
+        except sqlite3.Error as e:
+            # Список отзыва недоступен - продолжаем с последним загруженным
+            print(f"Не удалось обновить список отзыва сессий: {e}")
+        if claims.get("jti") in self._revoked:
+            return None
+        if claims.get("iat", 0) < self._not_before.get(claims.get("sub"), 0):
+            return None
+        return claims
+
+    def get(self, token: str) -> Optional[str]:
+        claims = self.claims(token)
+        return claims["sub"] if claims else None
+
+    def remove(self, token: str) -> None:
+        claims = self.claims(token)
+        if claims is None:
+            return
+        with self._lock:
+            self._revoked[claims["jti"]] = claims["exp"]
+        with get_db_connection(self.db_path) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO revoked_tokens (jti, expires_at) VALUES (?, ?)",
+                (claims["jti"], claims["exp"])
+            )
+            conn.commit()
+
+    def revoke_user(self, username: str) -> None:
+        not_before = time.time()
+        with self._lock:
+            self._not_before[username] = not_before
+        with get_db_connection(self.db_path) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO revoked_users (login, not_before) VALUES (?, ?)",
+                (username, not_before)
+            )
+            conn.commit()
+
+    def sweep(self) -> int:
+        now = time.time()
+        with get_db_connection(self.db_path) as conn:
+            removed = conn.execute("DELETE FROM revoked_tokens WHERE expires_at <= ?", (now,)).rowcount
+            # Отзыв пользователя не нужен, когда истекли все токены, выданные до него
+            removed += conn.execute(
+                "DELETE FROM revoked_users WHERE not_before <= ?", (now - settings.SESSION_TTL,)
+            ).rowcount
+            conn.commit()
+        return removed
+
+    def reset_after_fork(self) -> None:
+        self._lock = threading.Lock()
+
+
+def _create_backend():
+    if settings.SESSION_BACKEND == "sqlite":
+        return SQLiteSessionBackend(settings.SESSIONS_DB, settings.SESSION_CACHE_TTL)
+    if settings.SESSION_BACKEND == "signed":
+        return SignedSessionBackend(
+            parse_signing_keys(settings.SESSION_SIGNING_KEYS),
+            settings.SESSIONS_DB,
+            settings.SESSION_REVOCATION_REFRESH,
+        )
+    if settings.SESSION_BACKEND != "memory":
+        raise ValueError(f"Неизвестное хранилище сессий: {settings.SESSION_BACKEND}")
+    return MemorySessionBackend()
+
+
+backend = _create_backend()
+_sweeper = None
+_sweeper_lock = threading.Lock()
+
+
+def _run_sweeper():
+    while True:
+        time.sleep(settings.SESSION_SWEEP_INTERVAL)
+        try:
+            backend.sweep()
+        except Exception as e:
+            print(f"Ошибка очистки просроченных сессий: {e}")
+
+
+def _ensure_sweeper():
+    global _sweeper
+    if _sweeper is None:
+        with _sweeper_lock:
+            if _sweeper is None:
+                _sweeper = threading.Thread(target=_run_sweeper, name="session-sweeper", daemon=True)
+                _sweeper.start()
+
+
+def _reset_after_fork():
+    # Поток очистки не переживает fork - воркер запустит свой
+    global _sweeper, _sweeper_lock
+    _sweeper = None
+    _sweeper_lock = threading.Lock()
+    if hasattr(backend, "reset_after_fork"):
+        backend.reset_after_fork()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def create_session(username: str, user_type: Optional[str] = None) -> str:
     """Создает сессию для пользователя"""
-    session_token = secrets.token_hex(32)
-    active_sessions[session_token] = username
-    return session_token
+    _ensure_sweeper()
+    return backend.create(username, time.time() + settings.SESSION_TTL, user_type)
 
 def get_user_from_session(session_token: str) -> Optional[str]:
     """Получает пользователя из сессии по токену"""
-    if session_token and session_token in active_sessions:
-        return active_sessions[session_token]
-    return None
+    if not session_token:
+        return None
+    _ensure_sweeper()
+    return backend.get(session_token)
 
 def remove_session(session_token: str) -> None:
     """Удаляет сессию"""
-    if session_token in active_sessions:
-        del active_sessions[session_token]
\ No newline at end of file
+    if session_token:
+        backend.remove(session_token)
+
+def get_session_claims(session_token: str) -> Optional[dict]:
+    """Данные сессии: логин и тип пользователя (тип известен только для подписанных токенов)"""
+    if not session_token:
+        return None
+    if isinstance(backend, SignedSessionBackend):
+        claims = backend.claims(session_token)
+        if claims is None:
+            return None
+        return {"login": claims["sub"], "user_type": claims.get("typ"), "expires_at": claims["exp"]}
+    login = get_user_from_session(session_token)
+    return {"login": login, "user_type": None, "expires_at": None} if login else None
+
+def revoke_user_sessions(username: str) -> None:
+    """Завершает все сессии пользователя (удаление, смена логина или пароля)"""
+    if username:
+        backend.revoke_user(username)
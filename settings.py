@@ -0,0 +1,98 @@
+"""Настройки развертывания (переопределяются переменными окружения)"""
+
+import os
+
+# Модель кодирования ответов и порог сходства для зачета ответа
+MODEL_NAME = os.environ.get("QUIZ_MODEL_NAME", "all-MiniLM-L6-v2")
+THRESHOLD = float(os.environ.get("QUIZ_THRESHOLD", "0.833"))
+
+# Бэкенд инференса: torch, torch-int8, onnx, onnx-int8 или lexical (см. encoders.py)
+ENCODER_BACKEND = os.environ.get("QUIZ_ENCODER_BACKEND", "torch")
+# Порог сходства для лексического движка (шкала n-граммного косинуса ниже, чем у трансформера;
+# как выбрано значение по умолчанию и как его пересчитать - см. lexical.py)
+LEXICAL_THRESHOLD = float(os.environ.get("QUIZ_LEXICAL_THRESHOLD", "0.59"))
+# Корпус, на котором лексический движок обучает веса IDF (по предложению на строку)
+LEXICAL_CORPUS = os.environ.get(
+    "QUIZ_LEXICAL_CORPUS", os.path.join(os.path.dirname(os.path.abspath(__file__)), "lexical_corpus.txt")
+)
+# Файл квантованного ONNX-графа внутри репозитория модели для бэкенда onnx-int8
+ONNX_INT8_FILE = os.environ.get("QUIZ_ONNX_INT8_FILE", "onnx/model_quint8_avx2.onnx")
+
+# Лимит памяти LRU-кэша эмбеддингов ответов студентов, МБ
+ANSWER_CACHE_MAX_MB = float(os.environ.get("QUIZ_ANSWER_CACHE_MB", "64"))
+
+# Число потоков пула инференса модели
+INFERENCE_WORKERS = int(os.environ.get("QUIZ_INFERENCE_WORKERS", "1"))
+
+# Микро-батчинг кодирования ответов: максимум предложений в батче и время сбора, мс
+BATCH_MAX_SENTENCES = int(os.environ.get("QUIZ_BATCH_MAX_SENTENCES", "64"))
+BATCH_MAX_WAIT_MS = float(os.environ.get("QUIZ_BATCH_MAX_WAIT_MS", "10"))
+
+# Инкрементальная проверка: ответ оценивается в фоне сразу при сохранении через /answer
+INCREMENTAL_GRADING = os.environ.get("QUIZ_INCREMENTAL_GRADING", "1") not in ("0", "false", "no")
+
+# Попытки прохождения тестов: максимум одновременно хранимых и время жизни без активности, с
+MAX_QUIZ_ATTEMPTS = int(os.environ.get("QUIZ_MAX_ATTEMPTS", "5000"))
+ATTEMPT_IDLE_TTL = float(os.environ.get("QUIZ_ATTEMPT_IDLE_TTL", str(4 * 3600)))
+# Хранилище попыток: memory (в процессе) или sqlite (в SESSIONS_DB, общее для воркеров).
+# Для нескольких воркеров общими должны быть и попытки, и сессии (SESSION_BACKEND)
+ATTEMPT_BACKEND = os.environ.get("QUIZ_ATTEMPT_BACKEND", "memory")
+
+# Лимит памяти каталога скомпилированных тестов, МБ
+QUIZ_CATALOG_MAX_MB = float(os.environ.get("QUIZ_CATALOG_MAX_MB", "512"))
+
+# Формат хранения эмбеддингов эталонов в памяти: float32, float16 или int8
+EMBEDDING_DTYPE = os.environ.get("QUIZ_EMBEDDING_DTYPE", "float16")
+
+# Число воркеров uvicorn на машине (для распределения потоков инференса между ними).
+# Если QUIZ_WEB_WORKERS не задана, берется WEB_CONCURRENCY, которую uvicorn
+# использует как значение --workers по умолчанию. При запуске
+# "uvicorn main:app --workers N" одну из переменных нужно задать равной N,
+# иначе каждый воркер займет все ядра машины.
+WEB_WORKERS = int(os.environ.get("QUIZ_WEB_WORKERS") or os.environ.get("WEB_CONCURRENCY") or "1")
+
+# Профиль инференса, записанный calibrate.py (потоки torch и размер батча для этой машины)
+INFERENCE_PROFILE = os.environ.get("QUIZ_INFERENCE_PROFILE", "inference_profile.json")
+
+# Контроль допуска проверки (/final_results, /select): одновременные запросы к модели,
+# длина очереди ожидания, время ожидания в очереди (с) и Retry-After для ответа 503 (с)
+GRADING_MAX_CONCURRENCY = int(os.environ.get("QUIZ_GRADING_MAX_CONCURRENCY", "4"))
+GRADING_MAX_QUEUE = int(os.environ.get("QUIZ_GRADING_MAX_QUEUE", "32"))
+GRADING_QUEUE_TIMEOUT = float(os.environ.get("QUIZ_GRADING_QUEUE_TIMEOUT", "10"))
+GRADING_RETRY_AFTER = int(os.environ.get("QUIZ_GRADING_RETRY_AFTER", "5"))
+
+# Unix-сокет сервиса эмбеддингов (embedding_server.py); пусто - модель загружается в процессе
+EMBEDDING_SOCKET = os.environ.get("QUIZ_EMBEDDING_SOCKET", "")
+EMBEDDING_SOCKET_TIMEOUT = float(os.environ.get("QUIZ_EMBEDDING_SOCKET_TIMEOUT", "10"))
+
+# Каскадная проверка: cross-encoder для ответов со сходством в полосе THRESHOLD ± CASCADE_BAND.
+# Пустое имя модели отключает стадию
+CROSS_ENCODER_MODEL = os.environ.get("QUIZ_CROSS_ENCODER_MODEL", "")
+CASCADE_BAND = float(os.environ.get("QUIZ_CASCADE_BAND", "0.05"))
+CROSS_ENCODER_THRESHOLD = float(os.environ.get("QUIZ_CROSS_ENCODER_THRESHOLD", "0.5"))
+
+# Хранилище сессий: memory (в процессе), sqlite (общее для воркеров, переживает перезапуск)
+# или signed (подписанные токены без общего хранилища сессий)
+SESSION_BACKEND = os.environ.get("QUIZ_SESSION_BACKEND", "memory")
+SESSIONS_DB = os.environ.get("QUIZ_SESSIONS_DB", "sessions.db")
+# Время жизни сессии (с), период очистки просроченных (с), время кэширования сессии в процессе (с)
+SESSION_TTL = float(os.environ.get("QUIZ_SESSION_TTL", str(12 * 3600)))
+SESSION_SWEEP_INTERVAL = float(os.environ.get("QUIZ_SESSION_SWEEP_INTERVAL", "300"))
+SESSION_CACHE_TTL = float(os.environ.get("QUIZ_SESSION_CACHE_TTL", "5"))
+# Ключи подписи токенов бэкенда signed: "kid:секрет,kid:секрет", первым - текущий ключ
+# (обязательны: без них бэкенд signed не запускается).
+# Период перечитывания списка отзыва токенов (с)
+SESSION_SIGNING_KEYS = os.environ.get("QUIZ_SESSION_SIGNING_KEYS", "")
+SESSION_REVOCATION_REFRESH = float(os.environ.get("QUIZ_SESSION_REVOCATION_REFRESH", "5"))
+
+# Кэш профилей пользователей (identity.py): число записей и время жизни записи (с)
+IDENTITY_CACHE_SIZE = int(os.environ.get("QUIZ_IDENTITY_CACHE_SIZE", "10000"))
+IDENTITY_CACHE_TTL = float(os.environ.get("QUIZ_IDENTITY_CACHE_TTL", "30"))
+
+# Пул соединений SQLite (database.py): ожидание блокировки (мс), размер mmap (байт),
+# число кэшируемых подготовленных запросов на соединение
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("QUIZ_SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.environ.get("QUIZ_SQLITE_MMAP_SIZE", str(64 * 1024 * 1024)))
+SQLITE_CACHED_STATEMENTS = int(os.environ.get("QUIZ_SQLITE_CACHED_STATEMENTS", "256"))
+# Потоки пула для запросов к базе из асинхронных обработчиков
+DB_WORKERS = int(os.environ.get("QUIZ_DB_WORKERS", "4"))
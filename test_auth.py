@@ -7,39 +7,14 @@ from fastapi import FastAPI, Request, Form
 from fastapi.responses import HTMLResponse, RedirectResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-import sqlite3
 import secrets
 from session_manager import create_session, get_user_from_session
+from identity import get_user_by_login
 
 app = FastAPI()
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
 
-def get_user_by_login(login: str):
-    """Получает пользователя из базы данных по логину"""
-    conn = sqlite3.connect('users.db')
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT id, user_type, last_name, first_name, middle_name, group_name, login, password, created_at 
-        FROM users WHERE login = ?
-    """, (login,))
-    user = cursor.fetchone()
-    conn.close()
-    
-    if user:
-        return {
-            "id": user[0],
-            "user_type": user[1],
-            "last_name": user[2],
-            "first_name": user[3],
-            "middle_name": user[4],
-            "group_name": user[5],
-            "login": user[6],
-            "password": user[7],
-            "created_at": user[8]
-        }
-    return None
-
 def get_user_from_session_wrapper(request: Request):
     """Получает пользователя из сессии"""
     session_token = request.cookies.get("session_token")
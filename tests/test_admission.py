@@ -0,0 +1,51 @@
+"""Проверки контроля допуска"""
+
+import asyncio
+
+import pytest
+
+from admission import AdmissionController, OverloadedError
+
+
+def test_background_admission_does_not_queue():
+    controller = AdmissionController(max_concurrency=1, max_queue=4, queue_timeout=5)
+
+    async def run():
+        # Свободное место фоновая работа занимает как обычный запрос
+        async with controller.admit(wait=False):
+            assert controller.active == 1
+            # Место занято - фоновая работа отклоняется сразу, не вставая в очередь
+            with pytest.raises(OverloadedError):
+                async with controller.admit(wait=False):
+                    pass
+            assert controller.waiting == 0
+
+    asyncio.run(run())
+    stats = controller.stats()
+    assert stats["admitted"] == 1
+    assert stats["declined"] == 1
+    assert stats["rejected"] == 0
+
+
+def test_background_admission_yields_to_queued_requests():
+    controller = AdmissionController(max_concurrency=1, max_queue=4, queue_timeout=5)
+
+    async def run():
+        release = asyncio.Event()
+
+        async def request():
+            async with controller.admit():
+                await release.wait()
+
+        running = asyncio.ensure_future(request())
+        queued = asyncio.ensure_future(request())
+        await asyncio.sleep(0.01)
+        assert controller.waiting == 1
+        with pytest.raises(OverloadedError):
+            async with controller.admit(wait=False):
+                pass
+        release.set()
+        await asyncio.gather(running, queued)
+
+    asyncio.run(run())
+    assert controller.stats()["admitted"] == 2
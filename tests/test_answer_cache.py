@@ -0,0 +1,71 @@
+"""Проверки LRU-кэша эмбеддингов ответов"""
+
+import sys
+
+import numpy as np
+
+from embedding_store import EmbeddingLRUCache
+
+
+def vector(value, dim=8):
+    return np.full(dim, value, dtype=np.float32)
+
+
+def entry_size(text, dim=8):
+    return vector(0.0, dim).nbytes + sys.getsizeof(text)
+
+
+def test_evicts_least_recently_used_by_bytes():
+    # Места ровно на две записи одинакового размера
+    cache = EmbeddingLRUCache(entry_size("a") + entry_size("b"))
+    cache.put("a", vector(1.0))
+    cache.put("b", vector(2.0))
+    assert cache.get("a") is not None  # "a" становится недавно использованной
+
+    cache.put("c", vector(3.0))
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    stats = cache.stats()
+    assert stats["evictions"] == 1
+    assert stats["bytes"] == entry_size("a") + entry_size("c") <= stats["max_bytes"]
+
+
+def test_large_vectors_take_more_room():
+    cache = EmbeddingLRUCache(entry_size("a") + entry_size("b") + entry_size("c"))
+    for text in ("a", "b", "c"):
+        cache.put(text, vector(1.0))
+    # Вектор втрое длиннее вытесняет две старые записи, а не одну
+    cache.put("d", vector(1.0, dim=24))
+    assert cache.get("a") is None and cache.get("b") is None
+    assert cache.get("c") is not None and cache.get("d") is not None
+    assert cache.stats()["bytes"] <= cache.max_bytes
+
+
+def test_oversized_entry_not_stored():
+    cache = EmbeddingLRUCache(entry_size("a"))
+    cache.put("a", vector(1.0))
+    cache.put("big", vector(1.0, dim=1024))
+    assert cache.get("big") is None
+    assert cache.get("a") is not None
+
+
+def test_replacing_entry_keeps_byte_count():
+    cache = EmbeddingLRUCache(10 * entry_size("a"))
+    cache.put("a", vector(1.0))
+    cache.put("a", vector(2.0))
+    assert cache.stats()["bytes"] == entry_size("a")
+    assert cache.get("a")[0] == 2.0
+
+
+def test_encode_only_misses():
+    cache = EmbeddingLRUCache(1 << 20)
+    calls = []
+
+    def encode(texts):
+        calls.append(list(texts))
+        return np.array([vector(len(text)) for text in texts])
+
+    cache.encode(["a", "bb"], encode)
+    result = cache.encode(["bb", "ccc", "ccc"], encode)
+    assert calls == [["a", "bb"], ["ccc"]]
+    assert result[:, 0].tolist() == [2, 3, 3]
@@ -0,0 +1,58 @@
+"""Проверки микро-батчинга"""
+
+import asyncio
+
+import numpy as np
+
+from batching import MicroBatcher
+
+
+def fake_encode(texts):
+    return np.array([[len(text), 1.0] for text in texts], dtype=np.float32)
+
+
+def test_flush_by_size():
+    batcher = MicroBatcher(fake_encode, max_batch=4, max_wait_ms=10_000)
+
+    async def run():
+        return await asyncio.wait_for(
+            asyncio.gather(batcher.encode(["a", "bb"]), batcher.encode(["ccc", "dddd"])), timeout=5
+        )
+
+    first, second = asyncio.run(run())
+    # Батч отправлен по размеру, не дожидаясь таймера в 10 с
+    assert first[:, 0].tolist() == [1, 2]
+    assert second[:, 0].tolist() == [3, 4]
+    assert batcher.stats()["batches"] == 1
+
+
+def test_flush_by_time():
+    batcher = MicroBatcher(fake_encode, max_batch=64, max_wait_ms=20)
+
+    async def run():
+        first = asyncio.ensure_future(batcher.encode(["a"]))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(batcher.encode(["bb"]))
+        return await asyncio.wait_for(asyncio.gather(first, second), timeout=5)
+
+    first, second = asyncio.run(run())
+    assert first[:, 0].tolist() == [1]
+    assert second[:, 0].tolist() == [2]
+    stats = batcher.stats()
+    assert stats["batches"] == 1
+    assert stats["requests"] == 2
+    assert stats["running_batches"] == 0
+
+
+def test_errors_reach_all_waiters():
+    def failing(texts):
+        raise RuntimeError("модель недоступна")
+
+    batcher = MicroBatcher(failing, max_batch=2, max_wait_ms=10)
+
+    async def run():
+        return await asyncio.gather(batcher.encode(["a"]), batcher.encode(["b"]), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert batcher.stats()["errors"] == 1
@@ -0,0 +1,64 @@
+"""Проверки пула соединений SQLite"""
+
+import asyncio
+import threading
+
+import database
+
+
+def connect_in_thread(db_path):
+    result = []
+    thread = threading.Thread(target=lambda: result.append(database.connect(db_path)))
+    thread.start()
+    thread.join()
+    return result[0]
+
+
+def test_connection_reused_within_thread(tmp_path):
+    db_path = str(tmp_path / "test.db")
+    opened = database.stats()["connections_opened"]
+    conn = database.connect(db_path)
+    assert database.connect(db_path) is conn
+    with database.get_db_connection(db_path) as same:
+        assert same is conn
+    assert database.stats()["connections_opened"] == opened + 1
+
+
+def test_threads_get_own_connections(tmp_path):
+    db_path = str(tmp_path / "test.db")
+    conn = database.connect(db_path)
+    assert connect_in_thread(db_path) is not conn
+
+
+def test_connection_pragmas(tmp_path):
+    conn = database.connect(str(tmp_path / "test.db"))
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    # synchronous=NORMAL
+    assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1
+
+
+def test_uncommitted_transaction_rolled_back(tmp_path):
+    db_path = str(tmp_path / "test.db")
+    with database.get_db_connection(db_path) as conn:
+        conn.execute("CREATE TABLE items (name TEXT)")
+        conn.commit()
+        conn.execute("INSERT INTO items VALUES ('lost')")
+    # Следующий запрос этого потока не видит незафиксированную вставку
+    with database.get_db_connection(db_path) as conn:
+        assert not conn.in_transaction
+        assert conn.execute("SELECT COUNT(*) FROM items").fetchone()[0] == 0
+
+
+def test_async_helpers(tmp_path):
+    db_path = str(tmp_path / "test.db")
+
+    async def run():
+        await database.execute("CREATE TABLE items (name TEXT)", db_path=db_path)
+        assert await database.execute("INSERT INTO items VALUES (?)", ("a",), db_path=db_path) == 1
+        row = await database.fetch_one("SELECT name FROM items", db_path=db_path)
+        rows = await database.fetch_all("SELECT name FROM items", db_path=db_path)
+        return row, rows
+
+    row, rows = asyncio.run(run())
+    assert row["name"] == "a"
+    assert [r["name"] for r in rows] == ["a"]
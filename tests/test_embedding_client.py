@@ -0,0 +1,68 @@
+"""Проверки клиента сервиса эмбеддингов на поддельном сервере"""
+
+import json
+import socket
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from embedding_server import _HEADER, EmbeddingClient, EmbeddingServiceError, _recv_frame
+
+
+def serve(path, requests, delay=0.0):
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen()
+
+    def handle(conn):
+        with conn:
+            while True:
+                try:
+                    texts = json.loads(_recv_frame(conn))["texts"]
+                except (ConnectionError, OSError):
+                    return
+                requests.append(len(texts))
+                time.sleep(delay)
+                data = np.ones((len(texts), 3), dtype=np.float32)
+                header = json.dumps({"ok": True, "shape": list(data.shape), "dtype": "float32"}).encode()
+                try:
+                    conn.sendall(_HEADER.pack(len(header)) + header + _HEADER.pack(data.nbytes) + data.tobytes())
+                except OSError:
+                    return
+
+    def accept():
+        while True:
+            try:
+                conn, _ = server.accept()
+            except OSError:
+                return
+            threading.Thread(target=handle, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    return server
+
+
+def test_encode_splits_into_batches(tmp_path):
+    requests = []
+    path = str(tmp_path / "emb.sock")
+    server = serve(path, requests)
+    try:
+        result = EmbeddingClient(path, timeout=5, max_batch=4).encode([f"t{i}" for i in range(10)])
+    finally:
+        server.close()
+    assert result.shape == (10, 3)
+    assert requests == [4, 4, 2]
+
+
+def test_timeout_is_not_retried(tmp_path):
+    requests = []
+    path = str(tmp_path / "emb.sock")
+    server = serve(path, requests, delay=0.5)
+    try:
+        with pytest.raises(EmbeddingServiceError):
+            EmbeddingClient(path, timeout=0.1, max_batch=4).encode(["a", "b"])
+    finally:
+        server.close()
+    assert requests == [2]
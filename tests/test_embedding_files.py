@@ -0,0 +1,72 @@
+"""Проверки файлов скомпилированных тестов (.xlsx.emb)"""
+
+import numpy as np
+import pytest
+
+import embedding_files
+from grading import CompiledQuiz, PackedEmbeddings
+
+ENCODER = "test-encoder"
+
+
+def make_quiz(tmp_path, dtype, reference_answers=(("a", "b"), ("c",))):
+    reference_answers = [list(answers) for answers in reference_answers]
+    counts = [len(answers) for answers in reference_answers]
+    rng = np.random.default_rng(0)
+    embeddings = rng.normal(size=(sum(counts), 8)).astype(np.float32)
+    packed = PackedEmbeddings.from_flat(embeddings, counts, dtype)
+    path = str(tmp_path / "quiz.xlsx")
+    quiz = CompiledQuiz([f"q{i}" for i in range(len(counts))], reference_answers, packed, path)
+    quiz.version = "digest-1"
+    return path, quiz
+
+
+@pytest.mark.parametrize("dtype", ["float32", "float16", "int8"])
+def test_round_trip(tmp_path, dtype):
+    path, quiz = make_quiz(tmp_path, dtype)
+    embedding_files.write(path, quiz, ENCODER)
+
+    loaded = embedding_files.load(path, "digest-1", ENCODER, dtype)
+    assert loaded is not None
+    assert loaded.questions == quiz.questions
+    assert loaded.reference_answers == quiz.reference_answers
+    assert loaded.embeddings.dtype == dtype
+    np.testing.assert_array_equal(loaded.embeddings.matrix, quiz.embeddings.matrix)
+    np.testing.assert_array_equal(loaded.embeddings.offsets, quiz.embeddings.offsets)
+    assert loaded.embeddings.max_score_error == quiz.embeddings.max_score_error
+
+    users = np.random.default_rng(1).normal(size=(2, 8)).astype(np.float32)
+    for expected, actual in zip(quiz.embeddings.score(users), loaded.embeddings.score(users)):
+        np.testing.assert_array_equal(expected, actual)
+
+
+@pytest.mark.parametrize("change", [
+    {"source_digest": "digest-2"},
+    {"encoder": "other-encoder"},
+    {"dtype": "float16"},
+])
+def test_stale_header_rejected(tmp_path, change):
+    path, quiz = make_quiz(tmp_path, "float32")
+    embedding_files.write(path, quiz, ENCODER)
+    args = {"source_digest": "digest-1", "encoder": ENCODER, "dtype": "float32", **change}
+    assert embedding_files.load(path, **args) is None
+
+
+def test_corrupt_file_rejected(tmp_path):
+    path = str(tmp_path / "quiz.xlsx")
+    with open(embedding_files.sidecar_path(path), "wb") as f:
+        f.write(b"garbage")
+    assert embedding_files.load(path, "digest-1", ENCODER, "float32") is None
+
+
+@pytest.mark.parametrize("dtype", ["float32", "float16", "int8"])
+def test_quiz_without_references_reused(tmp_path, dtype):
+    path, quiz = make_quiz(tmp_path, dtype, reference_answers=((), ()))
+    assert quiz.embeddings.dtype == dtype
+    embedding_files.write(path, quiz, ENCODER)
+
+    loaded = embedding_files.load(path, "digest-1", ENCODER, dtype)
+    assert loaded is not None
+    scores, indices = loaded.embeddings.score(np.ones((2, 8), dtype=np.float32))
+    assert scores.tolist() == [0.0, 0.0]
+    assert indices.tolist() == [-1, -1]
@@ -0,0 +1,68 @@
+"""Проверки страницы итогов на приложении main (лексический движок, без torch)"""
+
+import importlib
+import os
+import shutil
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope="module")
+def client(tmp_path_factory):
+    from fastapi.testclient import TestClient
+    import settings
+    import session_manager
+
+    # Базы и файлы тестов создаются во временном каталоге, а не в репозитории
+    workdir = tmp_path_factory.mktemp("app")
+    for name in ("templates", "static"):
+        os.symlink(os.path.join(ROOT, name), workdir / name)
+    (workdir / "uploaded_files").mkdir()
+    shutil.copy(os.path.join(ROOT, "uploaded_files", "QuestionsAnswers.xlsx"), workdir / "uploaded_files")
+
+    cwd = os.getcwd()
+    mp = pytest.MonkeyPatch()
+    mp.chdir(workdir)
+    mp.setattr(settings, "ENCODER_BACKEND", "lexical")
+    mp.setattr(settings, "WEB_WORKERS", 1)
+    try:
+        main = importlib.import_module("main")
+        client = TestClient(main.app)
+        client.cookies.set("session_token", session_manager.create_session("student"))
+        yield client
+    finally:
+        mp.undo()
+        os.chdir(cwd)
+
+
+def answer(client, idx, text):
+    response = client.post("/answer", data={"idx": idx, "user_answer": text})
+    assert response.status_code == 200
+
+
+def test_skipped_question_lists_unanswered(client):
+    response = client.post("/select", data={"filename": "QuestionsAnswers.xlsx"}, follow_redirects=False)
+    assert response.status_code == 303
+
+    answer(client, 0, "Париж это столица Франции")
+    answer(client, 2, "тест")
+    answer(client, 3, "саламандра")
+
+    response = client.get("/final_results")
+    assert response.status_code == 200
+    assert "Без ответа остались вопросы: 2" in response.text
+    assert "/quiz?idx=1" in response.text
+
+    # Переход за последний вопрос ведет на ту же страницу, а не к ошибке
+    response = client.post("/navigate", data={"current_idx": 3, "direction": "next"})
+    assert response.status_code == 200
+    assert "Без ответа остались вопросы: 2" in response.text
+
+
+def test_complete_attempt_is_graded(client):
+    answer(client, 1, "Процесс преобразования солнечного света в энергию растениями")
+    response = client.get("/final_results")
+    assert response.status_code == 200
+    assert "Без ответа" not in response.text
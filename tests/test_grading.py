@@ -0,0 +1,25 @@
+"""Проверки точного совпадения ответов"""
+
+from grading import ExactMatchIndex, normalize_answer
+
+
+def test_edge_punctuation_and_case_ignored():
+    assert normalize_answer("  Москва.  ") == "москва"
+    assert normalize_answer("«Да», конечно!") == "да конечно"
+    assert normalize_answer("вода — жидкость") == "вода жидкость"
+
+
+def test_inner_punctuation_kept():
+    assert normalize_answer("-5") == "-5"
+    assert normalize_answer("3.14") == "3.14"
+    assert normalize_answer("x^2-1") == "x^2-1"
+
+
+def test_distinct_answers_do_not_match():
+    index = ExactMatchIndex([["-5"], ["3.14"], ["x^2-1"]])
+    assert index.match(0, "5") is None
+    assert index.match(1, "3 14") is None
+    assert index.match(2, "x^2 1") is None
+    assert index.match(0, "-5.") == 0
+    assert index.match(1, " 3.14 ") == 0
+    assert index.match(2, "X^2-1") == 0
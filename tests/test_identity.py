@@ -0,0 +1,33 @@
+"""Проверки сервиса данных пользователя"""
+
+import time
+from types import SimpleNamespace
+
+import identity
+import session_manager
+from session_manager import SignedSessionBackend
+
+
+def make_request(token):
+    return SimpleNamespace(cookies={"session_token": token}, state=SimpleNamespace())
+
+
+def test_signed_session_permissions_without_profile(tmp_path, monkeypatch):
+    backend = SignedSessionBackend({"k1": b"secret"}, str(tmp_path / "sessions.db"), refresh_interval=0)
+    monkeypatch.setattr(session_manager, "backend", backend)
+
+    def fail(login):
+        raise AssertionError("профиль не должен читаться")
+
+    monkeypatch.setattr(identity, "get_user_full_info", fail)
+    request = make_request(backend.create("petrova", time.time() + 60, "teacher"))
+
+    assert identity.get_user_from_session(request) == "petrova"
+    assert identity.get_request_permissions(request)["can_edit_tests"]
+    assert not identity.get_request_permissions(request)["can_manage_users"]
+
+
+def test_no_session():
+    request = make_request(None)
+    assert identity.get_user_from_session(request) is None
+    assert identity.get_request_permissions(request) is None
@@ -0,0 +1,38 @@
+"""Проверки лексического движка оценки"""
+
+import numpy as np
+
+import settings
+from lexical import LexicalEncoder, agreement, calibration_pairs, corpus_encoder, pair_scores
+
+
+def test_hard_negatives_below_default_threshold():
+    encoder = corpus_encoder(settings.LEXICAL_CORPUS)
+    scores = pair_scores(encoder, [
+        ("Париж это столица Франции", "Берлин это столица Германии"),
+        ("тест", "тесто"),
+        ("Париж это столица Франции", "Париж - столица Франции"),
+        ("тест", "Тест."),
+    ])
+    assert (scores[:2] < settings.LEXICAL_THRESHOLD).all()
+    assert (scores[2:] >= settings.LEXICAL_THRESHOLD).all()
+
+
+def test_idf_downweights_common_words():
+    corpus = ["это столица", "это город", "это река", "это страна"]
+    plain = LexicalEncoder()
+    weighted = LexicalEncoder().fit(corpus)
+    pair = [("это париж", "это берлин")]
+    # Общее слово "это" есть во всем корпусе, и его вклад в сходство падает
+    assert pair_scores(weighted, pair)[0] < pair_scores(plain, pair)[0]
+    # Веса входят в идентификатор, чтобы кэши эмбеддингов не смешивались
+    assert weighted.encoder_id != plain.encoder_id
+
+
+def test_default_threshold_matches_calibration():
+    pairs = calibration_pairs()
+    labels = np.array([label for _, _, label in pairs], dtype=np.float32)
+    scores = pair_scores(corpus_encoder(settings.LEXICAL_CORPUS), [(a, b) for a, b, _ in pairs])
+    report = agreement(labels, scores, 0.5, settings.LEXICAL_THRESHOLD)
+    assert report["agreement"] >= 0.75
+    assert report["precision"] >= 0.7
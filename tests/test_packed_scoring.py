@@ -0,0 +1,58 @@
+"""Проверки упакованной оценки ответов против поштучного сравнения"""
+
+import numpy as np
+
+from grading import PackedEmbeddings, _normalize_rows
+
+
+def naive_scores(references, users, question_indices):
+    """Сходство с каждым эталоном своего вопроса в цикле, как до упаковки"""
+    scores, indices = [], []
+    for user, question in zip(_normalize_rows(users), question_indices):
+        refs = references[question]
+        if len(refs) == 0:
+            scores.append(0.0)
+            indices.append(-1)
+            continue
+        similarities = [float(np.dot(user, ref)) for ref in _normalize_rows(refs)]
+        best = int(np.argmax(similarities))
+        scores.append(similarities[best])
+        indices.append(best)
+    return np.array(scores, dtype=np.float32), np.array(indices)
+
+
+def make_references(counts, dim, seed):
+    rng = np.random.default_rng(seed)
+    return [rng.normal(size=(count, dim)).astype(np.float32) for count in counts]
+
+
+def test_matches_naive_loop_with_empty_questions():
+    counts = [3, 0, 1, 5, 0, 2]
+    references = make_references(counts, dim=16, seed=0)
+    packed = PackedEmbeddings.from_flat(np.concatenate(references), counts)
+    users = np.random.default_rng(1).normal(size=(len(counts), 16)).astype(np.float32)
+
+    scores, indices = packed.score(users)
+    expected_scores, expected_indices = naive_scores(references, users, range(len(counts)))
+    np.testing.assert_allclose(scores, expected_scores, atol=1e-5)
+    np.testing.assert_array_equal(indices, expected_indices)
+
+
+def test_subset_of_questions_in_any_order():
+    counts = [2, 4, 0, 1]
+    references = make_references(counts, dim=8, seed=2)
+    packed = PackedEmbeddings.from_flat(np.concatenate(references), counts)
+    question_indices = [3, 0, 2, 3]
+    users = np.random.default_rng(3).normal(size=(len(question_indices), 8)).astype(np.float32)
+
+    scores, indices = packed.score(users, question_indices)
+    expected_scores, expected_indices = naive_scores(references, users, question_indices)
+    np.testing.assert_allclose(scores, expected_scores, atol=1e-5)
+    np.testing.assert_array_equal(indices, expected_indices)
+
+
+def test_quiz_without_references():
+    packed = PackedEmbeddings.from_flat(np.zeros((0, 0), dtype=np.float32), [0, 0])
+    scores, indices = packed.score(np.ones((2, 4), dtype=np.float32))
+    assert scores.tolist() == [0.0, 0.0]
+    assert indices.tolist() == [-1, -1]
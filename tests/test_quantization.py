@@ -0,0 +1,49 @@
+"""Проверки квантования эталонных эмбеддингов"""
+
+import numpy as np
+import pytest
+
+from grading import PackedEmbeddings, quantize, _normalize_rows
+
+
+def normalized(rows, dim, seed):
+    return _normalize_rows(np.random.default_rng(seed).normal(size=(rows, dim)).astype(np.float32))
+
+
+@pytest.mark.parametrize("dtype", ["float16", "int8"])
+def test_max_score_error_bounds_similarity_drift(dtype):
+    matrix = normalized(200, 64, seed=0)
+    stored, scales, max_score_error = quantize(matrix, dtype)
+    assert stored.dtype == dtype
+    assert 0.0 < max_score_error < (0.01 if dtype == "int8" else 0.001)
+
+    restored = stored.astype(np.float32)
+    if scales is not None:
+        restored *= scales[:, None]
+    queries = normalized(100, 64, seed=1)
+    drift = np.abs(queries @ matrix.T - queries @ restored.T)
+    assert drift.max() <= max_score_error + 1e-6
+
+
+def test_float32_is_exact():
+    matrix = normalized(10, 16, seed=2)
+    stored, scales, max_score_error = quantize(matrix, "float32")
+    assert scales is None and max_score_error == 0.0
+    np.testing.assert_array_equal(stored, matrix)
+
+
+def test_unknown_dtype_rejected():
+    with pytest.raises(ValueError):
+        quantize(normalized(2, 4, seed=3), "int4")
+
+
+@pytest.mark.parametrize("dtype", ["float16", "int8"])
+def test_packed_scores_within_bound(dtype):
+    embeddings = normalized(30, 32, seed=4)
+    counts = [3] * 10
+    exact = PackedEmbeddings.from_flat(embeddings, counts, "float32")
+    compact = PackedEmbeddings.from_flat(embeddings, counts, dtype)
+    users = normalized(10, 32, seed=5)
+    exact_scores, _ = exact.score(users)
+    compact_scores, _ = compact.score(users)
+    assert np.abs(exact_scores - compact_scores).max() <= compact.max_score_error + 1e-6
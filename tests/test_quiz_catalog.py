@@ -0,0 +1,89 @@
+"""Проверки каталога скомпилированных тестов"""
+
+import os
+import threading
+
+import numpy as np
+
+from grading import CompiledQuiz, PackedEmbeddings
+from quiz_catalog import QuizCatalog
+
+
+def make_catalog(max_bytes=1 << 20):
+    compiled = []
+
+    def compiler(path, digest):
+        compiled.append(path)
+        with open(path, encoding="utf-8") as f:
+            answers = [[line.strip()] for line in f if line.strip()]
+        embeddings = PackedEmbeddings.from_flat(np.ones((len(answers), 4), dtype=np.float32), [1] * len(answers))
+        return CompiledQuiz([f"q{i}" for i in range(len(answers))], answers, embeddings, path)
+
+    catalog = QuizCatalog(max_bytes)
+    catalog.set_compiler(compiler)
+    return catalog, compiled
+
+
+def write(path, text, mtime_ns=None):
+    path.write_text(text, encoding="utf-8")
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_unchanged_file_is_compiled_once(tmp_path):
+    catalog, compiled = make_catalog()
+    path = tmp_path / "quiz.txt"
+    write(path, "a\nb\n")
+    first = catalog.get(str(path))
+    assert catalog.get(str(path)) is first
+    assert len(compiled) == 1
+
+
+def test_resaved_file_with_same_content_is_reused(tmp_path):
+    catalog, compiled = make_catalog()
+    path = tmp_path / "quiz.txt"
+    write(path, "a\nb\n", mtime_ns=1_000_000_000)
+    first = catalog.get(str(path))
+    # Изменилось только время модификации - совпадение по хешу содержимого
+    write(path, "a\nb\n", mtime_ns=2_000_000_000)
+    assert catalog.get(str(path)) is first
+    assert len(compiled) == 1
+
+
+def test_changed_content_is_recompiled(tmp_path):
+    catalog, compiled = make_catalog()
+    path = tmp_path / "quiz.txt"
+    write(path, "a\nb\n", mtime_ns=1_000_000_000)
+    first = catalog.get(str(path))
+    write(path, "a\nc\n", mtime_ns=2_000_000_000)
+    second = catalog.get(str(path))
+    assert second is not first
+    assert second.version != first.version
+    assert second.reference_answers == [["a"], ["c"]]
+
+
+def test_invalidate_forces_recompile(tmp_path):
+    catalog, compiled = make_catalog()
+    path = tmp_path / "quiz.txt"
+    write(path, "a\n")
+    catalog.get(str(path))
+    catalog.invalidate(str(path))
+    assert catalog.stats()["quizzes"] == 0
+    catalog.get(str(path))
+    assert len(compiled) == 2
+
+
+def test_compile_locks_are_released(tmp_path):
+    catalog, compiled = make_catalog()
+    paths = []
+    for i in range(5):
+        path = tmp_path / f"quiz{i}.txt"
+        write(path, f"answer {i}\n")
+        paths.append(str(path))
+    threads = [threading.Thread(target=catalog.get, args=(path,)) for path in paths * 3]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(compiled) == 5
+    assert catalog.stats()["compiling"] == 0
@@ -0,0 +1,98 @@
+"""Проверки общего хранилища попыток"""
+
+import numpy as np
+
+from grading import CompiledQuiz, PackedEmbeddings
+from quiz_state import QuizAttempt, SQLiteAttemptStore
+
+
+def make_quiz(version="v1"):
+    embeddings = PackedEmbeddings.from_flat(np.eye(2, dtype=np.float32), [1, 1])
+    quiz = CompiledQuiz(["q1", "q2"], [["a1"], ["a2"]], embeddings, "quiz.xlsx")
+    quiz.version = version
+    return quiz
+
+
+def make_stores(tmp_path, quiz):
+    db_path = str(tmp_path / "sessions.db")
+    # Два хранилища с общей базой - как два воркера
+    return [SQLiteAttemptStore(db_path, 100, 3600, lambda source: quiz) for _ in range(2)]
+
+
+def test_attempt_visible_to_other_worker(tmp_path):
+    first, second = make_stores(tmp_path, make_quiz())
+    attempt = first.start("token", make_quiz())
+    attempt.set_answer(0, "один")
+    first.save_answer("token", 0, "один")
+
+    other = second.get("token")
+    assert other is not None
+    assert other.answers == ["один", ""]
+
+    other.set_answer(1, "два")
+    second.save_answer("token", 1, "два")
+    assert first.get("token").answers == ["один", "два"]
+    assert first.get("token").is_complete()
+
+
+def test_concurrent_saves_keep_both_answers(tmp_path):
+    first, second = make_stores(tmp_path, make_quiz())
+    first.start("token", make_quiz())
+    second.get("token")
+    first.save_answer("token", 0, "один")
+    second.save_answer("token", 1, "два")
+    assert second.get("token").answers == ["один", "два"]
+
+
+def test_changed_quiz_ends_attempt(tmp_path):
+    first, second = make_stores(tmp_path, make_quiz("v2"))
+    first.start("token", make_quiz("v1"))
+    assert second.get("token") is None
+    assert first.get("token") is None
+
+
+def test_remove(tmp_path):
+    first, second = make_stores(tmp_path, make_quiz())
+    first.start("token", make_quiz())
+    second.remove("token")
+    assert first.get("token") is None
+    assert first.stats()["attempts"] == 0
+
+
+def graded_attempt():
+    attempt = QuizAttempt(make_quiz())
+    attempt.set_answer(0, "один")
+    attempt.set_answer(1, "два")
+    attempt.store_results(attempt.fingerprint(), {"correct": 2})
+    return attempt
+
+
+def test_results_memoized_until_answer_changes():
+    attempt = graded_attempt()
+    assert attempt.cached_results() == {"correct": 2}
+
+    # Тот же ответ не меняет лист ответов и итоги не сбрасывает
+    attempt.set_answer(0, "один")
+    assert attempt.cached_results() == {"correct": 2}
+
+    attempt.set_answer(0, "три")
+    assert attempt.cached_results() is None
+    # Возврат прежнего ответа восстанавливает отпечаток, но итоги уже сброшены
+    attempt.set_answer(0, "один")
+    assert attempt.cached_results() is None
+
+
+def test_results_invalidated_by_quiz_version():
+    attempt = graded_attempt()
+    attempt.quiz = make_quiz("v2")
+    assert attempt.cached_results() is None
+
+
+def test_stale_results_not_stored():
+    attempt = QuizAttempt(make_quiz())
+    attempt.set_answer(0, "один")
+    fingerprint = attempt.fingerprint()
+    # Ответ изменился, пока шла проверка
+    attempt.set_answer(0, "два")
+    attempt.store_results(fingerprint, {"correct": 1})
+    assert attempt.cached_results() is None
@@ -0,0 +1,55 @@
+"""Проверки перезапуска воркеров главным процессом"""
+
+import time
+
+import serve
+
+
+def failing_worker(*args):
+    raise RuntimeError("ошибка при запуске")
+
+
+def test_master_stops_after_repeated_startup_failures(monkeypatch):
+    monkeypatch.setattr(serve, "_run_worker", failing_worker)
+    # Обработчики сигналов и gc.freeze главного процесса не нужны в процессе pytest
+    monkeypatch.setattr(serve.signal, "signal", lambda *args: None)
+    monkeypatch.setattr(serve.gc, "freeze", lambda: None)
+
+    master = serve.Master(None, None, workers=2, max_requests=0, graceful_timeout=1.0,
+                          min_uptime=5.0, max_failures=4)
+    spawned = []
+    spawn = master.spawn
+    monkeypatch.setattr(master, "spawn", lambda: spawned.append(spawn()) or spawned[-1])
+
+    started = time.monotonic()
+    assert master.run() == 1
+    elapsed = time.monotonic() - started
+
+    # Замены запускаются с задержкой 0.5, 1, 2 с, а не в цикле
+    assert len(spawned) == 4
+    assert 1.0 <= elapsed < 10.0
+    assert not master.children
+
+
+def test_clean_exits_respawned_without_backoff(monkeypatch):
+    # Воркер, отработавший лимит запросов, завершается с кодом 0
+    monkeypatch.setattr(serve, "_run_worker", lambda *args: None)
+    monkeypatch.setattr(serve.signal, "signal", lambda *args: None)
+    monkeypatch.setattr(serve.gc, "freeze", lambda: None)
+
+    master = serve.Master(None, None, workers=1, max_requests=0, graceful_timeout=1.0,
+                          min_uptime=5.0, max_failures=2)
+    spawned = []
+    spawn = master.spawn
+
+    def counting_spawn():
+        spawned.append(spawn())
+        if len(spawned) == 5:
+            master.stopping = True
+        return spawned[-1]
+
+    monkeypatch.setattr(master, "spawn", counting_spawn)
+    started = time.monotonic()
+    assert master.run() == 0
+    assert master.failures == 0
+    assert time.monotonic() - started < 5.0
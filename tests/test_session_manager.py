@@ -0,0 +1,39 @@
+"""Проверки подписанных токенов сессий"""
+
+import time
+
+import pytest
+
+from session_manager import SignedSessionBackend
+
+
+@pytest.fixture
+def signed(tmp_path):
+    return SignedSessionBackend({"k1": b"secret"}, str(tmp_path / "sessions.db"), refresh_interval=0)
+
+
+def test_signed_token_roundtrip(signed):
+    token = signed.create("ivanov", time.time() + 60, "teacher")
+    claims = signed.claims(token)
+    assert claims["sub"] == "ivanov"
+    assert claims["typ"] == "teacher"
+
+
+def test_tampered_signature_rejected(signed):
+    token = signed.create("ivanov", time.time() + 60)
+    payload, _, signature = token.partition(".")
+    assert signed.claims(f"{payload}.{signature[:-1]}A") is None
+
+
+def test_non_ascii_token_rejected(signed):
+    # Starlette декодирует cookie как latin-1: такой токен не должен приводить к ошибке 500
+    token = signed.create("ivanov", time.time() + 60)
+    payload = token.partition(".")[0]
+    assert signed.claims(payload + ".é") is None
+    assert signed.claims(token + "é") is None
+    assert signed.get(payload + ".é") is None
+
+
+def test_signing_keys_required(tmp_path):
+    with pytest.raises(ValueError):
+        SignedSessionBackend({}, str(tmp_path / "sessions.db"), refresh_interval=0)
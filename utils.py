@@ -1,9 +1,22 @@
 import pandas as pd
 import ast
+import re
 from openpyxl import load_workbook, Workbook
 from openpyxl.utils.dataframe import dataframe_to_rows
 import os
 
+def parse_quoted_strings(s):
+    """Парсит строку с ответами в кавычках, разделенных запятыми"""
+    return [m.group(1) for m in re.finditer(r'"([^"]*)"', s)]
+
+def read_quiz_file(file_path):
+    """Читает вопросы и эталонные ответы из файла теста"""
+    df = pd.read_excel(file_path, engine='openpyxl', usecols=[0,1], header=None, names=['q','a'])
+    
+    questions = df['q'].astype(str).tolist()
+    reference_answers = [parse_quoted_strings(answers_str) for answers_str in df['a'].astype(str)]
+    return questions, reference_answers
+
 def parse_answers(answers_str):
     """Парсит строку с ответами в список"""
     if pd.isna(answers_str):